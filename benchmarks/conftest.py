@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from des_archive_access.dbfiles import get_des_archive_access_db_conn
+from des_archive_access.testing.synthetic_db import make_synthetic_metadata_db
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory):
+    """A synthetic metadata DB whose size is set by the number of exposures in
+    the environment variable DES_ARCHIVE_ACCESS_BENCH_NEXP."""
+    nexp = int(os.environ.get("DES_ARCHIVE_ACCESS_BENCH_NEXP", "200"))
+    dbloc = make_synthetic_metadata_db(
+        str(tmp_path_factory.mktemp("synthetic_db") / "metadata.db"),
+        nexp=nexp,
+    )
+
+    old_db = os.environ.get("DES_ARCHIVE_ACCESS_DB", None)
+    os.environ["DES_ARCHIVE_ACCESS_DB"] = dbloc
+    get_des_archive_access_db_conn.cache_clear()
+    try:
+        yield dbloc
+    finally:
+        get_des_archive_access_db_conn().close()
+        get_des_archive_access_db_conn.cache_clear()
+        if old_db is None:
+            del os.environ["DES_ARCHIVE_ACCESS_DB"]
+        else:
+            os.environ["DES_ARCHIVE_ACCESS_DB"] = old_db
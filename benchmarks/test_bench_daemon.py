@@ -0,0 +1,43 @@
+import os
+import subprocess
+
+import pytest
+
+from des_archive_access.daemon import start_daemon, stop_daemon
+
+QUERY = (
+    "select i.filename, fai.path from y6a2_image i "
+    "join y6a2_file_archive_info fai on i.filename = fai.filename "
+    "where i.expnum = 226007"
+)
+
+
+@pytest.fixture(scope="module")
+def daemon_env(synthetic_db, tmp_path_factory):
+    old_daad = os.environ.get("DES_ARCHIVE_ACCESS_DIR", None)
+    os.environ["DES_ARCHIVE_ACCESS_DIR"] = str(tmp_path_factory.mktemp("daad"))
+    try:
+        yield dict(os.environ)
+    finally:
+        stop_daemon()
+        if old_daad is None:
+            del os.environ["DES_ARCHIVE_ACCESS_DIR"]
+        else:
+            os.environ["DES_ARCHIVE_ACCESS_DIR"] = old_daad
+
+
+@pytest.mark.parametrize("daemon", ["off", "on"])
+def test_bench_daemon_command(benchmark, daemon_env, daemon):
+    env = dict(daemon_env)
+    env["DES_ARCHIVE_ACCESS_DAEMON"] = daemon
+    if daemon == "on":
+        start_daemon()
+    else:
+        stop_daemon()
+
+    benchmark.pedantic(
+        subprocess.run,
+        args=(["des-archive-access", "-c", QUERY],),
+        kwargs={"check": True, "capture_output": True, "env": env},
+        rounds=20,
+    )
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from des_archive_access.testing.archive_server import (
+    MockArchiveServer,
+    make_mock_archive,
+)
+
+NFILES = 20
+FILE_SIZE = 1024 * 1024
+TOKEN = "bench-token"
+
+# curl config to retry failed transfers, read from $CURL_HOME/.curlrc
+RETRY_CURLRC = """\
+retry = 10
+retry-delay = 1
+retry-all-errors
+"""
+
+# the keyword arguments for the server and whether curl retries
+SCENARIOS = {
+    "fast": ({}, False),
+    "latency": ({"latency": 0.05}, False),
+    "bandwidth": ({"bandwidth": 20 * 1024 * 1024}, False),
+    "errors": ({"error_rate": 0.1, "seed": 1}, True),
+    "drops": ({"drop_rate": 0.1, "seed": 1}, True),
+}
+
+
+def _md5(fpth):
+    with open(fpth, "rb") as fp:
+        return hashlib.md5(fp.read()).hexdigest()
+
+
+@pytest.fixture(scope="module")
+def mock_archive(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("archive"))
+    paths = [
+        "OPS/finalcut/Y6A1/20181129-r4056/D%08d/p01/red/immask/"
+        "D%08d_r_c%02d_r4056p01_immasked.fits.fz" % (797980 + i, 797980 + i, i % 62)
+        for i in range(NFILES)
+    ]
+    make_mock_archive(root, paths, size=FILE_SIZE)
+    md5s = {path: _md5(os.path.join(root, path)) for path in paths}
+
+    daad = str(tmp_path_factory.mktemp("daad"))
+    with open(os.path.join(daad, "bearer_token"), "w") as fp:
+        fp.write(TOKEN)
+    with open(os.path.join(daad, ".curlrc"), "w") as fp:
+        fp.write(RETRY_CURLRC)
+
+    list_file = os.path.join(root, "files.txt")
+    with open(list_file, "w") as fp:
+        fp.write("\n".join(paths) + "\n")
+
+    return root, daad, list_file, md5s
+
+
+def _download_list(server, daad, list_file, desdata, retry):
+    env = dict(os.environ)
+    env["DES_ARCHIVE_ACCESS_DIR"] = daad
+    if retry:
+        env["CURL_HOME"] = daad
+    subprocess.run(
+        [
+            "des-archive-access-download",
+            "--no-refresh-token",
+            "-a",
+            server.url,
+            "-d",
+            desdata,
+            "--list",
+            list_file,
+        ],
+        check=True,
+        capture_output=True,
+        env=env,
+    )
+
+
+def _check_and_report(benchmark, server, desdata, md5s):
+    for path, md5 in md5s.items():
+        assert _md5(os.path.join(desdata, path)) == md5, path
+
+    # there are no timings to report when the benchmarks run as plain tests
+    # with --benchmark-disable
+    if benchmark.disabled or benchmark.stats is None:
+        return
+    benchmark.extra_info.update(server.stats)
+    benchmark.extra_info["MB/s"] = (
+        len(md5s) * FILE_SIZE / benchmark.stats.stats.mean / 1e6
+    )
+
+
+@pytest.mark.parametrize("scenario", list(SCENARIOS))
+def test_bench_download_list(benchmark, mock_archive, tmpdir, scenario):
+    root, daad, list_file, md5s = mock_archive
+    server_kwargs, retry = SCENARIOS[scenario]
+    desdata = os.path.join(tmpdir, "DESDATA")
+
+    def _setup():
+        shutil.rmtree(desdata, ignore_errors=True)
+
+    with MockArchiveServer(root, token=TOKEN, **server_kwargs) as server:
+        benchmark.pedantic(
+            _download_list,
+            args=(server, daad, list_file, desdata, retry),
+            setup=_setup,
+            rounds=3,
+        )
+        _check_and_report(benchmark, server, desdata, md5s)
+
+
+def test_bench_download_list_resume(benchmark, mock_archive, tmpdir):
+    root, daad, list_file, md5s = mock_archive
+    desdata = os.path.join(tmpdir, "DESDATA")
+
+    def _setup():
+        # every file is half downloaded
+        shutil.rmtree(desdata, ignore_errors=True)
+        for path in md5s:
+            fpth = os.path.join(desdata, path)
+            os.makedirs(os.path.dirname(fpth), exist_ok=True)
+            with open(os.path.join(root, path), "rb") as ifp, open(fpth, "wb") as ofp:
+                ofp.write(ifp.read(FILE_SIZE // 2))
+
+    # a disabled benchmark runs once
+    rounds = 1 if benchmark.disabled else 3
+    with MockArchiveServer(root, token=TOKEN) as server:
+        benchmark.pedantic(
+            _download_list,
+            args=(server, daad, list_file, desdata, False),
+            setup=_setup,
+            rounds=rounds,
+        )
+        assert server.stats["ranges"] == rounds * len(md5s)
+        _check_and_report(benchmark, server, desdata, md5s)
+
+
+def test_bench_download_list_complete(benchmark, mock_archive, tmpdir):
+    root, daad, list_file, md5s = mock_archive
+    desdata = os.path.join(tmpdir, "DESDATA")
+
+    with MockArchiveServer(root, token=TOKEN) as server:
+        _download_list(server, daad, list_file, desdata, False)
+        nbytes = server.stats["bytes"]
+        nreq = server.stats["requests"]
+        benchmark.pedantic(
+            _download_list,
+            args=(server, daad, list_file, desdata, False),
+            rounds=3,
+        )
+        # files that are already complete are cache hits with no requests
+        assert server.stats["bytes"] == nbytes
+        assert server.stats["requests"] == nreq
+        _check_and_report(benchmark, server, desdata, md5s)
@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+from des_archive_access.joins import JOINS_SCHEMA, build_joins
+
+QUERY = (
+    "select i.filename, fai.path || '/' || fai.filename || "
+    "coalesce(fai.compression, '') "
+    "from y6a2_image i "
+    "join y6a2_file_archive_info fai on fai.filename = i.filename "
+    "where fai.archive_name = 'desar2home' and i.band = 'r' "
+    "and i.filetype = 'red_immask'"
+)
+
+
+@pytest.fixture(scope="module")
+def joins_db(synthetic_db, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("joins") / "joins.db")
+    build_joins(path=path)
+    return path
+
+
+def test_bench_image_paths_join(benchmark, synthetic_db):
+    """The join of the images to their archive paths run on every query."""
+    conn = sqlite3.connect(f"file:{synthetic_db}?mode=ro", uri=True)
+    try:
+        result = benchmark(lambda: conn.execute(QUERY).fetchall())
+    finally:
+        conn.close()
+    assert len(result) > 0
+
+
+def test_bench_image_paths_materialised(benchmark, synthetic_db, joins_db):
+    conn = sqlite3.connect(f"file:{synthetic_db}?mode=ro", uri=True)
+    conn.execute("attach database ? as %s" % JOINS_SCHEMA, (joins_db,))
+    try:
+        result = benchmark(
+            lambda: conn.execute(
+                "select filename, archive_path from joins.image_paths "
+                "where band = 'r' and filetype = 'red_immask'"
+            ).fetchall()
+        )
+    finally:
+        conn.close()
+    assert len(result) > 0
+
+
+def test_bench_build_joins(benchmark, synthetic_db, tmpdir):
+    benchmark.pedantic(
+        build_joins,
+        kwargs={"path": str(tmpdir / "joins.db"), "force": True},
+        rounds=3,
+    )
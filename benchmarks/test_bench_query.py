@@ -0,0 +1,131 @@
+import contextlib
+import os
+import sqlite3
+
+import pytest
+
+from des_archive_access.dbfiles import get_des_archive_access_db_conn
+from des_archive_access.sql import parse_and_execute_query
+
+PATH_SQL = (
+    "select fai.path || '/' || fai.filename || coalesce(fai.compression, '') "
+    "from y6a2_file_archive_info fai "
+)
+
+
+def _quiet(func, *args, **kwargs):
+    with open(os.devnull, "w") as fp, contextlib.redirect_stdout(fp):
+        func(*args, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "select band, expnum, ccdnum, filename from y6a2_image limit 10",
+        "select band, expnum, ccdnum, filename from y6a2_image",
+        "select i.filename, fai.path from y6a2_image i, y6a2_file_archive_info fai "
+        "where i.filename = fai.filename and i.band = 'r'",
+    ],
+    ids=["limit", "all", "join"],
+)
+def test_bench_print_query(benchmark, synthetic_db, query):
+    benchmark(_quiet, parse_and_execute_query, query)
+
+
+def test_bench_write_fits(benchmark, synthetic_db, tmpdir):
+    fname = os.path.join(tmpdir, "images.fits")
+    benchmark(
+        _quiet,
+        parse_and_execute_query,
+        "select band, expnum, ccdnum, filename, ra_cent, dec_cent "
+        "from y6a2_image where filetype = 'red_immask'; > " + fname,
+    )
+    assert os.path.exists(fname)
+
+
+def _cold_query():
+    get_des_archive_access_db_conn.cache_clear()
+    conn = get_des_archive_access_db_conn()
+    try:
+        conn.execute("select count(*) from y6a2_image where band = 'r'").fetchall()
+    finally:
+        conn.close()
+        get_des_archive_access_db_conn.cache_clear()
+
+
+def test_bench_connection_cold(benchmark, synthetic_db):
+    benchmark(_cold_query)
+
+
+@pytest.mark.parametrize(
+    "pragmas",
+    [
+        [],
+        ["pragma mmap_size = 268435456"],
+        ["pragma cache_size = -262144"],
+        ["pragma mmap_size = 268435456", "pragma cache_size = -262144"],
+    ],
+    ids=["default", "mmap", "cache", "mmap+cache"],
+)
+def test_bench_connection_profile(benchmark, synthetic_db, pragmas):
+    conn = sqlite3.connect(f"file:{synthetic_db}?mode=ro", uri=True)
+    try:
+        for pragma in pragmas:
+            conn.execute(pragma)
+        benchmark(
+            lambda: conn.execute(
+                "select i.filename, fai.path from y6a2_image i "
+                "join y6a2_file_archive_info fai on i.filename = fai.filename "
+                "where i.band = 'g'"
+            ).fetchall()
+        )
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope="module")
+def filenames_to_resolve(synthetic_db):
+    conn = sqlite3.connect(f"file:{synthetic_db}?mode=ro", uri=True)
+    try:
+        return [
+            row[0]
+            for row in conn.execute(
+                "select filename from y6a2_image "
+                "where filetype = 'red_immask' order by random() limit 1000"
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def test_bench_path_resolution_per_file(benchmark, synthetic_db, filenames_to_resolve):
+    conn = get_des_archive_access_db_conn()
+
+    def _resolve():
+        return [
+            conn.execute(PATH_SQL + "where fai.filename = ?", (fname,)).fetchone()[0]
+            for fname in filenames_to_resolve
+        ]
+
+    paths = benchmark(_resolve)
+    assert len(paths) == len(filenames_to_resolve)
+
+
+def test_bench_path_resolution_bulk(benchmark, synthetic_db, filenames_to_resolve):
+    conn = get_des_archive_access_db_conn()
+
+    def _resolve():
+        conn.execute("create temp table if not exists _fnames (filename text)")
+        conn.execute("delete from _fnames")
+        conn.executemany(
+            "insert into _fnames values (?)", [(f,) for f in filenames_to_resolve]
+        )
+        return [
+            row[0]
+            for row in conn.execute(
+                PATH_SQL + "join _fnames f on f.filename = fai.filename"
+            )
+        ]
+
+    paths = benchmark(_resolve)
+    assert len(paths) == len(filenames_to_resolve)
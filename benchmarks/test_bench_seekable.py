@@ -0,0 +1,93 @@
+import os
+import sqlite3
+
+import pytest
+
+from des_archive_access.seekable import connect_seekable_db, make_seekable_db
+
+QUERIES = {
+    "point": "select * from y6a2_image where filename = ?",
+    "scan": "select band, count(*) from y6a2_image group by band",
+    "join": "select i.filename, fai.path from y6a2_image i, y6a2_file_archive_info fai "
+    "where i.filename = fai.filename and i.expnum = 226007",
+}
+
+
+@pytest.fixture(scope="module", params=[64 * 1024, 256 * 1024, 1024 * 1024])
+def seekable_db(request, synthetic_db, tmp_path_factory):
+    pytest.importorskip("apsw")
+    frame_size = request.param
+    dst = str(tmp_path_factory.mktemp("seekable") / "metadata.db.zst")
+    make_seekable_db(synthetic_db, dst, frame_size=frame_size)
+    return dst, frame_size
+
+
+def _params(conn, name):
+    if name == "point":
+        return conn.execute(
+            "select filename from y6a2_image limit 1 offset 1000"
+        ).fetchone()
+    return ()
+
+
+@pytest.mark.parametrize("name", list(QUERIES))
+@pytest.mark.parametrize("cache", ["cold", "warm"])
+def test_bench_query_raw(benchmark, synthetic_db, name, cache):
+    def _run(conn):
+        return conn.execute(QUERIES[name], _params(conn, name)).fetchall()
+
+    if cache == "warm":
+        conn = sqlite3.connect(f"file:{synthetic_db}?mode=ro", uri=True)
+        try:
+            benchmark(_run, conn)
+        finally:
+            conn.close()
+    else:
+
+        def _cold():
+            conn = sqlite3.connect(f"file:{synthetic_db}?mode=ro", uri=True)
+            try:
+                _run(conn)
+            finally:
+                conn.close()
+
+        benchmark(_cold)
+
+
+@pytest.mark.parametrize("name", list(QUERIES))
+@pytest.mark.parametrize("cache", ["cold", "warm"])
+def test_bench_query_seekable(benchmark, synthetic_db, seekable_db, name, cache):
+    dst, frame_size = seekable_db
+    benchmark.extra_info["frame_size"] = frame_size
+    benchmark.extra_info["compression_ratio"] = os.path.getsize(
+        synthetic_db
+    ) / os.path.getsize(dst)
+
+    def _run(conn):
+        return conn.execute(QUERIES[name], _params(conn, name)).fetchall()
+
+    if cache == "warm":
+        conn = connect_seekable_db(dst)
+        try:
+            benchmark(_run, conn)
+        finally:
+            conn.close()
+    else:
+
+        def _cold():
+            conn = connect_seekable_db(dst)
+            try:
+                _run(conn)
+            finally:
+                conn.close()
+
+        benchmark(_cold)
+
+
+def test_bench_make_seekable_db(benchmark, synthetic_db, tmpdir):
+    pytest.importorskip("apsw")
+    dst = os.path.join(tmpdir, "metadata.db.zst")
+    benchmark.pedantic(make_seekable_db, args=(synthetic_db, dst), rounds=3)
+    benchmark.extra_info["compression_ratio"] = os.path.getsize(
+        synthetic_db
+    ) / os.path.getsize(dst)
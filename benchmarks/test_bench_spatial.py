@@ -0,0 +1,59 @@
+import sqlite3
+
+import pytest
+
+from des_archive_access.spatial import build_spatial_index, cone, tiles_overlapping
+
+# a cone around the center of one of the synthetic exposures
+RADIUS = 0.5
+
+
+@pytest.fixture(scope="module")
+def spatial_index(synthetic_db, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("spatial") / "spatial.db")
+    build_spatial_index(path=path)
+    conn = sqlite3.connect(synthetic_db)
+    try:
+        ra, dec = conn.execute(
+            "select ra_cent, dec_cent from y6a2_image limit 1 offset 1000"
+        ).fetchone()
+    finally:
+        conn.close()
+    return path, ra, dec
+
+
+def test_bench_cone_range_scan(benchmark, synthetic_db, spatial_index):
+    """A cone search with range predicates on the image centers, which is what
+    queries had to do before the spatial index."""
+    _, ra, dec = spatial_index
+    conn = sqlite3.connect(f"file:{synthetic_db}?mode=ro", uri=True)
+    try:
+        benchmark(
+            lambda: conn.execute(
+                "select filename from y6a2_image "
+                "where ra_cent between ? and ? and dec_cent between ? and ?",
+                (ra - RADIUS, ra + RADIUS, dec - RADIUS, dec + RADIUS),
+            ).fetchall()
+        )
+    finally:
+        conn.close()
+
+
+def test_bench_cone_rtree(benchmark, synthetic_db, spatial_index):
+    path, ra, dec = spatial_index
+    result = benchmark(cone, ra, dec, RADIUS, path=path)
+    assert len(result) > 0
+
+
+def test_bench_tiles_overlapping(benchmark, synthetic_db, spatial_index):
+    path, ra, dec = spatial_index
+    result = benchmark(tiles_overlapping, ra, dec, RADIUS, path=path)
+    assert len(result) > 0
+
+
+def test_bench_build_spatial_index(benchmark, synthetic_db, tmpdir):
+    benchmark.pedantic(
+        build_spatial_index,
+        kwargs={"path": str(tmpdir / "spatial.db"), "force": True},
+        rounds=3,
+    )
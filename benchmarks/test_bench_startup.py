@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+CONSOLE_SCRIPTS = [
+    "des-archive-access-download",
+    "des-archive-access-download-metadata",
+    "des-archive-access-make-token",
+    "des-archive-access-sync-tile-data",
+    "des-archive-access",
+]
+
+
+def _run(cmd, env=None):
+    subprocess.run(cmd, check=True, capture_output=True, env=env)
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "des_archive_access",
+        "des_archive_access.cli",
+        "des_archive_access.repl",
+        "des_archive_access.sql",
+    ],
+)
+def test_bench_import(benchmark, module):
+    benchmark.pedantic(
+        _run, args=([sys.executable, "-c", f"import {module}"],), rounds=10
+    )
+
+
+@pytest.mark.parametrize("script", CONSOLE_SCRIPTS)
+def test_bench_startup_help(benchmark, script):
+    benchmark.pedantic(_run, args=([script, "--help"],), rounds=10)
+
+
+def test_bench_startup_command(benchmark, tmpdir):
+    dbloc = os.path.join(tmpdir, "metadata.db")
+    conn = sqlite3.connect(dbloc)
+    conn.execute("create table y6a2_image (band text, filename text)")
+    conn.execute("insert into y6a2_image values ('r', 'D00792065_r_c17.fits')")
+    conn.commit()
+    conn.close()
+
+    env = dict(os.environ)
+    env["DES_ARCHIVE_ACCESS_DB"] = dbloc
+    benchmark.pedantic(
+        _run,
+        args=(["des-archive-access", "-c", "select * from y6a2_image"],),
+        kwargs={"env": env},
+        rounds=10,
+    )
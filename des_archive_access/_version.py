@@ -0,0 +1 @@
+__version__ = "0.1.dev20+g4e33bf058.d20261019"
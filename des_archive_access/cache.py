@@ -0,0 +1,284 @@
+"""Manage DESDATA as a cache of archive files with a size cap.
+
+An index in DESDATA records the size and last use of each file downloaded with
+`download_file`. Asking for a file that is in the index is an index hit that
+needs no network access. If the environment variable
+DES_ARCHIVE_ACCESS_CACHE_SIZE sets a size cap (e.g., "500G"), the least
+recently used files are evicted to make space before each download and to get
+back under the cap after it. Pinned files are never evicted.
+
+Files that were already in DESDATA can be added to the index with
+`DesdataCache.scan`. Since they may be partial downloads, they are only used
+once their size matches the size in the metadata DB and are otherwise
+downloaded again, resuming from where they stopped.
+"""
+
+import os
+import re
+import sqlite3
+import time
+
+CACHE_INDEX_NAME = ".des_archive_access_cache.db"
+
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+_SCHEMA = """\
+create table if not exists files (
+    path text primary key,
+    size integer not null,
+    last_used real not null,
+    pinned integer not null default 0,
+    verified integer not null default 1
+);
+create index if not exists files_last_used_idx on files (pinned, last_used);
+"""
+
+
+def parse_size(size):
+    """Parse a size like "500G", "1.5T" or "1000000" into bytes.
+
+    The units K, M, G and T are powers of 1024 and can be followed by "B" or
+    "iB".
+    """
+    m = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)(?:I?B)?\s*", str(size).upper())
+    if m is None:
+        raise ValueError(f"Could not parse the size '{size}'!")
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+
+def format_size(nbytes):
+    """Format a number of bytes for humans."""
+    for unit in ["", "K", "M", "G"]:
+        if abs(nbytes) < 1024:
+            return f"{nbytes:.1f}{unit}B" if unit else f"{nbytes}B"
+        nbytes /= 1024
+    return f"{nbytes:.1f}TB"
+
+
+def get_cache_size_cap():
+    """Get the DESDATA cache size cap in bytes from the environment variable
+    DES_ARCHIVE_ACCESS_CACHE_SIZE or None if there is no cap."""
+    val = os.environ.get("DES_ARCHIVE_ACCESS_CACHE_SIZE", None)
+    if val is None or not val.strip():
+        return None
+    return parse_size(val)
+
+
+def _expected_size(fname):
+    """Get the size of the archive file `fname` from the metadata DB or None
+    if it is not known."""
+    from des_archive_access.dbfiles import connect_des_archive_access_db
+
+    filename = os.path.basename(fname)
+    try:
+        conn = connect_des_archive_access_db()
+        try:
+            for compression in ("", ".fz", ".gz"):
+                if compression and not filename.endswith(compression):
+                    continue
+                row = conn.execute(
+                    "select filesize from y6a2_file_archive_info "
+                    "where filename = ? and coalesce(compression, '') = ?",
+                    (filename[: len(filename) - len(compression)], compression),
+                ).fetchone()
+                if row is not None:
+                    return row[0]
+        finally:
+            conn.close()
+    except Exception:
+        pass
+    return None
+
+
+class DesdataCache:
+    """The cache index of a DESDATA directory.
+
+    Parameters
+    ----------
+    desdata : str
+        The DESDATA directory.
+    size_cap : int, optional
+        The maximum total size in bytes of the indexed files. The default
+        comes from `get_cache_size_cap`.
+    """
+
+    def __init__(self, desdata, size_cap=None):
+        self.desdata = desdata
+        self.size_cap = get_cache_size_cap() if size_cap is None else size_cap
+        self.index_path = os.path.join(desdata, CACHE_INDEX_NAME)
+        os.makedirs(desdata, exist_ok=True)
+        self._conn = sqlite3.connect(self.index_path, timeout=60)
+        self._conn.executescript(_SCHEMA)
+        columns = [row[1] for row in self._conn.execute("pragma table_info(files)")]
+        if "verified" not in columns:
+            with self._conn:
+                self._conn.execute(
+                    "alter table files "
+                    "add column verified integer not null default 1"
+                )
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _fpth(self, fname):
+        return os.path.join(self.desdata, fname)
+
+    def lookup(self, fname):
+        """Get the local path of the archive file `fname` if it is in the
+        cache, marking it as used, or None.
+
+        Files that were removed or changed behind the cache's back, and scanned
+        files whose size does not match the metadata DB, are dropped from the
+        index.
+        """
+        row = self._conn.execute(
+            "select size, verified from files where path = ?", (fname,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        fpth = self._fpth(fname)
+        size, verified = row
+        with self._conn:
+            if (
+                not os.path.exists(fpth)
+                or os.path.getsize(fpth) != size
+                or (not verified and _expected_size(fname) != size)
+            ):
+                self._conn.execute("delete from files where path = ?", (fname,))
+                return None
+            self._conn.execute(
+                "update files set last_used = ?, verified = 1 where path = ?",
+                (time.time(), fname),
+            )
+        return fpth
+
+    def add(self, fname, pinned=False):
+        """Add the downloaded archive file `fname` to the index."""
+        size = os.path.getsize(self._fpth(fname))
+        with self._conn:
+            self._conn.execute(
+                "insert into files (path, size, last_used, pinned, verified) "
+                "values (?, ?, ?, ?, 1) "
+                "on conflict (path) do update set size = excluded.size, "
+                "last_used = excluded.last_used, "
+                "pinned = max(pinned, excluded.pinned), verified = 1",
+                (fname, size, time.time(), int(pinned)),
+            )
+
+    def remove(self, fname):
+        """Remove the archive file `fname` from the cache and from disk."""
+        with self._conn:
+            self._conn.execute("delete from files where path = ?", (fname,))
+        try:
+            os.remove(self._fpth(fname))
+        except FileNotFoundError:
+            pass
+
+    def total_size(self):
+        """Get the total size in bytes of the files in the cache."""
+        return self._conn.execute(
+            "select coalesce(sum(size), 0) from files"
+        ).fetchone()[0]
+
+    def evict(self, nbytes=0, size_cap=None, keep=()):
+        """Evict least recently used, unpinned files until `nbytes` more bytes
+        fit under the size cap.
+
+        Parameters
+        ----------
+        nbytes : int, optional
+            The number of bytes to make space for.
+        size_cap : int, optional
+            The size cap in bytes to use instead of the cache's. If neither is
+            set, nothing is evicted.
+        keep : sequence of str, optional
+            Archive files that must not be evicted.
+
+        Returns
+        -------
+        evicted : list of str
+            The archive files that were evicted.
+        """
+        size_cap = self.size_cap if size_cap is None else size_cap
+        if size_cap is None:
+            return []
+
+        excess = self.total_size() + nbytes - size_cap
+        evicted = []
+        if excess <= 0:
+            return evicted
+
+        rows = self._conn.execute(
+            "select path, size from files where pinned = 0 order by last_used"
+        ).fetchall()
+        for fname, size in rows:
+            if excess <= 0:
+                break
+            if fname in keep:
+                continue
+            self.remove(fname)
+            evicted.append(fname)
+            excess -= size
+        return evicted
+
+    def set_pinned(self, pattern, pinned=True):
+        """Pin (or unpin) the files in the cache matching the glob `pattern`,
+        returning the number of files changed.
+
+        Pinned files are never evicted.
+        """
+        with self._conn:
+            return self._conn.execute(
+                "update files set pinned = ? where path glob ?", (int(pinned), pattern)
+            ).rowcount
+
+    def scan(self):
+        """Add any files in DESDATA that are not in the index, returning the
+        number of files added.
+
+        The files are added with their modification times as their last use.
+        They may be partial downloads, so they are marked as unverified until
+        `lookup` finds that their size matches the metadata DB.
+        """
+        known = {row[0] for row in self._conn.execute("select path from files")}
+        rows = []
+        for dirpath, _, fnames in os.walk(self.desdata):
+            for name in fnames:
+                fpth = os.path.join(dirpath, name)
+                fname = os.path.relpath(fpth, self.desdata)
+                if fname.startswith(CACHE_INDEX_NAME) or fname in known:
+                    continue
+                st = os.stat(fpth)
+                rows.append((fname, st.st_size, st.st_mtime))
+        with self._conn:
+            self._conn.executemany(
+                "insert or ignore into files (path, size, last_used, verified) "
+                "values (?, ?, ?, 0)",
+                rows,
+            )
+        return len(rows)
+
+    def files(self, pinned_only=False):
+        """Get (path, size, last_used, pinned) for the files in the cache, the
+        least recently used first."""
+        return self._conn.execute(
+            "select path, size, last_used, pinned from files "
+            + ("where pinned = 1 " if pinned_only else "")
+            + "order by last_used"
+        ).fetchall()
+
+
+def open_desdata_cache(desdata):
+    """Open the cache index of `desdata` or return None if it cannot be opened
+    (e.g., if DESDATA is read-only)."""
+    try:
+        return DesdataCache(desdata)
+    except (OSError, sqlite3.Error):
+        return None
@@ -0,0 +1,436 @@
+"""A cached catalogue of the schema of the metadata DB.
+
+The catalogue holds the tables of the metadata DB with their columns, types,
+indexes, approximate row counts and the distinct values of low-cardinality
+columns (e.g., `band`). It is extracted once per metadata DB snapshot and
+stored as JSON in the DES_ARCHIVE_ACCESS_DIR, so that the SQL shell can
+describe tables and complete names without touching the DB itself.
+
+Extracting the catalogue scans each table with unindexed low-cardinality
+columns once, which takes a while on the full DB. The SQL shell therefore
+extracts a missing catalogue in the background, and it can be extracted ahead
+of time with `des-archive-access-build-catalogue`.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from des_archive_access.dbfiles import (
+    connect_des_archive_access_db,
+    file_lock,
+    get_des_archive_access_db_version,
+    get_des_archive_access_dir,
+    make_des_archive_access_dir,
+    quote_identifier,
+)
+
+# the maximum number of distinct values kept for a column
+MAX_DISTINCT_VALUES = 50
+
+# the maximum number of distinct combinations of the scanned columns of a table
+_MAX_COMBINATIONS = 10_000
+
+# columns whose distinct values are worth a full scan of their table even if
+# they are not indexed
+LOW_CARDINALITY_COLUMNS = (
+    "archive_name",
+    "band",
+    "compression",
+    "crossra0",
+    "filetype",
+)
+
+SQL_KEYWORDS = (
+    "and",
+    "as",
+    "asc",
+    "between",
+    "by",
+    "count",
+    "desc",
+    "distinct",
+    "from",
+    "group",
+    "having",
+    "in",
+    "inner",
+    "is",
+    "join",
+    "left",
+    "like",
+    "limit",
+    "not",
+    "null",
+    "on",
+    "or",
+    "order",
+    "select",
+    "where",
+)
+
+
+def get_catalogue_path():
+    """Get the location of the cached schema catalogue."""
+    return os.path.join(get_des_archive_access_dir(), "schema_catalogue.json")
+
+
+def _approx_row_count(conn, table):
+    """Get an approximate row count of `table` without scanning it.
+
+    The count comes from the statistics of `analyze` if the DB has them and
+    otherwise from the largest rowid, which is exact for tables that were
+    never deleted from.
+    """
+    try:
+        row = conn.execute(
+            "select stat from sqlite_stat1 where tbl = ? limit 1", (table,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row is not None:
+        return int(row[0].split()[0])
+    try:
+        row = conn.execute(
+            "select max(rowid) from %s" % quote_identifier(table)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] or 0
+
+
+def _indexed_distinct_values(conn, table, column):
+    """Get up to `MAX_DISTINCT_VALUES` + 1 distinct values of an indexed column
+    by hopping through its index, which costs one index lookup per value."""
+    sql = "select min(%s) from %s where %s > ?" % (
+        quote_identifier(column),
+        quote_identifier(table),
+        quote_identifier(column),
+    )
+    val = conn.execute(
+        "select min(%s) from %s" % (quote_identifier(column), quote_identifier(table))
+    ).fetchone()[0]
+    values = []
+    while val is not None and len(values) <= MAX_DISTINCT_VALUES:
+        values.append(val)
+        val = conn.execute(sql, (val,)).fetchone()[0]
+    return values
+
+
+def _scanned_distinct_values(conn, table, columns):
+    """Get the distinct values of the unindexed `columns` of `table` with a
+    single scan of the table, as a dict with None for columns whose values could
+    not be collected."""
+    rows = conn.execute(
+        "select distinct %s from %s limit %d"
+        % (
+            ", ".join(quote_identifier(col) for col in columns),
+            quote_identifier(table),
+            _MAX_COMBINATIONS + 1,
+        )
+    ).fetchall()
+    if len(rows) > _MAX_COMBINATIONS:
+        return {col: None for col in columns}
+
+    values = {col: set() for col in columns}
+    for row in rows:
+        for col, val in zip(columns, row):
+            if val is not None:
+                values[col].add(val)
+    return {col: list(vals) for col, vals in values.items()}
+
+
+def extract_catalogue(conn, verbose=False):
+    """Extract the schema catalogue of the DB behind `conn`.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection to the metadata DB.
+    verbose : bool, optional
+        If True, print progress to stderr.
+
+    Returns
+    -------
+    catalogue : dict
+        A dict mapping each table name to a dict with the keys "columns" (a
+        list of dicts with the "name", "type" and, for low-cardinality columns,
+        the sorted distinct "values"), "indexes" (a dict of index names to
+        lists of columns) and "rows" (the approximate number of rows).
+    """
+    tables = [
+        row[0]
+        for row in conn.execute(
+            "select name from sqlite_master where type = 'table' "
+            "and name not like 'sqlite_%' order by name"
+        )
+    ]
+    catalogue = {}
+    for table in tables:
+        if verbose:
+            print("cataloguing %s" % table, file=sys.stderr, flush=True)
+        indexes = {}
+        for row in conn.execute("pragma index_list(%s)" % quote_identifier(table)):
+            name = row[1]
+            indexes[name] = [
+                irow[2]
+                for irow in conn.execute(
+                    "pragma index_info(%s)" % quote_identifier(name)
+                )
+            ]
+        leading = {cols[0] for cols in indexes.values() if cols}
+
+        columns = [
+            {"name": row[1], "type": row[2]}
+            for row in conn.execute("pragma table_info(%s)" % quote_identifier(table))
+        ]
+        scanned = [
+            col["name"]
+            for col in columns
+            if col["name"] not in leading
+            and col["name"].lower() in LOW_CARDINALITY_COLUMNS
+        ]
+        values = _scanned_distinct_values(conn, table, scanned) if scanned else {}
+        for column in columns:
+            if column["name"] in leading:
+                vals = _indexed_distinct_values(conn, table, column["name"])
+            else:
+                vals = values.get(column["name"], None)
+            if vals is not None and len(vals) <= MAX_DISTINCT_VALUES:
+                column["values"] = sorted(vals, key=str)
+
+        catalogue[table] = {
+            "columns": columns,
+            "indexes": indexes,
+            "rows": _approx_row_count(conn, table),
+        }
+    return catalogue
+
+
+def _read_catalogue(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def build_catalogue(path=None, force=False, verbose=False):
+    """Extract the schema catalogue of the metadata DB and cache it.
+
+    Parameters
+    ----------
+    path : str, optional
+        The location of the cached catalogue. The default comes from
+        `get_catalogue_path`.
+    force : bool, optional
+        If True, extract the catalogue even if the cached one is up to date.
+    verbose : bool, optional
+        If True, print progress to stderr.
+
+    Returns
+    -------
+    catalogue : dict
+        The catalogue as returned by `extract_catalogue`.
+    """
+    path = path or get_catalogue_path()
+    if path == get_catalogue_path():
+        make_des_archive_access_dir()
+
+    with file_lock(path + ".lock"):
+        version = get_des_archive_access_db_version()
+        cached = _read_catalogue(path)
+        if not force and cached is not None and cached.get("db_version") == version:
+            return cached["tables"]
+
+        conn = connect_des_archive_access_db()
+        try:
+            catalogue = extract_catalogue(conn, verbose=verbose)
+        finally:
+            conn.close()
+
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as fp:
+            json.dump({"db_version": version, "tables": catalogue}, fp, indent=1)
+        os.replace(tmp, path)
+
+    return catalogue
+
+
+def load_cached_catalogue(path=None):
+    """Load the cached schema catalogue if it was made from the current metadata
+    DB snapshot, or return None."""
+    version = get_des_archive_access_db_version()
+    cached = _read_catalogue(path or get_catalogue_path())
+    if cached is not None and cached.get("db_version") == version:
+        return cached["tables"]
+    return None
+
+
+def load_catalogue(path=None):
+    """Load the cached schema catalogue, extracting it first if it is missing or
+    was made from another metadata DB snapshot."""
+    path = path or get_catalogue_path()
+    catalogue = load_cached_catalogue(path)
+    if catalogue is not None:
+        return catalogue
+
+    print(
+        "cataloguing the schema of the metadata DB...",
+        file=sys.stderr,
+        flush=True,
+    )
+    return build_catalogue(path=path)
+
+
+def build_catalogue_in_background(callback, path=None):
+    """Extract the schema catalogue in a daemon thread and call `callback` with
+    it once it is ready, returning the thread."""
+
+    def _build():
+        try:
+            catalogue = build_catalogue(path=path)
+        except Exception:
+            # the shell works without the catalogue, so we keep quiet
+            return
+        callback(catalogue)
+
+    thread = threading.Thread(target=_build, daemon=True)
+    thread.start()
+    return thread
+
+
+def _find_table(catalogue, name):
+    for table in catalogue:
+        if table.lower() == name.lower():
+            return table
+    return None
+
+
+def describe_table(catalogue, name):
+    """Format the description of the table `name` in the `catalogue` as a list
+    of lines."""
+    table = _find_table(catalogue, name)
+    if table is None:
+        raise KeyError(f"The table '{name}' is not in the metadata DB!")
+
+    info = catalogue[table]
+    rows = info["rows"]
+    lines = [
+        "%s (%s rows)" % (table.upper(), "?" if rows is None else "~%d" % rows),
+        "",
+    ]
+    width = max(len(col["name"]) for col in info["columns"])
+    twidth = max(len(col["type"]) for col in info["columns"])
+    for col in info["columns"]:
+        line = "%-*s %-*s" % (width, col["name"].upper(), twidth, col["type"])
+        if "values" in col:
+            line += " " + ", ".join(str(val) for val in col["values"])
+        lines.append(line.rstrip())
+    if info["indexes"]:
+        lines.append("")
+        for name, cols in sorted(info["indexes"].items()):
+            lines.append("index %s (%s)" % (name, ", ".join(cols)))
+    return lines
+
+
+def list_tables(catalogue, pattern=None):
+    """Format the tables in the `catalogue` matching the glob `pattern` (case
+    insensitive) with their approximate row counts as a list of lines."""
+    regex = None
+    if pattern is not None:
+        regex = re.compile(
+            re.escape(pattern.lower()).replace(r"\*", ".*").replace(r"\?", ".")
+        )
+    names = [
+        table
+        for table in sorted(catalogue)
+        if regex is None or regex.fullmatch(table.lower())
+    ]
+    if not names:
+        return []
+    width = max(len(name) for name in names)
+    lines = []
+    for table in names:
+        rows = catalogue[table]["rows"]
+        lines.append(
+            "%-*s %s" % (width, table.upper(), "?" if rows is None else "~%d" % rows)
+        )
+    return lines
+
+
+def get_schema_completer(catalogue=None):
+    """Get a prompt_toolkit completer of the SQL keywords and the table names,
+    column names and column values in the `catalogue`.
+
+    The catalogue can be given later with the completer's `set_catalogue`
+    method. Until then, only SQL keywords are completed.
+    """
+    from prompt_toolkit.completion import Completer, Completion
+
+    class SchemaCompleter(Completer):
+        def __init__(self):
+            self.tables = {}
+
+        def set_catalogue(self, catalogue):
+            self.tables = {name.lower(): info for name, info in catalogue.items()}
+
+        def get_completions(self, document, complete_event):
+            tables = self.tables
+            text = document.text_before_cursor
+
+            # a value of a column, e.g., band = 'r
+            m = re.search(r"(\w+)\s*(?:=|!=|<>|in\s*\(|,)\s*'([^']*)$", text, re.I)
+            if m is not None:
+                column, prefix = m.group(1).lower(), m.group(2)
+                values = set()
+                for info in self._tables_in(text):
+                    for col in info["columns"]:
+                        if col["name"].lower() == column:
+                            values.update(str(val) for val in col.get("values", []))
+                for val in sorted(values):
+                    if val.startswith(prefix):
+                        yield Completion(val, start_position=-len(prefix))
+                return
+
+            m = re.search(r"([\w.]*)$", text)
+            word = m.group(1)
+            if "." in word:
+                # a column of a table, e.g., y6a2_image.ba
+                table, prefix = word.rsplit(".", 1)
+                info = tables.get(table.lower())
+                names = [] if info is None else [c["name"] for c in info["columns"]]
+            else:
+                prefix = word
+                columns = sorted(
+                    {
+                        col["name"].lower()
+                        for info in self._tables_in(text)
+                        for col in info["columns"]
+                    }
+                )
+                names = list(SQL_KEYWORDS) + sorted(tables) + columns
+
+            prefix_lower = prefix.lower()
+            if not prefix_lower:
+                return
+            for name in names:
+                if name.lower().startswith(prefix_lower) and name != prefix:
+                    yield Completion(name, start_position=-len(prefix))
+
+        def _tables_in(self, text):
+            tables = self.tables
+            mentioned = [
+                tables[word]
+                for word in re.findall(r"\w+", text.lower())
+                if word in tables
+            ]
+            return mentioned or list(tables.values())
+
+    completer = SchemaCompleter()
+    if catalogue is not None:
+        completer.set_catalogue(catalogue)
+    return completer
@@ -1,18 +1,23 @@
 import argparse
+import contextlib
+import hashlib
+import json
 import os
+import re
+import shutil
 import subprocess
 import sys
 import tempfile
-
-import requests
-import zstandard
-from tqdm import tqdm
+import time
 
 from des_archive_access.dbfiles import (
+    _cached_download,
     download_file,
     download_file_from_desdm,
+    file_lock,
     get_des_archive_access_db,
     get_des_archive_access_dir,
+    get_des_archive_access_shared_dir,
     make_des_archive_access_dir,
 )
 
@@ -38,7 +43,7 @@ def main_download():
         "--list",
         type=str,
         default=None,
-        help="download all files in a list",
+        help="download all files in a list ('-' to read the list from stdin)",
     )
     parser.add_argument(
         "-a",
@@ -71,8 +76,31 @@ def main_download():
         action="store_true",
         help="Do not attempt to automatically refresh the OIDC token.",
     )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        help=(
+            "Only download the files in a list that belong to shard i of N, given as "
+            "'i/N' with 0 <= i < N (e.g., '$SLURM_ARRAY_TASK_ID/100'). Files are "
+            "assigned to shards by a stable hash of their path."
+        ),
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help=(
+            "Record the status of each file in a list in a journal in this directory, "
+            "skip files the journal records as done and keep going after failures. "
+            "Use `des-archive-access-download-report` to merge the journals."
+        ),
+    )
     args, unknown = parser.parse_known_args()
 
+    if (args.shard is not None or args.journal is not None) and args.list is None:
+        parser.error("--shard and --journal can only be used with --list")
+
     prefix = args.archive or os.environ.get(
         "DES_ARCHIVE_ACCESS_ARCHIVE",
         "https://fndcadoor.fnal.gov:2880/des/persistent/DESDM_ARCHIVE",
@@ -94,12 +122,34 @@ def main_download():
         )
 
     if args.list is not None:
-        with open(args.list) as fp:
-            # for a list of files we refresh once
-            did_refresh = False
-            for line in fp:
-                line = line.strip()
-                download_file(
+        with (
+            contextlib.nullcontext(sys.stdin) if args.list == "-" else open(args.list)
+        ) as fp:
+            paths = [line.strip() for line in fp if line.strip()]
+
+        if args.shard is not None or args.journal is not None:
+            from des_archive_access.journal import Journal, parse_shard, shard_paths
+
+            try:
+                index, nshards = parse_shard(args.shard or "0/1")
+            except ValueError as e:
+                parser.error(str(e))
+            paths = shard_paths(paths, index, nshards)
+
+        journal = None
+        if args.journal is not None:
+            journal = Journal(args.journal, index, nshards)
+            done = journal.done_paths()
+            paths = [pth for pth in paths if pth not in done]
+
+        # for a list of files we refresh once, before the first file that is
+        # not already in the cache
+        did_refresh = False
+        nfailed = 0
+        for line in paths:
+            t0 = time.time()
+            try:
+                fpth, fetched = _cached_download(
                     line,
                     prefix=prefix,
                     desdata=desdata,
@@ -108,13 +158,293 @@ def main_download():
                     refresh_token=((not args.no_refresh_token) and (not did_refresh)),
                     extra_cli_args=" ".join(unknown),
                 )
+            except Exception as e:
+                if journal is None:
+                    raise
+                # failures come from the download itself, after the refresh
                 did_refresh = True
+                nfailed += 1
+                journal.record(line, "failed", time.time() - t0, error=repr(e))
+                print(f"failed to download {line}: {e!r}", file=sys.stderr)
+            else:
+                if journal is not None:
+                    journal.record(
+                        line, "done", time.time() - t0, nbytes=os.path.getsize(fpth)
+                    )
+                did_refresh = did_refresh or fetched
+
+        if nfailed > 0:
+            print(
+                f"failed to download {nfailed} of {len(paths)} files",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+
+def main_download_report():
+    from des_archive_access.journal import merge_journals
+
+    parser = argparse.ArgumentParser(
+        prog="des-archive-access-download-report",
+        description=(
+            "Merge the journals written by `des-archive-access-download --journal` "
+            "for all shards of a list into a completion report. Exits with a "
+            "nonzero status if any files failed or are pending."
+        ),
+    )
+    parser.add_argument("journal", type=str, help="the journal directory")
+    parser.add_argument(
+        "-l",
+        "--list",
+        type=str,
+        default=None,
+        help="the full list of files, used to find files no shard has tried yet",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="print the full report as JSON",
+    )
+    parser.add_argument(
+        "--retry-list",
+        type=str,
+        default=None,
+        help="write the failed and pending files to this list to retry them",
+    )
+    args = parser.parse_args()
+
+    paths = None
+    if args.list is not None:
+        with open(args.list) as fp:
+            paths = [line.strip() for line in fp if line.strip()]
+
+    report = merge_journals(args.journal, paths=paths)
+
+    if args.retry_list is not None:
+        with open(args.retry_list, "w") as fp:
+            for pth in sorted(report["failed"] + report["pending"]):
+                fp.write(pth + "\n")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"shards:  {report['shards']}")
+        print(f"done:    {len(report['done'])} ({report['bytes'] / 1e9:.3f} GB)")
+        print(f"failed:  {len(report['failed'])}")
+        if paths is not None:
+            print(f"pending: {len(report['pending'])}")
+        for host, stats in sorted(report["hosts"].items()):
+            print(f"  {host}: {stats['files']} files ({stats['bytes'] / 1e9:.3f} GB)")
+        for pth in report["failed"]:
+            print(f"failed {pth}: {report['errors'][pth]}")
+
+    if report["failed"] or report["pending"]:
+        sys.exit(1)
+
+
+DEFAULT_METADATA_URL = (
+    "http://deslogin.cosmology.illinois.edu/~donaldp/"
+    "desdm-file-db-23-10-06-15-39/desdm_pruned_indexed_files.db.zst"
+)
+
+
+def _remove_quietly(*paths):
+    for pth in paths:
+        try:
+            os.remove(pth)
+        except Exception:
+            pass
+
+
+def _download_metadata_db(url, mloc, seekable=False):
+    """Download the metadata DB at `url` to `mloc`, decompressing it if needed.
+
+    If `seekable` is True, the DB is instead stored as a seekable zstd file that
+    can be queried without decompressing it (see `des_archive_access.seekable`).
+
+    The data is written to temporary files next to `mloc` which are only moved
+    into place once the DB is complete. Thus concurrent downloads never see or
+    remove each other's partial files.
+    """
+    # these are imported here to keep the startup time of the other
+    # commands low
+    import requests
+    import zstandard
+    from tqdm import tqdm
+
+    tmp = f"{mloc}.tmp-{os.getpid()}"
+    tmp_src = tmp + ".src" + (".zst" if url.endswith(".zst") else "")
+    needs_conversion = seekable or url.endswith(".zst")
+
+    try:
+        if url.startswith("http"):
+            dest = tmp_src if needs_conversion else tmp
+
+            # https://stackoverflow.com/questions/37573483/progress-bar-while-download-file-over-http-with-requests
+            response = requests.get(url, stream=True)
+            total_size_in_bytes = int(response.headers.get("content-length", 0))
+            block_size = 1024
+            with tqdm(
+                total=total_size_in_bytes,
+                unit="iB",
+                unit_scale=True,
+                ncols=80,
+                desc="downloading DB",
+            ) as progress_bar:
+                with open(dest, "wb") as file:
+                    for data in response.iter_content(block_size):
+                        progress_bar.update(len(data))
+                        file.write(data)
+            if total_size_in_bytes != 0 and progress_bar.n != total_size_in_bytes:
+                raise RuntimeError("Download failed!")
+
+            _source_path = dest
+        else:
+            _source_path = url[len("file://") :]
+            if not needs_conversion:
+                shutil.copyfile(_source_path, tmp)
+
+        if seekable:
+            from des_archive_access.seekable import is_seekable_zstd, make_seekable_db
+
+            if url.endswith(".zst") and is_seekable_zstd(_source_path):
+                shutil.copyfile(_source_path, tmp)
+            else:
+                print("compressing into seekable frames...", end="", flush=True)
+                make_seekable_db(_source_path, tmp)
+                print("done.", flush=True)
+        elif url.endswith(".zst"):
+            # decompress
+            print("decompressing...", end="", flush=True)
+            dctx = zstandard.ZstdDecompressor()
+            with open(_source_path, "rb") as ifh, open(tmp, "wb") as ofh:
+                dctx.copy_stream(ifh, ofh)
+            print("done.", flush=True)
+
+        os.replace(tmp, mloc)
+    finally:
+        _remove_quietly(tmp, tmp_src)
+
+
+def _snapshot_name(url):
+    """Make a name for the metadata DB snapshot at `url` that is stable across
+    processes."""
+    name = os.path.basename(url.rstrip("/")).split(".")[0] or "metadata"
+    name = re.sub(r"[^A-Za-z0-9_\-]", "_", name)
+    return name + "-" + hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+
+
+def _metadata_db_path(mloc, seekable):
+    """Get the location to download the metadata DB at `mloc` to."""
+    if seekable and not mloc.endswith(".zst"):
+        return mloc + ".zst"
+    return mloc
+
+
+def _metadata_db_exists(mloc):
+    return os.path.exists(mloc) or os.path.exists(mloc + ".zst")
+
+
+def _make_group_shared(path, mode):
+    """Set the `mode` of a `path` in the node-shared directory so that the other
+    users of the node can use it, skipping paths owned by other users."""
+    try:
+        os.chmod(path, mode)
+    except PermissionError:
+        pass
+
+
+def _download_shared_metadata_db(shared_dir, url, snapshot, force, seekable):
+    """Download the metadata DB into the snapshot `snapshot` of the node-shared
+    directory and make it current.
+
+    Only one process downloads a given snapshot. Any others wait for it to finish
+    and then reuse it. Snapshots are made current by atomically swapping the
+    `current` symlink so that readers using the old snapshot are unaffected.
+
+    The directories are made group-writable with the setgid bit set, so that all
+    users in the group of the shared directory can publish new snapshots.
+    """
+    snapshots_dir = os.path.join(shared_dir, "snapshots")
+    os.makedirs(snapshots_dir, exist_ok=True)
+    for pth in [shared_dir, snapshots_dir]:
+        _make_group_shared(pth, 0o2775)
+    snapshot_dir = os.path.join(snapshots_dir, snapshot)
+    tmp_dir = os.path.join(snapshots_dir, f".tmp-{snapshot}-{os.getpid()}")
+    old_dir = os.path.join(snapshots_dir, f".old-{snapshot}-{os.getpid()}")
+
+    lock = os.path.join(shared_dir, ".lock")
+    os.close(os.open(lock, os.O_RDONLY | os.O_CREAT, 0o664))
+    _make_group_shared(lock, 0o664)
+
+    with file_lock(
+        lock,
+        wait_message="waiting for another process to download the metadata DB...",
+    ):
+        if force or not _metadata_db_exists(os.path.join(snapshot_dir, "metadata.db")):
+            os.makedirs(tmp_dir, exist_ok=True)
+            _make_group_shared(tmp_dir, 0o2775)
+            try:
+                mloc = _metadata_db_path(os.path.join(tmp_dir, "metadata.db"), seekable)
+                _download_metadata_db(url, mloc, seekable=seekable)
+                _make_group_shared(mloc, 0o664)
+
+                # the old copy of a snapshot that is downloaded again is only
+                # moved aside once the new one is complete, so readers never
+                # see a missing snapshot during the download
+                if os.path.exists(snapshot_dir):
+                    os.rename(snapshot_dir, old_dir)
+                os.rename(tmp_dir, snapshot_dir)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        current = os.path.join(shared_dir, "current")
+        target = os.path.join("snapshots", snapshot)
+        if not os.path.islink(current) or os.readlink(current) != target:
+            tmp_link = os.path.join(shared_dir, f".current-{os.getpid()}")
+            _remove_quietly(tmp_link)
+            os.symlink(target, tmp_link)
+            os.replace(tmp_link, current)
+
+        if force:
+            # readers with the old DB open keep working since the file is only
+            # unlinked
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _remove_shared_metadata_db(shared_dir, prune_only):
+    """Remove the snapshots in the node-shared directory that are not current,
+    and the current one too if `prune_only` is False."""
+    snapshots_dir = os.path.join(shared_dir, "snapshots")
+    current = os.path.join(shared_dir, "current")
+
+    with file_lock(os.path.join(shared_dir, ".lock")):
+        current_snapshot = (
+            os.path.basename(os.readlink(current)) if os.path.islink(current) else None
+        )
+        if not prune_only:
+            _remove_quietly(current)
+
+        if os.path.exists(snapshots_dir):
+            for snapshot in os.listdir(snapshots_dir):
+                if prune_only and snapshot == current_snapshot:
+                    continue
+                # readers with the DB open keep working since the
+                # file is only unlinked
+                shutil.rmtree(os.path.join(snapshots_dir, snapshot), ignore_errors=True)
 
 
 def main_download_metadata():
+    from des_archive_access.joins import refresh_joins
+
     parser = argparse.ArgumentParser(
         prog="des-archive-access-download-metadata",
-        description="Download the metadata for the DES archive at FNAL.",
+        description=(
+            "Download the metadata for the DES archive at FNAL. If the environment "
+            "variable DES_ARCHIVE_ACCESS_SHARED_DIR is set (and DES_ARCHIVE_ACCESS_DB "
+            "is not), the metadata is downloaded once into a snapshot in that "
+            "directory that is shared by all users of the node."
+        ),
     )
     parser.add_argument(
         "--url",
@@ -131,81 +461,76 @@ def main_download_metadata():
     parser.add_argument(
         "--remove", action="store_true", help="remove existing metadata"
     )
+    parser.add_argument(
+        "--seekable",
+        action="store_true",
+        help=(
+            "store the metadata as a seekable zstd file that is queried without "
+            "decompressing it (requires the `apsw` package)"
+        ),
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=str,
+        default=None,
+        help=(
+            "name of the snapshot in the shared directory "
+            "(defaults to a name made from the URL)"
+        ),
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="remove all snapshots in the shared directory except the current one",
+    )
     args = parser.parse_args()
 
-    mloc = get_des_archive_access_db()
+    url = args.url or DEFAULT_METADATA_URL
 
-    if args.remove or args.force:
-        try:
-            os.remove(mloc)
-        except Exception:
-            pass
+    shared_dir = get_des_archive_access_shared_dir()
+    if shared_dir is not None and "DES_ARCHIVE_ACCESS_DB" not in os.environ:
+        os.makedirs(shared_dir, exist_ok=True)
+        if args.remove or args.prune:
+            _remove_shared_metadata_db(shared_dir, prune_only=not args.remove)
+            sys.exit(0)
 
-    if args.remove:
-        sys.exit(0)
+        _download_shared_metadata_db(
+            shared_dir,
+            url,
+            args.snapshot or _snapshot_name(url),
+            args.force,
+            args.seekable,
+        )
+        # joins materialised from an older snapshot are rebuilt here so that
+        # queries never wait for them
+        refresh_joins()
+        return
 
-    if not os.path.exists(mloc) or args.force:
-        if os.path.dirname(mloc) == os.path.expanduser("~/.des_archive_access"):
-            make_des_archive_access_dir()
-        else:
-            os.makedirs(os.path.dirname(mloc), exist_ok=True)
+    mloc = get_des_archive_access_db()
 
-        url = args.url or (
-            "http://deslogin.cosmology.illinois.edu/~donaldp/"
-            "desdm-file-db-23-10-06-15-39/desdm_pruned_indexed_files.db.zst"
-        )
+    if os.path.dirname(mloc) == os.path.expanduser("~/.des_archive_access"):
+        make_des_archive_access_dir()
+    else:
+        os.makedirs(os.path.dirname(mloc), exist_ok=True)
 
-        if url.endswith(".zst"):
-            dest = mloc + ".zst"
-        else:
-            dest = mloc
+    with file_lock(
+        mloc + ".lock",
+        wait_message="waiting for another process to download the metadata DB...",
+    ):
+        if args.remove or args.force:
+            _remove_quietly(mloc, mloc + ".zst")
 
-        try:
-            if url.startswith("http"):
-                # https://stackoverflow.com/questions/37573483/progress-bar-while-download-file-over-http-with-requests
-                response = requests.get(url, stream=True)
-                total_size_in_bytes = int(response.headers.get("content-length", 0))
-                block_size = 1024
-                with tqdm(
-                    total=total_size_in_bytes,
-                    unit="iB",
-                    unit_scale=True,
-                    ncols=80,
-                    desc="downloading DB",
-                ) as progress_bar:
-                    with open(dest, "wb") as file:
-                        for data in response.iter_content(block_size):
-                            progress_bar.update(len(data))
-                            file.write(data)
-                if total_size_in_bytes != 0 and progress_bar.n != total_size_in_bytes:
-                    raise RuntimeError("Download failed!")
-
-                _source_path = dest
-            else:
-                _source_path = url[len("file://") :]
+        if args.remove:
+            sys.exit(0)
 
-            # decompress
-            if url.endswith(".zst"):
-                print("decompressing...", end="", flush=True)
-                dctx = zstandard.ZstdDecompressor()
-                with open(_source_path, "rb") as ifh, open(mloc, "wb") as ofh:
-                    dctx.copy_stream(ifh, ofh)
-                print("done.", flush=True)
-        except (KeyboardInterrupt, Exception) as e:
-            try:
-                os.remove(mloc)
-                if url.endswith(".zst"):
-                    os.remove(mloc + ".zst")
-            except Exception:
-                pass
+        if not _metadata_db_exists(mloc):
+            _download_metadata_db(
+                url,
+                _metadata_db_path(mloc, args.seekable),
+                seekable=args.seekable or mloc.endswith(".zst"),
+            )
 
-            raise e
-        finally:
-            try:
-                if url.startswith("http") and url.endswith(".zst"):
-                    os.remove(mloc + ".zst")
-            except Exception:
-                pass
+    refresh_joins()
 
 
 def main_make_token():
@@ -271,6 +596,77 @@ def main_make_token():
         os.chmod(pth, 0o700)
 
 
+def main_daemon():
+    from des_archive_access.daemon import (
+        DEFAULT_CACHE_SIZE_MB,
+        DEFAULT_IDLE_TIMEOUT,
+        DEFAULT_POOL_SIZE,
+        DaemonNotRunningError,
+        QueryDaemon,
+        daemon_status,
+        start_daemon,
+        stop_daemon,
+    )
+
+    parser = argparse.ArgumentParser(
+        prog="des-archive-access-daemon",
+        description=(
+            "Manage the query daemon that keeps the metadata DB open and warm "
+            "across calls to `des-archive-access`."
+        ),
+    )
+    parser.add_argument(
+        "action",
+        choices=["start", "stop", "status", "serve"],
+        help=(
+            "start the daemon in the background, stop it, print its status "
+            "or run it in the foreground"
+        ),
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="the maximum number of DB connections",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help="seconds without queries before the daemon exits (0 to never exit)",
+    )
+    parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=DEFAULT_CACHE_SIZE_MB,
+        help="size of the page cache for each DB connection in MB",
+    )
+    args = parser.parse_args()
+
+    if args.action == "start":
+        start_daemon(
+            pool_size=args.pool_size,
+            idle_timeout=args.idle_timeout,
+            cache_size_mb=args.cache_size_mb,
+        )
+    elif args.action == "stop":
+        stop_daemon()
+    elif args.action == "status":
+        try:
+            status = daemon_status()
+        except DaemonNotRunningError:
+            print("not running")
+            sys.exit(1)
+        for key, val in status.items():
+            print(f"{key}: {val}")
+    else:
+        QueryDaemon(
+            pool_size=args.pool_size,
+            idle_timeout=args.idle_timeout,
+            cache_size_mb=args.cache_size_mb,
+        ).serve_forever()
+
+
 PIZZA_CUTTER_CONFIG = """\
 des_data:
   campaign: Y6A2_COADD
@@ -408,6 +804,243 @@ single_epoch:
 """
 
 
+def main_cache():
+    from des_archive_access.cache import DesdataCache, format_size, parse_size
+
+    parser = argparse.ArgumentParser(
+        prog="des-archive-access-cache",
+        description=(
+            "Manage DESDATA as a cache of archive files. Set the environment "
+            "variable DES_ARCHIVE_ACCESS_CACHE_SIZE (e.g., '500G') to cap its size."
+        ),
+    )
+    parser.add_argument(
+        "-d",
+        "--desdata",
+        type=str,
+        default=None,
+        help="The DESDATA directory.",
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    subparsers.add_parser("status", help="print the size of the cache")
+    subparsers.add_parser(
+        "scan", help="add files already in DESDATA that are not in the cache"
+    )
+    evict = subparsers.add_parser(
+        "evict", help="evict least recently used files to get under the size cap"
+    )
+    evict.add_argument(
+        "--to",
+        type=str,
+        default=None,
+        help="the size to evict down to instead of the size cap (e.g., '100G')",
+    )
+    for action, action_help in [("pin", "pin files"), ("unpin", "unpin files")]:
+        sub = subparsers.add_parser(action, help=action_help)
+        sub.add_argument(
+            "patterns",
+            type=str,
+            nargs="+",
+            help="glob patterns of the archive paths of the files",
+        )
+    ls = subparsers.add_parser(
+        "list", help="list the files in the cache, least recently used first"
+    )
+    ls.add_argument("--pinned", action="store_true", help="only list pinned files")
+    args = parser.parse_args()
+
+    desdata = args.desdata or os.environ["DESDATA"]
+
+    with DesdataCache(desdata) as cache:
+        if args.action == "status":
+            files = cache.files()
+            npinned = sum(row[3] for row in files)
+            print(f"DESDATA: {desdata}")
+            print(f"files:   {len(files)} ({npinned} pinned)")
+            print(f"size:    {format_size(cache.total_size())}")
+            print(
+                "cap:     "
+                + (
+                    format_size(cache.size_cap)
+                    if cache.size_cap is not None
+                    else "none"
+                )
+            )
+        elif args.action == "scan":
+            print(f"added {cache.scan()} files to the cache")
+        elif args.action == "evict":
+            size_cap = parse_size(args.to) if args.to is not None else None
+            if size_cap is None and cache.size_cap is None:
+                parser.error(
+                    "set DES_ARCHIVE_ACCESS_CACHE_SIZE or use --to to give a size"
+                )
+            evicted = cache.evict(size_cap=size_cap)
+            for fname in evicted:
+                print(f"evicted {fname}")
+        elif args.action in ("pin", "unpin"):
+            for pattern in args.patterns:
+                n = cache.set_pinned(pattern, pinned=args.action == "pin")
+                print(f"{args.action}ned {n} files matching {pattern}")
+        elif args.action == "list":
+            for fname, size, last_used, pinned in cache.files(pinned_only=args.pinned):
+                print(
+                    "%s %10s %s %s"
+                    % (
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_used)),
+                        format_size(size),
+                        "P" if pinned else "-",
+                        fname,
+                    )
+                )
+
+
+def main_spatial_index():
+    from des_archive_access.spatial import build_spatial_index, get_spatial_index_path
+
+    parser = argparse.ArgumentParser(
+        prog="des-archive-access-spatial-index",
+        description=(
+            "Build the spatial index of the image and coadd tile footprints in the "
+            "metadata DB used for cone searches."
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="rebuild the index even if it is up to date",
+    )
+    parser.add_argument(
+        "--path",
+        type=str,
+        default=None,
+        help=f"location of the index (default {get_spatial_index_path()})",
+    )
+    args = parser.parse_args()
+
+    print(build_spatial_index(path=args.path, force=args.force, verbose=True))
+
+
+def main_build_joins():
+    from des_archive_access.joins import build_joins, get_joins_db_path
+
+    parser = argparse.ArgumentParser(
+        prog="des-archive-access-build-joins",
+        description=(
+            "Materialise the common joins of the metadata DB (e.g., images with "
+            "their archive paths) into indexed tables in a side DB."
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="rebuild the tables even if they are up to date",
+    )
+    parser.add_argument(
+        "--path",
+        type=str,
+        default=None,
+        help=f"location of the side DB (default {get_joins_db_path()})",
+    )
+    args = parser.parse_args()
+
+    print(build_joins(path=args.path, force=args.force, verbose=True))
+
+
+def main_build_catalogue():
+    from des_archive_access.catalogue import build_catalogue, get_catalogue_path
+
+    parser = argparse.ArgumentParser(
+        prog="des-archive-access-build-catalogue",
+        description=(
+            "Extract the catalogue of the tables, columns and indexes of the "
+            "metadata DB used by the SQL shell for introspection and tab "
+            "completion."
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="extract the catalogue even if it is up to date",
+    )
+    parser.add_argument(
+        "--path",
+        type=str,
+        default=None,
+        help=f"location of the catalogue (default {get_catalogue_path()})",
+    )
+    args = parser.parse_args()
+
+    build_catalogue(path=args.path, force=args.force, verbose=True)
+    print(args.path or get_catalogue_path())
+
+
+def main_cone():
+    from des_archive_access.spatial import (
+        cone,
+        get_archive_paths,
+        tiles_overlapping,
+    )
+
+    parser = argparse.ArgumentParser(
+        prog="des-archive-access-cone",
+        description=(
+            "Find the images or coadd tiles whose footprints overlap a cone on the "
+            "sky using the spatial index. The output can be passed to "
+            "`des-archive-access-download --list` with `--paths`."
+        ),
+    )
+    parser.add_argument("ra", type=float, help="RA of the center in degrees")
+    parser.add_argument("dec", type=float, help="Dec of the center in degrees")
+    parser.add_argument("radius", type=float, help="radius in degrees")
+    parser.add_argument(
+        "--tiles",
+        action="store_true",
+        help="find coadd tiles instead of images",
+    )
+    parser.add_argument(
+        "--filetype",
+        type=str,
+        default=None,
+        help="only find images of this filetype (e.g., red_immask)",
+    )
+    parser.add_argument(
+        "--band",
+        type=str,
+        default=None,
+        help="only find images in this band",
+    )
+    parser.add_argument(
+        "--paths",
+        action="store_true",
+        help=(
+            "print the archive paths of the files (or of the images of the tiles) "
+            "instead of their names"
+        ),
+    )
+    args = parser.parse_args()
+
+    if args.tiles:
+        names = tiles_overlapping(args.ra, args.dec, args.radius)
+        if args.paths:
+            names = get_archive_paths(tilenames=names)
+    else:
+        names = cone(
+            args.ra,
+            args.dec,
+            args.radius,
+            filetype=args.filetype,
+            band=args.band,
+        )
+        if args.paths:
+            names = get_archive_paths(filenames=names)
+
+    for name in names:
+        print(name)
+
+
 def main_sync_tile_data():
     parser = argparse.ArgumentParser(
         prog="des-archive-access-sync-tile-data",
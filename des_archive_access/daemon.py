@@ -0,0 +1,741 @@
+"""A long-lived local service that keeps the metadata DB warm.
+
+The daemon listens on a Unix socket in the DES_ARCHIVE_ACCESS_DIR and runs
+queries for clients on a pool of read-only connections, so that short queries
+do not each pay the cost of opening the DB and filling the page cache.
+
+Each message on the socket is a frame made of a one byte frame type, a four
+byte little-endian body length and the body. A client sends a single request
+frame with a JSON body and the daemon replies with a description frame (the
+JSON list of column names), any number of batch frames and an end frame, or
+with an error frame. Batches are encoded column by column with
+`encode_batch` so that numeric columns are sent as packed binary arrays.
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from array import array
+
+from des_archive_access.dbfiles import (
+    connect_des_archive_access_db,
+    get_des_archive_access_db,
+    get_des_archive_access_db_version,
+    get_des_archive_access_dir,
+    make_des_archive_access_dir,
+)
+from des_archive_access.joins import get_joins_db_path
+from des_archive_access.spatial import get_spatial_index_path
+
+FRAME_REQUEST = b"Q"
+FRAME_DESCRIPTION = b"D"
+FRAME_BATCH = b"B"
+FRAME_END = b"E"
+FRAME_ERROR = b"X"
+FRAME_STATUS = b"S"
+
+_FRAME_HEADER = struct.Struct("<cI")
+_UINT32 = struct.Struct("<I")
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 3600
+DEFAULT_CACHE_SIZE_MB = 256
+
+
+class DaemonNotRunningError(RuntimeError):
+    """Raised when the query daemon cannot be reached."""
+
+
+def get_daemon_socket_path():
+    """Get the location of the query daemon's Unix socket."""
+    return os.environ.get(
+        "DES_ARCHIVE_ACCESS_DAEMON_SOCKET",
+        os.path.join(get_des_archive_access_dir(), "daemon.sock"),
+    )
+
+
+def get_daemon_mode():
+    """Get how queries use the daemon from the environment variable
+    DES_ARCHIVE_ACCESS_DAEMON.
+
+    The mode is one of "auto" (use the daemon if it is running, the default),
+    "on" (start the daemon if it is not running and use it) or "off" (never use
+    the daemon).
+    """
+    mode = os.environ.get("DES_ARCHIVE_ACCESS_DAEMON", "auto").strip().lower()
+    if mode in ("1", "true", "yes", "start"):
+        mode = "on"
+    elif mode in ("0", "false", "no", "never"):
+        mode = "off"
+    if mode not in ("auto", "on", "off"):
+        raise RuntimeError(
+            "DES_ARCHIVE_ACCESS_DAEMON must be one of 'auto', 'on' or 'off', "
+            f"got '{mode}'!"
+        )
+    return mode
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return "-"
+    return "%d-%d-%d" % (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def get_serving_version(dbloc=None):
+    """Get the version of the metadata DB (or of the DB at `dbloc`) and of the
+    side DBs attached to its connections (the spatial index and the
+    materialised joins) that queries are answered from, or None if the DB does
+    not exist.
+
+    The daemon records this version when it opens its connections and clients
+    send theirs with each query, so that a DB replaced at the same location
+    (e.g., by `des-archive-access-download-metadata --force`) or a side DB built
+    after the daemon started is never missed by the daemon's connections.
+    """
+    try:
+        version = get_des_archive_access_db_version(dbloc)
+    except FileNotFoundError:
+        return None
+    return ":".join(
+        [version]
+        + [
+            _file_stamp(path)
+            for path in [get_joins_db_path(), get_spatial_index_path()]
+        ]
+    )
+
+
+def _to_bytes(typecode, values):
+    arr = array(typecode, values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_bytes(typecode, buff):
+    arr = array(typecode)
+    arr.frombytes(buff)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def _encode_column(values):
+    """Encode a list of values into a (kind, has_nulls, buffers) tuple."""
+    types = {type(v) for v in values if v is not None}
+    nulls = bytes(v is None for v in values)
+    has_nulls = any(nulls)
+
+    if not types:
+        return "null", False, []
+    elif types == {int}:
+        buffers = [_to_bytes("q", [0 if v is None else v for v in values])]
+        kind = "i8"
+    elif types == {float}:
+        buffers = [_to_bytes("d", [0.0 if v is None else v for v in values])]
+        kind = "f8"
+    elif types == {str} or types == {bytes}:
+        kind = "str" if types == {str} else "bytes"
+        datas = [
+            (
+                b""
+                if v is None
+                else (v.encode("utf-8", "surrogatepass") if kind == "str" else v)
+            )
+            for v in values
+        ]
+        offsets = [0]
+        for d in datas:
+            offsets.append(offsets[-1] + len(d))
+        buffers = [_to_bytes("q", offsets), b"".join(datas)]
+    else:
+        # SQLite allows mixed types in a column, so we fall back to JSON
+        kind = "mixed"
+        buffers = [
+            json.dumps(
+                [["b", v.hex()] if isinstance(v, bytes) else [None, v] for v in values]
+            ).encode("utf-8")
+        ]
+        has_nulls = False
+
+    if has_nulls:
+        buffers = [nulls] + buffers
+    return kind, has_nulls, buffers
+
+
+def _decode_column(kind, has_nulls, nrows, buffers):
+    """Decode the buffers of a column into a list of values."""
+    if kind == "null":
+        return [None] * nrows
+
+    if has_nulls:
+        nulls, buffers = buffers[0], buffers[1:]
+
+    if kind == "i8":
+        values = _from_bytes("q", buffers[0]).tolist()
+    elif kind == "f8":
+        values = _from_bytes("d", buffers[0]).tolist()
+    elif kind in ("str", "bytes"):
+        offsets = _from_bytes("q", buffers[0])
+        data = buffers[1]
+        if kind == "str":
+            values = [
+                data[offsets[i] : offsets[i + 1]].decode("utf-8", "surrogatepass")
+                for i in range(nrows)
+            ]
+        else:
+            values = [data[offsets[i] : offsets[i + 1]] for i in range(nrows)]
+    elif kind == "mixed":
+        values = [
+            bytes.fromhex(v) if t == "b" else v
+            for t, v in json.loads(buffers[0].decode("utf-8"))
+        ]
+    else:
+        raise RuntimeError(f"Did not recognize column kind '{kind}'!")
+
+    if has_nulls:
+        values = [None if isnull else v for isnull, v in zip(nulls, values)]
+    return values
+
+
+def encode_batch(rows, ncols):
+    """Encode a list of `rows` with `ncols` columns into the binary columnar
+    format used by the daemon."""
+    columns = list(zip(*rows)) if rows else [()] * ncols
+    header = {"nrows": len(rows), "columns": []}
+    all_buffers = []
+    for values in columns:
+        kind, has_nulls, buffers = _encode_column(list(values))
+        header["columns"].append(
+            {"kind": kind, "nulls": has_nulls, "sizes": [len(b) for b in buffers]}
+        )
+        all_buffers.extend(buffers)
+    header = json.dumps(header).encode("utf-8")
+    return b"".join([_UINT32.pack(len(header)), header] + all_buffers)
+
+
+def decode_batch(body):
+    """Decode a batch in the binary columnar format, returning a list with the
+    values of each column."""
+    (hlen,) = _UINT32.unpack_from(body, 0)
+    header = json.loads(body[4 : 4 + hlen].decode("utf-8"))
+    loc = 4 + hlen
+    columns = []
+    for col in header["columns"]:
+        buffers = []
+        for size in col["sizes"]:
+            buffers.append(body[loc : loc + size])
+            loc += size
+        columns.append(
+            _decode_column(col["kind"], col["nulls"], header["nrows"], buffers)
+        )
+    return columns
+
+
+def _send_frame(sock, kind, body):
+    sock.sendall(_FRAME_HEADER.pack(kind, len(body)) + body)
+
+
+def _recv_exact(sock, nbytes):
+    buff = bytearray()
+    while len(buff) < nbytes:
+        chunk = sock.recv(min(nbytes - len(buff), 1 << 20))
+        if not chunk:
+            raise ConnectionError("The query daemon closed the connection!")
+        buff.extend(chunk)
+    return bytes(buff)
+
+
+def _recv_frame(sock):
+    kind, nbytes = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    return kind, _recv_exact(sock, nbytes)
+
+
+class _ConnectionPool:
+    """A pool of read-only connections to the `version` of the metadata DB at
+    `db` that can be shared across threads."""
+
+    def __init__(self, size, cache_size_mb, db, version):
+        self.size = size
+        self.cache_size_mb = cache_size_mb
+        self.db = db
+        self.version = version
+        self._conns = queue.Queue()
+        self._nconns = 0
+        self._lock = threading.Lock()
+        self._retired = False
+
+    def _connect(self):
+        conn = connect_des_archive_access_db(self.db, check_same_thread=False)
+        conn.execute("pragma query_only = 1")
+        conn.execute("pragma cache_size = -%d" % (self.cache_size_mb * 1024))
+        conn.execute("pragma mmap_size = %d" % (self.cache_size_mb * 1024 * 1024))
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._conns.empty() and self._nconns < self.size:
+                self._nconns += 1
+                return self._connect()
+        return self._conns.get()
+
+    def release(self, conn):
+        with self._lock:
+            if not self._retired:
+                self._conns.put(conn)
+                return
+        conn.close()
+
+    def retire(self):
+        """Close the idle connections and any in use once they are released."""
+        with self._lock:
+            self._retired = True
+        self.close()
+
+    def close(self):
+        while not self._conns.empty():
+            self._conns.get().close()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        daemon = self.server.daemon
+        try:
+            kind, body = _recv_frame(self.request)
+        except ConnectionError:
+            return
+        req = json.loads(body.decode("utf-8"))
+
+        try:
+            if kind == FRAME_STATUS:
+                self._send_json(FRAME_STATUS, daemon.status())
+                if req.get("shutdown", False):
+                    threading.Thread(target=daemon.shutdown, daemon=True).start()
+            elif kind == FRAME_REQUEST:
+                self._handle_query(daemon, req)
+        except (BrokenPipeError, ConnectionError):
+            # the client went away, e.g., after the user closed the pager
+            pass
+
+    def _send_json(self, kind, data):
+        _send_frame(self.request, kind, json.dumps(data).encode("utf-8"))
+
+    def _handle_query(self, daemon, req):
+        pool = daemon.get_pool(req.get("db", None), req.get("version", None))
+        if pool is None:
+            # queries the daemon cannot serve do not keep it alive
+            self._send_json(
+                FRAME_ERROR,
+                {
+                    "type": "DaemonDBMismatch",
+                    "message": f"The daemon is serving the DB at {daemon.db}!",
+                },
+            )
+            return
+
+        daemon._touch()
+        batch_size = int(req.get("batch_size", DEFAULT_BATCH_SIZE))
+        conn = pool.acquire()
+        try:
+            curr = conn.cursor()
+            try:
+                try:
+                    curr.execute(req["sql"], req.get("params", ()))
+                except Exception as e:
+                    self._send_json(
+                        FRAME_ERROR, {"type": type(e).__name__, "message": str(e)}
+                    )
+                    return
+
+                description = [d[0] for d in (curr.description or [])]
+                self._send_json(FRAME_DESCRIPTION, description)
+                nrows = 0
+                while True:
+                    rows = curr.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    nrows += len(rows)
+                    _send_frame(
+                        self.request,
+                        FRAME_BATCH,
+                        encode_batch(rows, len(description)),
+                    )
+                self._send_json(FRAME_END, {"nrows": nrows})
+            finally:
+                curr.close()
+        finally:
+            pool.release(conn)
+            daemon._touch()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class QueryDaemon:
+    """A query daemon holding a pool of warm read-only connections to the
+    metadata DB.
+
+    Parameters
+    ----------
+    socket_path : str, optional
+        The location of the Unix socket. Defaults to
+        `get_daemon_socket_path()`.
+    pool_size : int, optional
+        The maximum number of DB connections.
+    idle_timeout : float, optional
+        The daemon shuts down after this many seconds without any requests.
+        Set to zero to never shut down.
+    cache_size_mb : int, optional
+        The size of the page cache and memory map of each connection in MB.
+    """
+
+    def __init__(
+        self,
+        socket_path=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        cache_size_mb=DEFAULT_CACHE_SIZE_MB,
+    ):
+        self.socket_path = socket_path or get_daemon_socket_path()
+        self.idle_timeout = idle_timeout
+        # the daemon keeps serving the DB its own environment points to
+        self._environ = dict(os.environ)
+        db = get_des_archive_access_db(self._environ)
+        self.pool = _ConnectionPool(
+            pool_size, cache_size_mb, db, get_serving_version(db)
+        )
+        self._pool_lock = threading.Lock()
+        self.started = time.time()
+        self._last_active = time.time()
+        self._server = None
+
+    @property
+    def db(self):
+        """The location of the metadata DB the daemon is serving."""
+        return self.pool.db
+
+    def _touch(self):
+        self._last_active = time.time()
+
+    def get_pool(self, db, version):
+        """Get the connection pool for the DB at `db` with the `version` a
+        client sees.
+
+        If the DB was replaced or a new shared snapshot was made current since
+        the pool was opened, the DB location is resolved again and the pool is
+        replaced by one for the new DB if that is the DB the client sees.
+        Returns None if the daemon cannot serve the client's DB.
+        """
+
+        def _matches(pool_db, pool_version):
+            return (
+                db is None or os.path.realpath(db) == os.path.realpath(pool_db)
+            ) and (version is None or version == pool_version)
+
+        with self._pool_lock:
+            if _matches(self.pool.db, self.pool.version):
+                return self.pool
+
+            current_db = get_des_archive_access_db(self._environ)
+            current = get_serving_version(current_db)
+            if not _matches(current_db, current):
+                return None
+
+            old_pool = self.pool
+            self.pool = _ConnectionPool(
+                old_pool.size, old_pool.cache_size_mb, current_db, current
+            )
+        old_pool.retire()
+        return self.pool
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "db": self.db,
+            "version": self.pool.version,
+            "socket": self.socket_path,
+            "uptime": time.time() - self.started,
+            "connections": self.pool._nconns,
+        }
+
+    def _watch_idle(self):
+        while self._server is not None:
+            time.sleep(min(self.idle_timeout, 10))
+            if time.time() - self._last_active > self.idle_timeout:
+                self.shutdown()
+                return
+
+    def serve_forever(self):
+        """Serve queries until the daemon is shut down."""
+        if os.path.dirname(self.socket_path) == get_des_archive_access_dir():
+            make_des_archive_access_dir()
+        if os.path.exists(self.socket_path):
+            if daemon_is_running(self.socket_path):
+                raise RuntimeError(
+                    f"A query daemon is already running at {self.socket_path}!"
+                )
+            os.remove(self.socket_path)
+
+        # warm up the first connection before accepting queries
+        self.pool.release(self.pool.acquire())
+
+        old_umask = os.umask(0o077)
+        try:
+            self._server = _Server(self.socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon = self
+
+        if self.idle_timeout:
+            threading.Thread(target=self._watch_idle, daemon=True).start()
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._server = None
+            try:
+                os.remove(self.socket_path)
+            except Exception:
+                pass
+            self.pool.close()
+
+    def shutdown(self):
+        """Stop serving queries."""
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def _connect_socket(socket_path=None, timeout=None):
+    socket_path = socket_path or get_daemon_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+    except OSError as e:
+        sock.close()
+        raise DaemonNotRunningError(
+            f"Could not connect to the query daemon at {socket_path}!"
+        ) from e
+    return sock
+
+
+def daemon_status(socket_path=None, shutdown=False):
+    """Get the status of the query daemon as a dict, optionally asking it to
+    shut down. Raises `DaemonNotRunningError` if it is not running."""
+    sock = _connect_socket(socket_path, timeout=5)
+    try:
+        _send_frame(
+            sock, FRAME_STATUS, json.dumps({"shutdown": shutdown}).encode("utf-8")
+        )
+        kind, body = _recv_frame(sock)
+    except OSError as e:
+        raise DaemonNotRunningError("The query daemon did not respond!") from e
+    finally:
+        sock.close()
+    return json.loads(body.decode("utf-8"))
+
+
+def daemon_is_running(socket_path=None):
+    """Check if the query daemon is running."""
+    socket_path = socket_path or get_daemon_socket_path()
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        daemon_status(socket_path)
+    except DaemonNotRunningError:
+        return False
+    return True
+
+
+def start_daemon(
+    pool_size=DEFAULT_POOL_SIZE,
+    idle_timeout=DEFAULT_IDLE_TIMEOUT,
+    cache_size_mb=DEFAULT_CACHE_SIZE_MB,
+    timeout=30,
+):
+    """Start the query daemon in the background if it is not already running.
+
+    The daemon's output is written to `daemon.log` in the DES_ARCHIVE_ACCESS_DIR.
+    """
+    socket_path = get_daemon_socket_path()
+    if daemon_is_running(socket_path):
+        return
+
+    make_des_archive_access_dir()
+    with open(os.path.join(get_des_archive_access_dir(), "daemon.log"), "a") as fp:
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "des_archive_access.daemon",
+                "serve",
+                "--pool-size",
+                str(pool_size),
+                "--idle-timeout",
+                str(idle_timeout),
+                "--cache-size-mb",
+                str(cache_size_mb),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=fp,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+    t0 = time.time()
+    while not daemon_is_running(socket_path):
+        if time.time() - t0 > timeout:
+            raise RuntimeError(
+                "The query daemon did not start! See the log at "
+                f"{os.path.join(get_des_archive_access_dir(), 'daemon.log')}."
+            )
+        time.sleep(0.05)
+
+
+def stop_daemon():
+    """Stop the query daemon if it is running."""
+    socket_path = get_daemon_socket_path()
+    if daemon_is_running(socket_path):
+        daemon_status(socket_path, shutdown=True)
+        while os.path.exists(socket_path):
+            time.sleep(0.05)
+
+
+class DaemonCursor:
+    """A cursor over the results of a query run by the query daemon.
+
+    The cursor mirrors the parts of the `sqlite3.Cursor` API used to read
+    results (`description`, `arraysize`, `fetchone`, `fetchmany`,
+    `fetchall` and `close`) and fetches batches from the daemon lazily.
+    Errors raised by SQLite in the daemon are raised as the same
+    `sqlite3` exception types.
+    """
+
+    def __init__(self, sql, params=(), socket_path=None, batch_size=None):
+        self.arraysize = 1
+        self._sock = _connect_socket(socket_path)
+        self._rows = []
+        self._done = False
+        self.rowcount = -1
+        try:
+            _send_frame(
+                self._sock,
+                FRAME_REQUEST,
+                json.dumps(
+                    {
+                        "sql": sql,
+                        "params": list(params),
+                        "db": get_des_archive_access_db(),
+                        "version": get_serving_version(),
+                        "batch_size": batch_size or DEFAULT_BATCH_SIZE,
+                    }
+                ).encode("utf-8"),
+            )
+            kind, body = _recv_frame(self._sock)
+        except OSError as e:
+            self.close()
+            raise DaemonNotRunningError("The query daemon did not respond!") from e
+
+        if kind == FRAME_ERROR:
+            self.close()
+            _raise_error(json.loads(body.decode("utf-8")))
+
+        columns = json.loads(body.decode("utf-8"))
+        self.description = (
+            tuple((col,) + (None,) * 6 for col in columns) if columns else None
+        )
+
+    def _fetch_batch(self):
+        if self._done:
+            return False
+        kind, body = _recv_frame(self._sock)
+        if kind == FRAME_BATCH:
+            self._rows.extend(zip(*decode_batch(body)))
+            return True
+        elif kind == FRAME_ERROR:
+            self.close()
+            _raise_error(json.loads(body.decode("utf-8")))
+        else:
+            self.rowcount = json.loads(body.decode("utf-8"))["nrows"]
+            self.close()
+            return False
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        while len(self._rows) < size and self._fetch_batch():
+            pass
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        while self._fetch_batch():
+            pass
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetch_columns(self):
+        """Fetch all remaining rows as a dict of lists of values keyed on the
+        column names."""
+        columns = [[] for _ in self.description or []]
+        if self._rows:
+            for col, values in zip(columns, zip(*self._rows)):
+                col.extend(values)
+            self._rows = []
+        while not self._done:
+            kind, body = _recv_frame(self._sock)
+            if kind == FRAME_BATCH:
+                for col, values in zip(columns, decode_batch(body)):
+                    col.extend(values)
+            elif kind == FRAME_ERROR:
+                self.close()
+                _raise_error(json.loads(body.decode("utf-8")))
+            else:
+                self.close()
+        return {d[0]: col for d, col in zip(self.description or [], columns)}
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self._done = True
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def _raise_error(err):
+    import sqlite3
+
+    if err["type"] == "DaemonDBMismatch":
+        raise DaemonNotRunningError(err["message"])
+
+    exc = getattr(sqlite3, err["type"], None)
+    if not (isinstance(exc, type) and issubclass(exc, Exception)):
+        exc = sqlite3.Error
+    raise exc(err["message"])
+
+
+if __name__ == "__main__":
+    from des_archive_access.cli import main_daemon
+
+    main_daemon()
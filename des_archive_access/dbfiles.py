@@ -1,7 +1,12 @@
+import fcntl
+import hashlib
 import os
+import re
 import sqlite3
 import subprocess
 import sys
+import tempfile
+from contextlib import contextmanager
 from functools import lru_cache
 
 
@@ -23,25 +28,205 @@ def make_des_archive_access_dir(fix_permissions=False):
             os.chmod(os.path.join(daad, fname), 0o600)
 
 
-def get_des_archive_access_db():
-    """Get the metadata DB location."""
-    return os.environ.get(
-        "DES_ARCHIVE_ACCESS_DB",
-        os.path.join(
-            os.path.expanduser("~/.des_archive_access"),
-            "metadata.db",
-        ),
+def get_des_archive_access_shared_dir():
+    """Get the node-shared metadata DB directory or None if it is not set."""
+    return os.environ.get("DES_ARCHIVE_ACCESS_SHARED_DIR", None) or None
+
+
+def get_des_archive_access_db(environ=None):
+    """Get the metadata DB location from the environment `environ` (by default
+    `os.environ`).
+
+    If DES_ARCHIVE_ACCESS_DB is not set but DES_ARCHIVE_ACCESS_SHARED_DIR is,
+    this is the DB in the current snapshot of the shared directory, resolved to
+    its snapshot directory so that the location does not change if a new
+    snapshot is made current.
+    """
+    environ = os.environ if environ is None else environ
+    if "DES_ARCHIVE_ACCESS_DB" in environ:
+        return environ["DES_ARCHIVE_ACCESS_DB"]
+
+    shared_dir = environ.get("DES_ARCHIVE_ACCESS_SHARED_DIR", None) or None
+    if shared_dir is not None:
+        return os.path.realpath(os.path.join(shared_dir, "current", "metadata.db"))
+
+    return os.path.join(
+        os.path.expanduser("~/.des_archive_access"),
+        "metadata.db",
     )
 
 
+def get_des_archive_access_db_version(dbloc=None):
+    """Get a string identifying the version of the metadata DB (or of the DB at
+    `dbloc`).
+
+    The version changes whenever the DB is downloaded again or a new snapshot
+    is made current. It is used to tell if files derived from the DB are stale.
+    """
+    dbloc = dbloc or get_des_archive_access_db()
+    if not os.path.exists(dbloc) and os.path.exists(dbloc + ".zst"):
+        dbloc = dbloc + ".zst"
+    dbloc = os.path.realpath(dbloc)
+    st = os.stat(dbloc)
+    return hashlib.sha1(
+        f"{dbloc}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8")
+    ).hexdigest()[:16]
+
+
+@contextmanager
+def file_lock(path, wait_message=None):
+    """Hold an exclusive lock on the file at `path`, waiting for any other
+    process holding the lock to release it.
+
+    If `wait_message` is given, it is printed to stderr if we have to wait.
+    """
+    # the lock file is opened read-only so that other users can take the lock
+    # on a file they do not own
+    fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o666)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if wait_message is not None:
+                print(wait_message, file=sys.stderr, flush=True)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def connect_des_archive_access_db(dbloc=None, **kwargs):
+    """Open a new read-only connection to the metadata DB (or to the DB at
+    `dbloc`).
+
+    The spatial SQL functions are registered on the connection. The spatial
+    index and the materialised joins are attached as the schemas "spatial" and
+    "joins" if they are up to date (see `des_archive_access.spatial` and
+    `des_archive_access.joins`).
+
+    Any keyword arguments are passed to `sqlite3.connect`. If the DB location
+    ends in ".zst", or only a ".zst" file exists next to it, the DB is read
+    directly from that seekable zstd file (see `des_archive_access.seekable`)
+    and the keyword arguments are ignored.
+    """
+    dbloc = dbloc or get_des_archive_access_db()
+    if not os.path.exists(dbloc) and os.path.exists(dbloc + ".zst"):
+        dbloc = dbloc + ".zst"
+    if dbloc.endswith(".zst"):
+        from des_archive_access.seekable import connect_seekable_db
+
+        conn = connect_seekable_db(dbloc)
+    else:
+        conn = sqlite3.connect(
+            f"file:{dbloc}?mode=ro",
+            uri=True,
+            **kwargs,
+        )
+
+    from des_archive_access.joins import attach_joins
+    from des_archive_access.spatial import (
+        attach_spatial_index,
+        register_spatial_functions,
+    )
+
+    register_spatial_functions(conn)
+    attach_spatial_index(conn)
+    attach_joins(conn)
+    return conn
+
+
 @lru_cache(maxsize=1)
 def get_des_archive_access_db_conn():
     """Get a DB connection."""
-    dbloc = get_des_archive_access_db()
-    return sqlite3.connect(
-        f"file:{dbloc}?mode=ro",
-        uri=True,
-    )
+    return connect_des_archive_access_db()
+
+
+def quote_identifier(name):
+    """Quote `name` for use as a table, column or index name in SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_side_db_meta(path):
+    """Get the `meta` table of the side DB at `path` (e.g., the spatial index)
+    as a dict, or None if there is no such DB."""
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return dict(conn.execute("select key, value from meta").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def side_db_is_current(path, **meta):
+    """Check if the side DB at `path` was built from the current metadata DB
+    and has the values in `meta` in its `meta` table."""
+    found = get_side_db_meta(path)
+    if found is None:
+        return False
+    meta["db_version"] = get_des_archive_access_db_version()
+    return all(found.get(key) == val for key, val in meta.items())
+
+
+def build_side_db(path, populate, force=False, **meta):
+    """Build a side DB of tables derived from the metadata DB.
+
+    The DB is built in a temporary file under a lock and moved to `path` once it
+    is complete, so that readers only ever see a complete DB. Its `meta` table
+    records the version of the metadata DB it was built from.
+
+    Parameters
+    ----------
+    path : str
+        The location of the side DB.
+    populate : callable
+        A function called as `populate(conn, out)` with a connection to the
+        metadata DB and to the new side DB that fills the side DB. It can
+        return a dict of extra values for the `meta` table.
+    force : bool, optional
+        If True, rebuild the DB even if it is current.
+    **meta
+        Values for the `meta` table. The DB is only rebuilt if it was made from
+        another metadata DB or with other values.
+
+    Returns
+    -------
+    path : str
+        The location of the side DB.
+    """
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(
+        get_des_archive_access_dir()
+    ):
+        make_des_archive_access_dir()
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with file_lock(path + ".lock"):
+        if not force and side_db_is_current(path, **meta):
+            return path
+
+        meta["db_version"] = get_des_archive_access_db_version()
+        tmp = f"{path}.tmp-{os.getpid()}"
+        conn = connect_des_archive_access_db()
+        out = sqlite3.connect(tmp)
+        try:
+            out.execute("create table meta (key text primary key, value text)")
+            meta.update(populate(conn, out) or {})
+            out.executemany("insert into meta values (?, ?)", sorted(meta.items()))
+            out.commit()
+        except Exception:
+            out.close()
+            os.remove(tmp)
+            raise
+        finally:
+            conn.close()
+        out.close()
+        os.replace(tmp, path)
+
+    return path
 
 
 def download_file(
@@ -56,8 +241,31 @@ def download_file(
     """Download a file FNAME from the DES FNAL archive
     possibly with an optional HTTPS `prefix` and optional `desdata` destination.
 
+    DESDATA is managed as a cache (see `des_archive_access.cache`). Files already
+    in the cache are returned without any network access and, if a size cap is
+    set, least recently used files are evicted to make space for new downloads.
+
     Returns the local path to the file.
     """
+    return _cached_download(
+        fname,
+        prefix=prefix,
+        desdata=desdata,
+        force=force,
+        debug=debug,
+        refresh_token=refresh_token,
+        extra_cli_args=extra_cli_args,
+    )[0]
+
+
+def _cached_download(
+    fname, prefix, desdata, force, debug, refresh_token, extra_cli_args
+):
+    """Download `fname` like `download_file`, returning the local path and
+    whether the file was fetched from the archive (as opposed to found in the
+    cache)."""
+    from des_archive_access.cache import _expected_size, open_desdata_cache
+
     prefix = prefix or os.environ.get(
         "DES_ARCHIVE_ACCESS_ARCHIVE",
         "https://fndcadoor.fnal.gov:2880/des/persistent/DESDM_ARCHIVE",
@@ -66,11 +274,39 @@ def download_file(
 
     fpth = os.path.join(desdata, fname)
     os.makedirs(os.path.dirname(fpth), exist_ok=True)
-    if force:
-        try:
-            os.remove(fpth)
-        except Exception:
-            pass
+
+    cache = open_desdata_cache(desdata)
+    try:
+        if cache is not None and not force and cache.lookup(fname) is not None:
+            return fpth, False
+
+        if force:
+            if cache is not None:
+                cache.remove(fname)
+            try:
+                os.remove(fpth)
+            except Exception:
+                pass
+
+        if cache is not None and cache.size_cap is not None:
+            cache.evict(nbytes=_expected_size(fname) or 0, keep=(fname,))
+
+        _download_file(
+            fname, fpth, prefix, desdata, debug, refresh_token, extra_cli_args
+        )
+
+        if cache is not None:
+            cache.add(fname)
+            cache.evict(keep=(fname,))
+    finally:
+        if cache is not None:
+            cache.close()
+
+    return fpth, True
+
+
+def _download_file(fname, fpth, prefix, desdata, debug, refresh_token, extra_cli_args):
+    """Run curl to download `fname` from the archive at `prefix` to `fpth`."""
 
     if refresh_token:
         try:
@@ -96,40 +332,28 @@ def download_file(
                 "at the command line to debug."
             )
 
-    cmd = (
-        'curl --write-out "%{{http_code}}" -L {} '
-        '-H "Authorization: Bearer $(<{})" -o {} -C - {}/{}'
-    ).format(
-        extra_cli_args,
-        os.path.join(get_des_archive_access_dir(), "bearer_token"),
-        fpth,
-        prefix,
-        fname,
-    )
-
-    if debug:
-        print("RUNNING COMMAND:", cmd, file=sys.stderr)
-
-    res = subprocess.run(
-        cmd,
-        shell=True,
-        check=True,
-        cwd=desdata,
-        # we always capture stdout since the only thing that should be
-        # on stdout is the file path after the download
-        stdout=subprocess.PIPE,
-        # if we are debugging, we let stderr through
-        stderr=None if debug else subprocess.PIPE,
-        text=True,
-    )
-
-    http_code = int(res.stdout)
-    if debug:
-        print(f"HTTP return code: {res.stdout}", file=sys.stderr)
+    # a local file that is at least as large as the remote one makes the range
+    # request to resume the download fail with a 416, so the download is only
+    # complete if the sizes agree
+    for attempt in range(2):
+        http_code, stderr, total = _run_curl(
+            fname, fpth, prefix, desdata, debug, extra_cli_args
+        )
+        if http_code != 416:
+            break
+        if total is not None and os.path.getsize(fpth) == total:
+            return
+        if attempt == 0:
+            print(
+                f"Removing the local copy of {fname} since it does not match the "
+                "size of the file in the archive.",
+                file=sys.stderr,
+            )
+            os.remove(fpth)
 
     if http_code >= 400:
-        if res.stderr:
-            print(res.stderr, file=sys.stderr)
+        if stderr:
+            print(stderr, file=sys.stderr)
         err_str = (
             f"Failed to download file with HTTP error code {http_code}! "
             "Trying the same command on with `--debug` may help you diagnose the error."
@@ -141,7 +365,56 @@ def download_file(
             )
         raise RuntimeError(err_str)
 
-    return fpth
+
+def _run_curl(fname, fpth, prefix, desdata, debug, extra_cli_args):
+    """Run curl to download or resume the download of `fname` to `fpth`.
+
+    Returns the HTTP code, the captured stderr and the total size of the file
+    from the `Content-Range` header of the last response (or None).
+    """
+    fd, hdrs = tempfile.mkstemp(prefix="des-archive-access-headers-")
+    os.close(fd)
+    try:
+        cmd = (
+            'curl --write-out "%{{http_code}}" -L {} '
+            '-H "Authorization: Bearer $(cat {})" -D {} -o {} -C - {}/{}'
+        ).format(
+            extra_cli_args,
+            os.path.join(get_des_archive_access_dir(), "bearer_token"),
+            hdrs,
+            fpth,
+            prefix,
+            fname,
+        )
+
+        if debug:
+            print("RUNNING COMMAND:", cmd, file=sys.stderr)
+
+        res = subprocess.run(
+            cmd,
+            shell=True,
+            check=True,
+            cwd=desdata,
+            # we always capture stdout since the only thing that should be
+            # on stdout is the file path after the download
+            stdout=subprocess.PIPE,
+            # if we are debugging, we let stderr through
+            stderr=None if debug else subprocess.PIPE,
+            text=True,
+        )
+
+        with open(hdrs) as fp:
+            totals = re.findall(
+                r"^content-range:\s*bytes\s+[^/]*/(\d+)", fp.read(), re.I | re.M
+            )
+    finally:
+        os.remove(hdrs)
+
+    http_code = int(res.stdout)
+    if debug:
+        print(f"HTTP return code: {res.stdout}", file=sys.stderr)
+
+    return http_code, res.stderr, int(totals[-1]) if totals else None
 
 
 def download_file_from_desdm(archive_path, source_dir):
@@ -0,0 +1,232 @@
+"""Materialised tables of common joins in the metadata DB.
+
+Most queries join the image tables to `y6a2_file_archive_info` to get the full
+archive path of each file. This module runs a set of declared joins once per
+metadata DB snapshot and stores their results as indexed tables in a side DB.
+Connections to the metadata DB attach the side DB as the schema "joins" and
+expose each table as a temporary view with the name of the join (e.g.,
+`image_paths`), as long as the tables were built from the current snapshot.
+
+Extra joins can be declared in the JSON file `joins.json` in the
+DES_ARCHIVE_ACCESS_DIR as a mapping of names to objects with the keys "sql"
+(the query to materialise) and "indexes" (a list of lists of columns to index).
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+
+from des_archive_access.dbfiles import (
+    build_side_db,
+    get_des_archive_access_db_version,
+    get_des_archive_access_dir,
+    get_side_db_meta,
+    quote_identifier,
+    side_db_is_current,
+)
+
+JOINS_SCHEMA = "joins"
+
+_ARCHIVE_PATH = (
+    "fai.path || '/' || fai.filename || coalesce(fai.compression, '') "
+    "as archive_path"
+)
+
+COMMON_JOINS = {
+    "file_paths": {
+        "sql": (
+            "select fai.filename, " + _ARCHIVE_PATH + ", fai.compression, fai.filesize "
+            "from y6a2_file_archive_info fai "
+            "where fai.archive_name = 'desar2home'"
+        ),
+        "indexes": [["filename"]],
+    },
+    "image_paths": {
+        "sql": (
+            "select i.filename, i.filetype, i.band, i.tilename, i.expnum, "
+            "i.ccdnum, i.pfw_attempt_id, "
+            + _ARCHIVE_PATH
+            + ", fai.compression, fai.filesize "
+            "from y6a2_image i "
+            "join y6a2_file_archive_info fai on fai.filename = i.filename "
+            "where fai.archive_name = 'desar2home'"
+        ),
+        "indexes": [["filename"], ["band", "filetype"], ["tilename"], ["expnum"]],
+    },
+}
+
+_BATCH_SIZE = 10_000
+
+
+def get_joins_db_path():
+    """Get the location of the DB of materialised joins."""
+    return os.environ.get(
+        "DES_ARCHIVE_ACCESS_JOINS_DB",
+        os.path.join(get_des_archive_access_dir(), "joins.db"),
+    )
+
+
+def get_join_declarations():
+    """Get the declared joins, i.e., `COMMON_JOINS` updated with any joins in
+    `joins.json` in the DES_ARCHIVE_ACCESS_DIR."""
+    joins = dict(COMMON_JOINS)
+    fname = os.path.join(get_des_archive_access_dir(), "joins.json")
+    if os.path.exists(fname):
+        with open(fname) as fp:
+            joins.update(json.load(fp))
+    for name, decl in joins.items():
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+            raise RuntimeError(f"The join name '{name}' is not a valid table name!")
+        if "sql" not in decl:
+            raise RuntimeError(f"The join '{name}' does not have any 'sql'!")
+    return joins
+
+
+def joins_are_current(path=None, joins=None):
+    """Check if the joins DB exists, was built from the current metadata DB and
+    has the currently declared joins."""
+    joins = get_join_declarations() if joins is None else joins
+    return side_db_is_current(
+        path or get_joins_db_path(), joins=json.dumps(joins, sort_keys=True)
+    )
+
+
+def joins_are_stale(path=None):
+    """Check if the joins DB exists but is not current."""
+    path = path or get_joins_db_path()
+    return os.path.exists(path) and not joins_are_current(path)
+
+
+def build_joins(path=None, force=False, verbose=False):
+    """Materialise the declared joins into the joins DB.
+
+    Parameters
+    ----------
+    path : str, optional
+        The location of the joins DB. The default comes from
+        `get_joins_db_path`.
+    force : bool, optional
+        If True, rebuild the tables even if they are up to date.
+    verbose : bool, optional
+        If True, print progress to stderr.
+
+    Returns
+    -------
+    path : str
+        The location of the joins DB.
+    """
+    joins = get_join_declarations()
+
+    def _populate(conn, out):
+        tables = []
+        for name, decl in sorted(joins.items()):
+            try:
+                curr = conn.execute(decl["sql"])
+            except sqlite3.OperationalError as e:
+                # not every metadata DB has every table
+                print(
+                    "skipping the join %s: %s" % (name, e),
+                    file=sys.stderr,
+                )
+                continue
+            tables.append(name)
+            columns = [d[0] for d in curr.description]
+            out.execute(
+                "create table %s (%s)"
+                % (
+                    quote_identifier(name),
+                    ", ".join(quote_identifier(col) for col in columns),
+                )
+            )
+            sql = "insert into %s values (%s)" % (
+                quote_identifier(name),
+                ", ".join(["?"] * len(columns)),
+            )
+            nrows = 0
+            while True:
+                rows = curr.fetchmany(_BATCH_SIZE)
+                if not rows:
+                    break
+                out.executemany(sql, rows)
+                nrows += len(rows)
+
+            for cols in decl.get("indexes", []):
+                out.execute(
+                    "create index %s on %s (%s)"
+                    % (
+                        quote_identifier("%s_%s_idx" % (name, "_".join(cols))),
+                        quote_identifier(name),
+                        ", ".join(quote_identifier(col) for col in cols),
+                    )
+                )
+            if verbose:
+                print("materialised %d rows for %s" % (nrows, name), file=sys.stderr)
+
+        out.commit()
+        # the tables are only read from now on, so we let sqlite plan queries
+        # against them with statistics
+        out.execute("analyze")
+        return {"tables": json.dumps(tables)}
+
+    return build_side_db(
+        path or get_joins_db_path(),
+        _populate,
+        force=force,
+        joins=json.dumps(joins, sort_keys=True),
+    )
+
+
+def attach_joins(conn, path=None):
+    """Attach the joins DB to `conn` as the schema "joins" and make a temporary
+    view for each join if the DB is current, returning True if it was attached.
+
+    Out-of-date joins are never rebuilt here since that takes a while. Queries
+    use the plain tables instead until the joins are rebuilt, e.g., by
+    `des-archive-access-download-metadata`.
+    """
+    path = path or get_joins_db_path()
+    meta = get_side_db_meta(path)
+    if meta is None:
+        return False
+    if meta.get("db_version") != get_des_archive_access_db_version():
+        print(
+            f"The materialised joins in {path} were built from another metadata "
+            "DB and are not used! Run 'des-archive-access-download-metadata' or "
+            "'des-archive-access-build-joins' to rebuild them.",
+            file=sys.stderr,
+        )
+        return False
+
+    conn.execute("attach database ? as %s" % JOINS_SCHEMA, (f"file:{path}?mode=ro",))
+    for name in json.loads(meta["tables"]):
+        conn.execute(
+            "create temp view if not exists %s as select * from %s.%s"
+            % (quote_identifier(name), JOINS_SCHEMA, quote_identifier(name))
+        )
+    return True
+
+
+def refresh_joins(path=None):
+    """Rebuild the joins DB if it exists but is out of date, e.g., after a new
+    metadata DB snapshot was downloaded, returning True if it was rebuilt.
+
+    This is run by `des-archive-access-download-metadata` and not when queries
+    are run.
+    """
+    path = path or get_joins_db_path()
+    try:
+        stale = joins_are_stale(path)
+    except FileNotFoundError:
+        # there is no metadata DB to rebuild them from
+        return False
+    if not stale:
+        return False
+    print(
+        "rebuilding the materialised joins for the new metadata DB...",
+        file=sys.stderr,
+        flush=True,
+    )
+    build_joins(path=path)
+    return True
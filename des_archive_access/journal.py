@@ -0,0 +1,176 @@
+"""Sharded list downloads and their completion journals.
+
+A list of files can be split across the tasks of a batch array job with
+`--shard i/N`. Each path goes to the shard given by a stable hash of the path,
+so every task computes the same partition without any coordination and a path
+always lands in the same shard.
+
+Each task can append a line of JSON for each file it downloads or fails to
+download to its own file in a shared journal directory. A task that is rerun
+skips the files its journal already records as done, and
+`des-archive-access-download-report` merges the journals of all tasks into a
+single completion report.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import socket
+import time
+
+JOURNAL_GLOB = "shard-*.jsonl"
+
+
+def parse_shard(shard):
+    """Parse a shard specification "i/N" into (i, N), with 0 <= i < N."""
+    try:
+        index, nshards = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"The shard must be of the form 'i/N', got '{shard}'!")
+    if nshards < 1 or not 0 <= index < nshards:
+        raise ValueError(
+            f"The shard index must be in [0, N) with N >= 1, got '{shard}'!"
+        )
+    return index, nshards
+
+
+def get_shard(path, nshards):
+    """Get the shard in [0, `nshards`) of an archive `path`.
+
+    The shard comes from the SHA-1 hash of the path so that it is the same on
+    every machine and Python version.
+    """
+    digest = hashlib.sha1(path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % nshards
+
+
+def shard_paths(paths, index, nshards):
+    """Get the paths in `paths` that belong to shard `index` of `nshards`."""
+    return [path for path in paths if get_shard(path, nshards) == index]
+
+
+def get_journal_path(journal_dir, index, nshards):
+    """Get the journal file for shard `index` of `nshards`."""
+    return os.path.join(journal_dir, "shard-%05d-of-%05d.jsonl" % (index, nshards))
+
+
+def read_journal(fname):
+    """Read the records in a journal file, skipping any truncated last line."""
+    records = []
+    if not os.path.exists(fname):
+        return records
+    with open(fname) as fp:
+        for line in fp:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # a task killed mid-write leaves a partial line
+                pass
+    return records
+
+
+def get_done_paths(fname):
+    """Get the set of paths recorded as done in a journal file."""
+    return {rec["path"] for rec in read_journal(fname) if rec.get("status") == "done"}
+
+
+class Journal:
+    """Append the status of each download of a shard to its journal file.
+
+    Parameters
+    ----------
+    journal_dir : str
+        The directory shared by all shards.
+    index : int
+        The index of the shard.
+    nshards : int
+        The total number of shards.
+    """
+
+    def __init__(self, journal_dir, index, nshards):
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = get_journal_path(journal_dir, index, nshards)
+        self.index = index
+        self.nshards = nshards
+        self.host = socket.gethostname()
+        # the journal exists as soon as the shard starts, so that shards with no
+        # files still show up in the report
+        open(self.path, "a").close()
+
+    def done_paths(self):
+        """Get the set of paths this shard has already downloaded."""
+        return get_done_paths(self.path)
+
+    def record(self, path, status, seconds, nbytes=None, error=None):
+        """Record that the download of `path` ended with `status` ("done" or
+        "failed")."""
+        rec = {
+            "path": path,
+            "status": status,
+            "shard": "%d/%d" % (self.index, self.nshards),
+            "host": self.host,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seconds": seconds,
+            "bytes": nbytes,
+            "error": error,
+        }
+        # each record is a single small write to a file only this shard
+        # writes, so the journal stays valid if the task is killed
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(rec) + "\n")
+
+
+def merge_journals(journal_dir, paths=None):
+    """Merge the journals of all shards into a completion report.
+
+    Parameters
+    ----------
+    journal_dir : str
+        The directory with the journal files.
+    paths : list of str, optional
+        The full list of paths that should be downloaded. If given, paths in the
+        list that no journal mentions are reported as pending.
+
+    Returns
+    -------
+    report : dict
+        The report with the number of shards that started a journal, the lists
+        of done, failed and pending paths, the total bytes downloaded, and the
+        number of files and bytes done by each host.
+    """
+    status = {}
+    nbytes = {}
+    errors = {}
+    hosts = {}
+    fnames = sorted(glob.glob(os.path.join(journal_dir, JOURNAL_GLOB)))
+    for fname in fnames:
+        for rec in read_journal(fname):
+            path = rec["path"]
+            # a path is done if any attempt succeeded
+            if status.get(path) == "done":
+                continue
+            status[path] = rec["status"]
+            if rec["status"] == "done":
+                nbytes[path] = rec.get("bytes") or 0
+                host = hosts.setdefault(rec.get("host"), {"files": 0, "bytes": 0})
+                host["files"] += 1
+                host["bytes"] += nbytes[path]
+            else:
+                errors[path] = rec.get("error")
+
+    done = sorted(p for p, s in status.items() if s == "done")
+    failed = sorted(p for p, s in status.items() if s != "done")
+    pending = []
+    if paths is not None:
+        pending = sorted(set(paths) - set(status))
+
+    return {
+        "shards": len(fnames),
+        "done": done,
+        "failed": failed,
+        "pending": pending,
+        "errors": {p: errors[p] for p in failed},
+        "bytes": sum(nbytes.values()),
+        "hosts": hosts,
+    }
@@ -1,13 +1,22 @@
 import os
 
 import click
-from click_repl import repl
-from prompt_toolkit.history import FileHistory
 
-from des_archive_access.dbfiles import get_des_archive_access_db_conn
-from des_archive_access.sql import parse_and_execute_query
+from des_archive_access.dbfiles import (
+    get_des_archive_access_db,
+    get_des_archive_access_db_conn,
+)
+from des_archive_access.sql import explain_query, parse_and_execute_query
 
 IN_REPL = False
+TIMING = False
+
+
+def _close_db_conn():
+    # the connection is only closed if it was opened, so that leaving the shell
+    # does not fail without a DB
+    if get_des_archive_access_db_conn.cache_info().currsize:
+        get_des_archive_access_db_conn().close()
 
 
 class _Group(click.Group):
@@ -40,8 +49,20 @@ class _Group(click.Group):
     type=str,
     help="Load a SQL command from the command line and execute it.",
 )
+@click.option(
+    "--count",
+    is_flag=True,
+    default=False,
+    help="Always report the total number of rows returned by the query.",
+)
+@click.option(
+    "--timing",
+    is_flag=True,
+    default=False,
+    help="Report the time spent in each phase of the query.",
+)
 @click.pass_context
-def cli(ctx, command, loadsql):
+def cli(ctx, command, loadsql, count, timing):
     """DES archive access CLI
 
     Execute `des-archive-access` at the command line to run queries
@@ -60,9 +81,9 @@ def cli(ctx, command, loadsql):
 
     if query is not None:
         try:
-            parse_and_execute_query(query)
+            parse_and_execute_query(query, count=count, timing=timing)
         finally:
-            get_des_archive_access_db_conn().close()
+            _close_db_conn()
     else:
         if ctx.invoked_subcommand is None:
             ctx.invoke(sqlrepl)
@@ -73,6 +94,35 @@ def sqlrepl():
     """Alternative way of staring the SQL shell."""
     global IN_REPL
 
+    # the REPL dependencies are imported here so that one-shot queries
+    # at the command line start quickly
+    from click_repl import ClickCompleter, repl
+    from prompt_toolkit.completion import merge_completers
+    from prompt_toolkit.history import FileHistory
+
+    from des_archive_access.catalogue import (
+        build_catalogue_in_background,
+        get_schema_completer,
+        load_cached_catalogue,
+    )
+
+    ctx = click.get_current_context()
+    group_ctx = ctx.parent or ctx
+
+    # the shell starts right away and completes commands only until the schema
+    # catalogue is ready, since extracting it scans parts of the DB
+    completers = [ClickCompleter(group_ctx.command, ctx=group_ctx)]
+    try:
+        catalogue = load_cached_catalogue()
+    except FileNotFoundError:
+        # without a DB, queries fail with their own error message
+        pass
+    else:
+        schema_completer = get_schema_completer(catalogue)
+        completers.append(schema_completer)
+        if catalogue is None:
+            build_catalogue_in_background(schema_completer.set_catalogue)
+
     prompt_kwargs = {
         "history": FileHistory(
             os.path.join(
@@ -80,18 +130,104 @@ def sqlrepl():
                 "history",
             ),
         ),
+        "completer": merge_completers(completers),
     }
     try:
         IN_REPL = True
-        repl(click.get_current_context(), prompt_kwargs=prompt_kwargs)
+        repl(ctx, prompt_kwargs=prompt_kwargs)
     finally:
         IN_REPL = False
-        get_des_archive_access_db_conn().close()
+        _close_db_conn()
 
 
 @cli.command()
+@click.option(
+    "--count",
+    is_flag=True,
+    default=False,
+    help="Always report the total number of rows returned by the query.",
+)
 @click.argument("query", nargs=-1, required=True)
-def sql(query):
+def sql(query, count):
     """Execute a QUERY."""
     query = " ".join(query)
-    parse_and_execute_query(query)
+    parse_and_execute_query(query, count=count, timing=TIMING)
+
+
+@cli.command()
+@click.argument("state", required=False, type=click.Choice(["on", "off"]))
+def timing(state):
+    """Toggle (or turn on/off) reporting the time spent in each query phase."""
+    global TIMING
+
+    if state is None:
+        TIMING = not TIMING
+    else:
+        TIMING = state == "on"
+    click.echo("timing is %s" % ("on" if TIMING else "off"))
+
+
+@cli.command()
+@click.argument("query", nargs=-1, required=True)
+def explain(query):
+    """Show the query plan for a QUERY, highlighting full table scans."""
+    query = " ".join(query)
+    explain_query(query)
+
+
+@cli.command(context_settings={"ignore_unknown_options": True})
+@click.option("--tiles", is_flag=True, default=False, help="Find coadd tiles.")
+@click.option("--filetype", default=None, type=str, help="Only find this filetype.")
+@click.option("--band", default=None, type=str, help="Only find this band.")
+@click.argument("ra", type=float)
+@click.argument("dec", type=float)
+@click.argument("radius", type=float)
+def cone(ra, dec, radius, tiles, filetype, band):
+    """Find the images (or tiles) overlapping a cone at RA, DEC with RADIUS
+    in degrees using the spatial index."""
+    from des_archive_access import spatial
+
+    if tiles:
+        names = spatial.tiles_overlapping(ra, dec, radius)
+    else:
+        names = spatial.cone(ra, dec, radius, filetype=filetype, band=band)
+    for name in names:
+        click.echo(name)
+    click.echo("found %d %s" % (len(names), "tiles" if tiles else "images"))
+
+
+def _load_catalogue():
+    from des_archive_access.catalogue import load_catalogue
+
+    try:
+        return load_catalogue()
+    except FileNotFoundError:
+        raise click.ClickException(
+            f"The metadata DB at {get_des_archive_access_db()} does not exist! "
+            "Run 'des-archive-access-download-metadata' to download it."
+        )
+
+
+@cli.command()
+@click.argument("pattern", required=False)
+def tables(pattern):
+    """List the tables (matching the glob PATTERN) with their approximate
+    row counts."""
+    from des_archive_access.catalogue import list_tables
+
+    for line in list_tables(_load_catalogue(), pattern=pattern):
+        click.echo(line)
+
+
+@cli.command()
+@click.argument("table")
+def describe(table):
+    """Describe the columns and indexes of a TABLE."""
+    from des_archive_access.catalogue import describe_table
+
+    try:
+        lines = describe_table(_load_catalogue(), table)
+    except KeyError as e:
+        raise click.ClickException(e.args[0])
+    for line in lines:
+        click.echo(line)
@@ -0,0 +1,494 @@
+"""Query the metadata DB directly from a seekable zstd file.
+
+A seekable zstd file (see
+https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md)
+is a sequence of independent zstd frames, each holding a fixed amount of the
+uncompressed data, followed by a skippable frame with a seek table giving the
+compressed and uncompressed size of each frame. Any byte range of the
+uncompressed data can be read by decompressing only the frames that hold it.
+
+The metadata DB is read from such a file through a custom SQLite VFS made with
+the optional dependency `apsw`. The VFS decompresses the frames that hold the
+pages SQLite asks for and keeps them in an LRU cache, so the DB never has to be
+decompressed on disk.
+"""
+
+import bisect
+import os
+import sqlite3
+import struct
+import threading
+from collections import OrderedDict
+
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+
+_SKIPPABLE_HEADER = struct.Struct("<II")
+_SEEK_TABLE_FOOTER = struct.Struct("<IBI")
+_SEEK_TABLE_ENTRY = struct.Struct("<II")
+_SEEK_TABLE_ENTRY_CHECKSUM = struct.Struct("<III")
+
+DEFAULT_FRAME_SIZE = 256 * 1024
+DEFAULT_LEVEL = 3
+DEFAULT_CACHE_SIZE_MB = 256
+
+VFS_NAME = "des_archive_access_seekable"
+
+
+def get_seekable_cache_size_mb():
+    """Get the size of the cache of decompressed frames in MB from the
+    environment variable DES_ARCHIVE_ACCESS_SEEKABLE_CACHE_MB."""
+    return float(
+        os.environ.get("DES_ARCHIVE_ACCESS_SEEKABLE_CACHE_MB", DEFAULT_CACHE_SIZE_MB)
+    )
+
+
+def _read_full(fp, size):
+    """Read `size` bytes from `fp`, returning fewer only at the end of the
+    stream."""
+    chunks = []
+    while size > 0:
+        chunk = fp.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def write_seekable(ifh, ofh, frame_size=DEFAULT_FRAME_SIZE, level=DEFAULT_LEVEL):
+    """Compress the data read from `ifh` into a seekable zstd file written to
+    `ofh`.
+
+    Parameters
+    ----------
+    ifh : file-like
+        The file to read the uncompressed data from.
+    ofh : file-like
+        The file to write the seekable zstd data to.
+    frame_size : int, optional
+        The amount of uncompressed data in each frame. Smaller frames make
+        random reads cheaper but compress less well.
+    level : int, optional
+        The zstd compression level.
+
+    Returns
+    -------
+    nframes : int
+        The number of frames written.
+    """
+    import zstandard
+
+    cctx = zstandard.ZstdCompressor(level=level)
+    entries = []
+    while True:
+        data = _read_full(ifh, frame_size)
+        if not data:
+            break
+        frame = cctx.compress(data)
+        ofh.write(frame)
+        entries.append(_SEEK_TABLE_ENTRY.pack(len(frame), len(data)))
+
+    table = b"".join(entries) + _SEEK_TABLE_FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC)
+    ofh.write(_SKIPPABLE_HEADER.pack(SKIPPABLE_MAGIC, len(table)))
+    ofh.write(table)
+    return len(entries)
+
+
+def make_seekable_db(src, dst, frame_size=DEFAULT_FRAME_SIZE, level=DEFAULT_LEVEL):
+    """Make a seekable zstd copy `dst` of the DB at `src`.
+
+    If `src` is itself zstd compressed (i.e., its name ends in ".zst"), it is
+    decompressed on the fly so that the uncompressed DB is never written to disk.
+    """
+    import zstandard
+
+    with open(src, "rb") as ifh, open(dst, "wb") as ofh:
+        if src.endswith(".zst"):
+            with zstandard.ZstdDecompressor().stream_reader(ifh) as reader:
+                write_seekable(reader, ofh, frame_size=frame_size, level=level)
+        else:
+            write_seekable(ifh, ofh, frame_size=frame_size, level=level)
+
+
+def read_seek_table(fp):
+    """Read the seek table at the end of the seekable zstd file `fp`.
+
+    Returns
+    -------
+    table : list of tuples
+        A list of (compressed offset, uncompressed offset, compressed size,
+        uncompressed size) for each frame.
+
+    Raises
+    ------
+    ValueError
+        If the file does not end with a seek table.
+    """
+    fp.seek(0, os.SEEK_END)
+    fsize = fp.tell()
+    if fsize < _SKIPPABLE_HEADER.size + _SEEK_TABLE_FOOTER.size:
+        raise ValueError("The file is too small to be a seekable zstd file!")
+
+    fp.seek(fsize - _SEEK_TABLE_FOOTER.size)
+    nframes, descriptor, magic = _SEEK_TABLE_FOOTER.unpack(
+        fp.read(_SEEK_TABLE_FOOTER.size)
+    )
+    if magic != SEEKABLE_MAGIC:
+        raise ValueError("The file does not end with a zstd seek table!")
+
+    entry = _SEEK_TABLE_ENTRY_CHECKSUM if descriptor & 0x80 else _SEEK_TABLE_ENTRY
+    table_size = nframes * entry.size + _SEEK_TABLE_FOOTER.size
+    fp.seek(fsize - table_size - _SKIPPABLE_HEADER.size)
+    skippable_magic, frame_size = _SKIPPABLE_HEADER.unpack(
+        fp.read(_SKIPPABLE_HEADER.size)
+    )
+    if skippable_magic != SKIPPABLE_MAGIC or frame_size != table_size:
+        raise ValueError("The zstd seek table is corrupt!")
+
+    data = fp.read(nframes * entry.size)
+    table = []
+    coffset = 0
+    doffset = 0
+    for i in range(nframes):
+        csize, dsize = entry.unpack_from(data, i * entry.size)[:2]
+        table.append((coffset, doffset, csize, dsize))
+        coffset += csize
+        doffset += dsize
+    return table
+
+
+def is_seekable_zstd(path):
+    """Check if the file at `path` is a seekable zstd file."""
+    try:
+        with open(path, "rb") as fp:
+            read_seek_table(fp)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class SeekableZstdReader:
+    """Random access reads of the uncompressed data in a seekable zstd file.
+
+    Decompressed frames are kept in an LRU cache of at most `cache_size_mb` MB.
+    The reader is safe to use from multiple threads.
+
+    Parameters
+    ----------
+    path : str
+        The location of the seekable zstd file.
+    cache_size_mb : float, optional
+        The size of the cache of decompressed frames in MB. The default comes
+        from `get_seekable_cache_size_mb`.
+
+    Attributes
+    ----------
+    size : int
+        The size of the uncompressed data.
+    hits : int
+        The number of frame reads served from the cache.
+    misses : int
+        The number of frames decompressed.
+    """
+
+    def __init__(self, path, cache_size_mb=None):
+        if cache_size_mb is None:
+            cache_size_mb = get_seekable_cache_size_mb()
+        self.path = path
+        self.cache_size = int(cache_size_mb * 1024 * 1024)
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            with open(path, "rb") as fp:
+                self._table = read_seek_table(fp)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._doffsets = [row[1] for row in self._table]
+        self.size = self._table[-1][1] + self._table[-1][3] if self._table else 0
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_frame(self, index):
+        with self._lock:
+            data = self._cache.get(index, None)
+            if data is not None:
+                self._cache.move_to_end(index)
+                self.hits += 1
+                return data
+
+        import zstandard
+
+        coffset, _, csize, dsize = self._table[index]
+        data = zstandard.ZstdDecompressor().decompress(
+            os.pread(self._fd, csize, coffset), max_output_size=dsize
+        )
+
+        with self._lock:
+            self.misses += 1
+            if index not in self._cache:
+                self._cache[index] = data
+                self._cached_bytes += len(data)
+                # we always keep the frame we just read
+                while self._cached_bytes > self.cache_size and len(self._cache) > 1:
+                    _, old = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(old)
+        return data
+
+    def read(self, size, offset):
+        """Read up to `size` bytes of the uncompressed data at `offset`."""
+        size = max(min(size, self.size - offset), 0)
+        chunks = []
+        index = bisect.bisect_right(self._doffsets, offset) - 1
+        while size > 0:
+            data = self._get_frame(index)
+            start = offset - self._table[index][1]
+            chunk = data[start : start + size]
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+            index += 1
+        return b"".join(chunks)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._cache.clear()
+            self._cached_bytes = 0
+
+
+class _SeekableVFSFile:
+    """A read-only SQLite file backed by a `SeekableZstdReader`."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def xRead(self, amount, offset):
+        # SQLite fills any short read with zeros itself
+        return self.reader.read(amount, offset)
+
+    def xFileSize(self):
+        return self.reader.size
+
+    def xClose(self):
+        self.reader.close()
+
+    def xLock(self, level):
+        pass
+
+    def xUnlock(self, level):
+        pass
+
+    def xCheckReservedLock(self):
+        return False
+
+    def xFileControl(self, op, ptr):
+        return False
+
+    def xSectorSize(self):
+        return 4096
+
+    def xDeviceCharacteristics(self):
+        return 0
+
+    def xSync(self, flags):
+        pass
+
+    def xWrite(self, data, offset):
+        import apsw
+
+        raise apsw.ReadOnlyError("The seekable metadata DB is read-only!")
+
+    def xTruncate(self, newsize):
+        import apsw
+
+        raise apsw.ReadOnlyError("The seekable metadata DB is read-only!")
+
+
+_VFS = None
+_VFS_LOCK = threading.Lock()
+
+
+def _get_vfs():
+    """Register the seekable zstd VFS with SQLite once and return it."""
+    global _VFS
+
+    import apsw
+
+    class _SeekableVFS(apsw.VFS):
+        def __init__(self):
+            super().__init__(VFS_NAME, "")
+            self.cache_size_mb = {}
+
+        def xOpen(self, name, flags):
+            fname = name.filename() if hasattr(name, "filename") else name
+            # attached DBs that are not seekable zstd files use the default VFS
+            if flags[0] & apsw.SQLITE_OPEN_MAIN_DB and fname.endswith(".zst"):
+                return _SeekableVFSFile(
+                    SeekableZstdReader(
+                        fname,
+                        cache_size_mb=self.cache_size_mb.get(fname, None),
+                    )
+                )
+            return super().xOpen(name, flags)
+
+    with _VFS_LOCK:
+        if _VFS is None:
+            _VFS = _SeekableVFS()
+    return _VFS
+
+
+def _convert_error(e):
+    """Convert an `apsw` exception to the matching `sqlite3` one."""
+    import apsw
+
+    if isinstance(e, (apsw.SQLError, apsw.ReadOnlyError, apsw.BusyError)):
+        exc = sqlite3.OperationalError
+    elif isinstance(e, apsw.ConstraintError):
+        exc = sqlite3.IntegrityError
+    elif isinstance(e, (apsw.BindingsError, apsw.ExecutionCompleteError)):
+        exc = sqlite3.ProgrammingError
+    else:
+        exc = sqlite3.DatabaseError
+    return exc(str(e))
+
+
+class SeekableCursor:
+    """A cursor over a seekable metadata DB with the parts of the
+    `sqlite3.Cursor` API used to read query results."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.arraysize = 1
+        self.description = None
+        self._cursor = connection._conn.cursor()
+        self._cursor.exec_trace = self._trace
+        self._rows = iter(())
+
+    def _trace(self, cursor, sql, bindings):
+        # the description is only available while a statement is running, so we
+        # record it as each statement starts
+        self.description = cursor.description
+        return True
+
+    def execute(self, sql, parameters=()):
+        import apsw
+
+        self.description = None
+        try:
+            self._rows = iter(self._cursor.execute(sql, parameters))
+        except apsw.Error as e:
+            raise _convert_error(e) from e
+        return self
+
+    def _next(self):
+        import apsw
+
+        try:
+            return next(self._rows)
+        except apsw.Error as e:
+            raise _convert_error(e) from e
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._next()
+
+    def fetchone(self):
+        try:
+            return self._next()
+        except StopIteration:
+            return None
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = []
+        for _ in range(size):
+            row = self.fetchone()
+            if row is None:
+                break
+            rows.append(row)
+        return rows
+
+    def fetchall(self):
+        return list(self)
+
+    def close(self):
+        self._rows = iter(())
+        self._cursor.close()
+
+
+class SeekableConnection:
+    """A read-only connection to a seekable metadata DB with the parts of the
+    `sqlite3.Connection` API used by this package."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return SeekableCursor(self)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        import apsw
+
+        try:
+            self._conn.cursor().executemany(sql, seq_of_parameters)
+        except apsw.Error as e:
+            raise _convert_error(e) from e
+
+    def create_function(self, name, narg, func, deterministic=False):
+        self._conn.create_scalar_function(name, func, narg, deterministic=deterministic)
+
+    def close(self):
+        self._conn.close()
+
+
+def connect_seekable_db(path, cache_size_mb=None):
+    """Open a read-only connection to the DB in the seekable zstd file at `path`.
+
+    Parameters
+    ----------
+    path : str
+        The location of the seekable zstd file.
+    cache_size_mb : float, optional
+        The size of the cache of decompressed frames in MB. The default comes
+        from `get_seekable_cache_size_mb`.
+
+    Returns
+    -------
+    conn : SeekableConnection
+        The connection.
+    """
+    try:
+        import apsw
+    except ImportError as e:
+        raise RuntimeError(
+            "Querying a seekable zstd metadata DB requires the `apsw` package!"
+        ) from e
+
+    path = os.path.abspath(path)
+    if not is_seekable_zstd(path):
+        raise RuntimeError(
+            f"The metadata DB {path} is not a seekable zstd file! Download it "
+            "again with `des-archive-access-download-metadata --seekable`."
+        )
+
+    vfs = _get_vfs()
+    vfs.cache_size_mb[path] = cache_size_mb
+    try:
+        conn = apsw.Connection(
+            f"file:{path}?mode=ro&immutable=1",
+            flags=apsw.SQLITE_OPEN_READONLY | apsw.SQLITE_OPEN_URI,
+            vfs=VFS_NAME,
+        )
+    except apsw.Error as e:
+        raise _convert_error(e) from e
+    return SeekableConnection(conn)
@@ -0,0 +1,372 @@
+"""A spatial index of the image and coadd tile footprints in the metadata DB.
+
+The index is a side DB holding SQLite R*Tree tables of the RA/Dec bounding
+boxes of the footprints of the images in `y6a2_image` and the tiles in
+`y6a2_coaddtile_geom`. Footprints that cross RA = 0 are split into two boxes.
+Cone searches first find the boxes that overlap the bounding box of the cone
+with the R*Tree and then keep the footprints whose bounding box comes within
+the cone radius of its center, so they never scan the metadata DB tables.
+
+The index is tagged with the version of the metadata DB it was built from
+(see `get_des_archive_access_db_version`) and is ignored once it is stale.
+"""
+
+import math
+import os
+import sqlite3
+import sys
+
+from des_archive_access.dbfiles import (
+    build_side_db,
+    connect_des_archive_access_db,
+    get_des_archive_access_dir,
+    side_db_is_current,
+)
+
+SPATIAL_SCHEMA = "spatial"
+
+_INDEX_SCHEMA = """\
+create virtual table image_rtree using rtree(
+    id, ra_min, ra_max, dec_min, dec_max, +filename, +filetype, +band
+);
+create virtual table tile_rtree using rtree(
+    id, ra_min, ra_max, dec_min, dec_max, +tilename
+);
+"""
+
+_BATCH_SIZE = 10_000
+
+
+def get_spatial_index_path():
+    """Get the location of the spatial index."""
+    return os.environ.get(
+        "DES_ARCHIVE_ACCESS_SPATIAL_DB",
+        os.path.join(get_des_archive_access_dir(), "spatial.db"),
+    )
+
+
+def ang_sep(ra1, dec1, ra2, dec2):
+    """Get the angular separation in degrees between two points on the sky
+    given in degrees."""
+    if ra1 is None or dec1 is None or ra2 is None or dec2 is None:
+        return None
+    ra1, dec1, ra2, dec2 = map(math.radians, (ra1, dec1, ra2, dec2))
+    # the haversine formula is accurate for small separations
+    sdec = math.sin((dec2 - dec1) / 2)
+    sra = math.sin((ra2 - ra1) / 2)
+    a = sdec * sdec + math.cos(dec1) * math.cos(dec2) * sra * sra
+    return math.degrees(2 * math.asin(min(1.0, math.sqrt(a))))
+
+
+def in_cone(ra, dec, ra0, dec0, radius):
+    """Return 1 if the point (`ra`, `dec`) is within `radius` degrees of
+    (`ra0`, `dec0`) and 0 otherwise."""
+    sep = ang_sep(ra, dec, ra0, dec0)
+    if sep is None or radius is None:
+        return None
+    return int(sep <= radius)
+
+
+def _box_sep(ra, dec, ra_min, ra_max, dec_min, dec_max):
+    """Get the angular separation in degrees between (`ra`, `dec`) and the
+    closest point of an RA/Dec box that does not cross RA = 0."""
+    cdec = min(max(dec, dec_min), dec_max)
+    if ra_min <= ra <= ra_max:
+        cra = ra
+    else:
+        # pick the closest edge going around the sky either way
+        cra = min(
+            (ra_min, ra_max),
+            key=lambda edge: min((ra - edge) % 360, (edge - ra) % 360),
+        )
+    return ang_sep(ra, dec, cra, cdec)
+
+
+def register_spatial_functions(conn):
+    """Register the `ang_sep`, `in_cone` and `box_sep` SQL functions on `conn`.
+
+    `ang_sep(ra1, dec1, ra2, dec2)` is the angular separation in degrees of two
+    points, `in_cone(ra, dec, ra0, dec0, radius)` is 1 if a point is within
+    `radius` degrees of another and `box_sep(ra, dec, ra_min, ra_max, dec_min,
+    dec_max)` is the separation of a point from an RA/Dec box like those in the
+    spatial index.
+    """
+    conn.create_function("ang_sep", 4, ang_sep, deterministic=True)
+    conn.create_function("in_cone", 5, in_cone, deterministic=True)
+    conn.create_function("box_sep", 6, _box_sep, deterministic=True)
+
+
+def _footprint_boxes(racs, decs, crossra0):
+    """Get the RA/Dec boxes covering a footprint with corners `racs` and `decs`,
+    splitting it in two if it crosses RA = 0."""
+    dec_min, dec_max = min(decs), max(decs)
+    if crossra0 == "Y":
+        racs = [r - 360 if r > 180 else r for r in racs]
+        ra_min, ra_max = min(racs), max(racs)
+        return [
+            (ra_min + 360, 360.0, dec_min, dec_max),
+            (0.0, ra_max, dec_min, dec_max),
+        ]
+    return [(min(racs), max(racs), dec_min, dec_max)]
+
+
+def _get_tables(conn):
+    return {
+        row[0]
+        for row in conn.execute(
+            "select lower(name) from sqlite_master where type in ('table', 'view')"
+        ).fetchall()
+    }
+
+
+def _insert_boxes(out, table, columns, rows, make_boxes):
+    nboxes = 0
+    sql = "insert into %s (ra_min, ra_max, dec_min, dec_max, %s) values (%s)" % (
+        table,
+        ", ".join(columns),
+        ", ".join(["?"] * (4 + len(columns))),
+    )
+    while True:
+        batch = rows.fetchmany(_BATCH_SIZE)
+        if not batch:
+            break
+        boxes = []
+        for row in batch:
+            for box in make_boxes(row):
+                boxes.append(box + tuple(row[: len(columns)]))
+        out.executemany(sql, boxes)
+        nboxes += len(boxes)
+    return nboxes
+
+
+def build_spatial_index(path=None, force=False, verbose=False):
+    """Build the spatial index of the footprints in the metadata DB.
+
+    Parameters
+    ----------
+    path : str, optional
+        The location of the index. The default comes from
+        `get_spatial_index_path`.
+    force : bool, optional
+        If True, rebuild the index even if it is up to date.
+    verbose : bool, optional
+        If True, print progress to stderr.
+
+    Returns
+    -------
+    path : str
+        The location of the index.
+    """
+
+    def _populate(conn, out):
+        out.executescript(_INDEX_SCHEMA)
+        tables = _get_tables(conn)
+
+        if "y6a2_image" in tables:
+            curr = conn.execute(
+                "select filename, filetype, band, "
+                "rac1, rac2, rac3, rac4, decc1, decc2, decc3, decc4, crossra0 "
+                "from y6a2_image where rac1 is not null"
+            )
+            nimg = _insert_boxes(
+                out,
+                "image_rtree",
+                ["filename", "filetype", "band"],
+                curr,
+                lambda row: _footprint_boxes(row[3:7], row[7:11], row[11]),
+            )
+            if verbose:
+                print("indexed %d image boxes" % nimg, file=sys.stderr)
+
+        if "y6a2_coaddtile_geom" in tables:
+            curr = conn.execute(
+                "select tilename, racmin, racmax, deccmin, deccmax, crossra0 "
+                "from y6a2_coaddtile_geom"
+            )
+            ntile = _insert_boxes(
+                out,
+                "tile_rtree",
+                ["tilename"],
+                curr,
+                lambda row: _footprint_boxes(
+                    (row[1], row[2]), (row[3], row[4]), row[5]
+                ),
+            )
+            if verbose:
+                print("indexed %d tile boxes" % ntile, file=sys.stderr)
+
+    return build_side_db(path or get_spatial_index_path(), _populate, force=force)
+
+
+def spatial_index_is_current(path=None):
+    """Check if the spatial index exists and matches the metadata DB."""
+    return side_db_is_current(path or get_spatial_index_path())
+
+
+def attach_spatial_index(conn, path=None):
+    """Attach the spatial index to `conn` as the schema "spatial" if it is
+    current, returning True if it was attached."""
+    path = path or get_spatial_index_path()
+    if not spatial_index_is_current(path):
+        return False
+    conn.execute("attach database ? as %s" % SPATIAL_SCHEMA, (f"file:{path}?mode=ro",))
+    return True
+
+
+def _cone_boxes(ra, dec, radius):
+    """Get the RA/Dec boxes that cover a cone, splitting it at RA = 0."""
+    dec_min = max(dec - radius, -90.0)
+    dec_max = min(dec + radius, 90.0)
+    if dec_max >= 90 or dec_min <= -90:
+        return [(0.0, 360.0, dec_min, dec_max)]
+
+    # the widest extent in RA of a cone is at a declination above the center
+    # so we use the bounding declination closest to a pole
+    cos_dec = math.cos(math.radians(max(abs(dec_min), abs(dec_max))))
+    dra = radius / cos_dec if cos_dec > 0 else 360.0
+    if dra >= 180:
+        return [(0.0, 360.0, dec_min, dec_max)]
+
+    ra = ra % 360
+    ra_min, ra_max = ra - dra, ra + dra
+    if ra_min < 0:
+        return [
+            (ra_min + 360, 360.0, dec_min, dec_max),
+            (0.0, ra_max, dec_min, dec_max),
+        ]
+    elif ra_max > 360:
+        return [
+            (ra_min, 360.0, dec_min, dec_max),
+            (0.0, ra_max - 360, dec_min, dec_max),
+        ]
+    return [(ra_min, ra_max, dec_min, dec_max)]
+
+
+def _get_index_conn(path=None):
+    path = path or get_spatial_index_path()
+    if not spatial_index_is_current(path):
+        raise RuntimeError(
+            "The spatial index is missing or out of date! Build it with "
+            "`des-archive-access-spatial-index`."
+        )
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def _search(table, name_column, ra, dec, radius, where="", params=(), path=None):
+    conn = _get_index_conn(path)
+    try:
+        names = set()
+        for ra_min, ra_max, dec_min, dec_max in _cone_boxes(ra, dec, radius):
+            rows = conn.execute(
+                f"select {name_column}, ra_min, ra_max, dec_min, dec_max "
+                f"from {table} "
+                "where ra_max >= ? and ra_min <= ? and dec_max >= ? and dec_min <= ?"
+                + where,
+                (ra_min, ra_max, dec_min, dec_max) + tuple(params),
+            )
+            for row in rows:
+                if _box_sep(ra % 360, dec, *row[1:]) <= radius:
+                    names.add(row[0])
+    finally:
+        conn.close()
+    return sorted(names)
+
+
+def cone(ra, dec, radius, filetype=None, band=None, path=None):
+    """Find the images whose footprints overlap a cone.
+
+    Footprints are approximated by their RA/Dec bounding boxes.
+
+    Parameters
+    ----------
+    ra : float
+        The RA of the center of the cone in degrees.
+    dec : float
+        The Dec of the center of the cone in degrees.
+    radius : float
+        The radius of the cone in degrees.
+    filetype : str, optional
+        If given, only return images of this filetype (e.g., "red_immask").
+    band : str, optional
+        If given, only return images in this band.
+    path : str, optional
+        The location of the spatial index. The default comes from
+        `get_spatial_index_path`.
+
+    Returns
+    -------
+    filenames : list of str
+        The sorted file names of the images.
+    """
+    where = ""
+    params = []
+    if filetype is not None:
+        where += " and filetype = ?"
+        params.append(filetype)
+    if band is not None:
+        where += " and band = ?"
+        params.append(band)
+    return _search(
+        "image_rtree",
+        "filename",
+        ra,
+        dec,
+        radius,
+        where=where,
+        params=params,
+        path=path,
+    )
+
+
+def tiles_overlapping(ra, dec, radius=0, path=None):
+    """Find the coadd tiles whose footprints overlap a cone, or contain a point
+    if `radius` is 0.
+
+    Parameters
+    ----------
+    ra : float
+        The RA of the center of the cone in degrees.
+    dec : float
+        The Dec of the center of the cone in degrees.
+    radius : float, optional
+        The radius of the cone in degrees.
+    path : str, optional
+        The location of the spatial index. The default comes from
+        `get_spatial_index_path`.
+
+    Returns
+    -------
+    tilenames : list of str
+        The sorted names of the tiles.
+    """
+    return _search("tile_rtree", "tilename", ra, dec, radius, path=path)
+
+
+def get_archive_paths(filenames=None, tilenames=None):
+    """Get the archive paths of the files with the given names or of the coadd
+    images of the given tiles, in the format used by `des-archive-access-download`.
+    """
+    conn = connect_des_archive_access_db()
+    try:
+        conn.execute("create temp table _names (name text primary key)")
+        conn.executemany(
+            "insert or ignore into temp._names values (?)",
+            [(name,) for name in (filenames or tilenames or [])],
+        )
+        if filenames is not None:
+            join = "y6a2_file_archive_info fai on fai.filename = n.name"
+        else:
+            join = (
+                "y6a2_image i on i.tilename = n.name "
+                "join y6a2_file_archive_info fai on fai.filename = i.filename"
+            )
+        rows = conn.execute(
+            "select distinct "
+            "fai.path || '/' || fai.filename || coalesce(fai.compression, '') "
+            f"from temp._names n join {join} "
+            "where fai.archive_name = 'desar2home' "
+            "order by 1"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
@@ -1,58 +1,153 @@
+import json
+import os
+import shutil
+import sys
 import time
+from contextlib import contextmanager
 
-import fitsio
-import numpy as np
+from des_archive_access.dbfiles import (
+    get_des_archive_access_db_conn,
+    get_des_archive_access_dir,
+    make_des_archive_access_dir,
+)
 
-from des_archive_access.dbfiles import get_des_archive_access_db_conn
+QUERY_PHASES = ("execute", "fetch", "convert", "write")
+
+
+class _QueryTimer:
+    """Accumulate the wall time spent in each phase of a query."""
+
+    def __init__(self):
+        self.t0 = time.time()
+        self.timings = {phase: 0.0 for phase in QUERY_PHASES}
+
+    @property
+    def elapsed(self):
+        return time.time() - self.t0
+
+    @contextmanager
+    def phase(self, name, exclude=()):
+        """Time a block as phase `name`, not counting any time recorded for
+        the phases in `exclude` while the block runs."""
+        excluded = sum(self.timings[ex] for ex in exclude)
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            dt = time.time() - t0
+            dt -= sum(self.timings[ex] for ex in exclude) - excluded
+            self.timings[name] += dt
 
 
 def _print_time(t0, nrows):
     print("found %d rows in %f seconds (%f rows/s)" % (nrows, t0, nrows / t0))
 
 
-def _print_table(columns, curr, t0):
-    rows = curr.fetchall()
-    t0 = time.time() - t0
-    _print_time(t0, len(rows))
-    rows = [tuple(str(r) for r in row) for row in rows]
+def _print_timings(timer):
+    print(
+        "timing: "
+        + ", ".join("%s %f s" % (ph, timer.timings[ph]) for ph in QUERY_PHASES)
+        + ", total %f s" % timer.elapsed
+    )
+
+
+def _table_format(columns, rows):
     mlens = []
     for i in range(len(columns)):
         mlens.append(max(len(cr[i]) for cr in ([columns] + rows)))
     fmt = ""
     for mlen in mlens:
         fmt += " %-" + str(mlen) + "s"
-    fmt = fmt[1:]
+    return fmt[1:]
+
+
+def _print_table(columns, curr, timer, count=False):
+    """Print the rows in `curr` as a table.
+
+    The column widths are computed from the first page of rows only. The
+    remaining rows are fetched lazily as they are written through a pager, so that
+    the time to the first row does not depend on the size of the result and no
+    more rows are fetched once the pager is closed. The total number of rows is
+    only reported for results larger than a single page if `count` is True.
+    """
+    import click
+
+    with timer.phase("fetch"):
+        rows = curr.fetchmany()
+    with timer.phase("convert"):
+        page = [tuple(str(r) for r in row) for row in rows]
+        fmt = _table_format(columns, page)
+
+    if len(rows) < curr.arraysize and (
+        len(rows) + 3 <= shutil.get_terminal_size().lines or not sys.stdout.isatty()
+    ):
+        # the full result fits in a single page, so we print it directly
+        _print_time(timer.elapsed, len(rows))
+        with timer.phase("write"):
+            print("\n" + fmt % columns)
+            for row in page:
+                print(fmt % row)
+        return
 
-    print("\n" + fmt % columns)
-    for row in rows:
-        print(fmt % row)
+    nrows = len(rows)
 
+    def _lines():
+        nonlocal nrows, page
+        yield "\n" + fmt % columns + "\n"
+        while page:
+            yield "".join(fmt % row + "\n" for row in page)
+            with timer.phase("fetch"):
+                rows = curr.fetchmany()
+            nrows += len(rows)
+            with timer.phase("convert"):
+                page = [tuple(str(r) for r in row) for row in rows]
 
-def _write_table(columns, curr, fname, t0):
-    rows = curr.fetchall()
-    t0 = time.time() - t0
-    _print_time(t0, len(rows))
+    with timer.phase("write", exclude=("fetch", "convert")):
+        click.echo_via_pager(_lines())
+
+    if count:
+        # the pager may have been closed early, so we count any rows it did not show
+        with timer.phase("fetch"):
+            while True:
+                rows = curr.fetchmany()
+                if not rows:
+                    break
+                nrows += len(rows)
+        _print_time(timer.elapsed, nrows)
+
+
+def _write_table(columns, curr, fname, timer):
+    # numpy and fitsio are only needed to write files, so we import them
+    # here to keep the startup time for printing queries low
+    import fitsio
+    import numpy as np
+
+    with timer.phase("fetch"):
+        rows = curr.fetchall()
+    _print_time(timer.elapsed, len(rows))
     if len(rows) > 0:
-        descr = []
-        for i, col in enumerate(columns):
-            if isinstance(rows[0][i], str):
-                mlen = max(len(r[i]) for r in rows)
-                mlen = max(mlen, 1)
-                descr.append((col, "U%d" % mlen))
-            elif isinstance(rows[0][i], int):
-                descr.append((col, "i8"))
-            elif isinstance(rows[0][i], float):
-                descr.append((col, "f8"))
-            else:
-                raise RuntimeError("Did not recognize type %s" % type(rows[0][i]))
-        d = np.array(rows, dtype=descr)
-        fitsio.write(fname, d, clobber=True)
+        with timer.phase("convert"):
+            descr = []
+            for i, col in enumerate(columns):
+                if isinstance(rows[0][i], str):
+                    mlen = max(len(r[i]) for r in rows)
+                    mlen = max(mlen, 1)
+                    descr.append((col, "U%d" % mlen))
+                elif isinstance(rows[0][i], int):
+                    descr.append((col, "i8"))
+                elif isinstance(rows[0][i], float):
+                    descr.append((col, "f8"))
+                else:
+                    raise RuntimeError("Did not recognize type %s" % type(rows[0][i]))
+            d = np.array(rows, dtype=descr)
+        with timer.phase("write"):
+            fitsio.write(fname, d, clobber=True)
     else:
         raise RuntimeError("No data found in query! Cannot write file!")
 
 
-def parse_and_execute_query(query):
-    """Parse and execute a SQL `query`."""
+def _split_query(query):
+    """Split a `query` into the SQL and the optional output file name."""
     query = query.replace("\n", " ").strip()
 
     if "; > " in query:
@@ -62,16 +157,170 @@ def parse_and_execute_query(query):
     else:
         fname = None
 
-    conn = get_des_archive_access_db_conn()
+    return query, fname
+
+
+def execute_query(query, params=()):
+    """Execute a SQL `query` against the metadata DB, returning a cursor over
+    the results.
+
+    If the query daemon is running (see `des_archive_access.daemon`), the query
+    is sent to it and the returned cursor fetches the results from it lazily.
+    Otherwise the query runs on the connection from
+    `get_des_archive_access_db_conn`. Set the environment variable
+    DES_ARCHIVE_ACCESS_DAEMON to "on" to start the daemon if it is not running
+    or to "off" to never use it.
+    """
+    from des_archive_access.daemon import (
+        DaemonCursor,
+        DaemonNotRunningError,
+        get_daemon_mode,
+        get_daemon_socket_path,
+        start_daemon,
+    )
+
+    mode = get_daemon_mode()
+    if mode == "on":
+        start_daemon()
+    if mode != "off" and os.path.exists(get_daemon_socket_path()):
+        try:
+            return DaemonCursor(query, params)
+        except DaemonNotRunningError:
+            pass
+
+    curr = get_des_archive_access_db_conn().cursor()
+    try:
+        curr.execute(query, params)
+    except Exception:
+        curr.close()
+        raise
+    return curr
+
+
+def _get_query_plan(query):
+    """Get the rows of `EXPLAIN QUERY PLAN` as (id, parent, detail) tuples."""
+    curr = execute_query("EXPLAIN QUERY PLAN " + query)
+    try:
+        return [(row[0], row[1], row[3]) for row in curr.fetchall()]
+    finally:
+        curr.close()
+
+
+def _plan_warning(detail):
+    """Get a warning for a step of a query plan that could use a better index
+    or None."""
+    if (
+        detail.startswith("SCAN ")
+        and " USING " not in detail
+        and detail != "SCAN CONSTANT ROW"
+    ):
+        return "full table scan"
+    elif "AUTOMATIC" in detail and "INDEX" in detail:
+        return "automatic index"
+    else:
+        return None
+
+
+def _format_query_plan(plan):
+    """Format the rows of a query `plan` as an indented tree, returning a list of
+    (line, warning) tuples."""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, detail in plan:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append(("  " * depth[node_id] + detail, _plan_warning(detail)))
+    return lines
+
+
+def explain_query(query):
+    """Print the formatted `EXPLAIN QUERY PLAN` for a SQL `query`, highlighting
+    any full table scans or automatic indexes."""
+    import click
+
+    query, _ = _split_query(query)
+    if query.lower().startswith("explain "):
+        query = query[len("explain ") :].lstrip()
+    if query.lower().startswith("query plan "):
+        query = query[len("query plan ") :].lstrip()
+
+    plan = _get_query_plan(query)
+    nwarn = 0
+    for line, warning in _format_query_plan(plan):
+        if warning is not None:
+            nwarn += 1
+            click.echo(click.style(line + "  <-- " + warning, fg="red", bold=True))
+        else:
+            click.echo(line)
+    if nwarn > 0:
+        click.echo(
+            "found %d step%s that could use a better index"
+            % (nwarn, "" if nwarn == 1 else "s")
+        )
+
+
+def _get_slow_query_time():
+    """Get the slow query log threshold in seconds or None if the log is
+    not enabled."""
+    val = os.environ.get("DES_ARCHIVE_ACCESS_SLOW_QUERY_TIME", None)
+    if val is None or not val.strip():
+        return None
+    return float(val)
+
+
+def _log_slow_query(query, timer):
+    """Record `query` in the slow query log if the database time taken by the
+    execute and fetch phases is above the configured threshold."""
+    slow_time = _get_slow_query_time()
+    db_time = timer.timings["execute"] + timer.timings["fetch"]
+    if slow_time is None or db_time < slow_time:
+        return
+
+    try:
+        plan = [detail for _, _, detail in _get_query_plan(query)]
+    except Exception:
+        plan = None
+
+    make_des_archive_access_dir()
+    with open(
+        os.path.join(get_des_archive_access_dir(), "slow_queries.jsonl"), "a"
+    ) as fp:
+        fp.write(
+            json.dumps(
+                {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "sql": query,
+                    "plan": plan,
+                    "timings": timer.timings,
+                    "total": timer.elapsed,
+                }
+            )
+            + "\n"
+        )
+
+
+def parse_and_execute_query(query, count=False, timing=False):
+    """Parse and execute a SQL `query`.
+
+    If `count` is True, the total number of rows is always reported, even if
+    this requires fetching rows that were not displayed. If `timing` is True,
+    the time spent executing the query, fetching the rows, converting them and
+    writing them out is reported.
+    """
+    query, fname = _split_query(query)
+
+    timer = _QueryTimer()
+    with timer.phase("execute"):
+        curr = execute_query(query)
     try:
-        curr = conn.cursor()
         curr.arraysize = 100
-        t0 = time.time()
-        curr.execute(query)
         columns = tuple(d[0] for d in curr.description)
         if fname is not None:
-            _write_table(columns, curr, fname, t0)
+            _write_table(columns, curr, fname, timer)
         else:
-            _print_table(columns, curr, t0)
+            _print_table(columns, curr, timer, count=count)
     finally:
         curr.close()
+
+    if timing:
+        _print_timings(timer)
+    _log_slow_query(query, timer)
@@ -0,0 +1 @@
+"""Utilities for testing and benchmarking des-archive-access."""
@@ -0,0 +1,314 @@
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+DEFAULT_PREFIX = "/des/persistent/DESDM_ARCHIVE"
+CHUNK_SIZE = 64 * 1024
+
+
+def make_mock_archive(root, paths, size=1024 * 1024, seed=42):
+    """Make a DESDATA-like tree of files with random contents.
+
+    Parameters
+    ----------
+    root : str
+        The root directory of the tree.
+    paths : list of str
+        The paths of the files relative to `root` (e.g.,
+        "OPS/finalcut/Y6A1/20181129-r4056/D00797980/p01/red/immask/"
+        "D00797980_r_c27_r4056p01_immasked.fits.fz").
+    size : int, optional
+        The size of each file in bytes.
+    seed : int, optional
+        The seed for the random number generator.
+
+    Returns
+    -------
+    paths : list of str
+        The full paths of the files.
+    """
+    rng = random.Random(seed)
+    fpths = []
+    for path in paths:
+        fpth = os.path.join(root, path)
+        os.makedirs(os.path.dirname(fpth), exist_ok=True)
+        with open(fpth, "wb") as fp:
+            if size > 0:
+                fp.write(rng.getrandbits(8 * size).to_bytes(size, "little"))
+        fpths.append(fpth)
+    return fpths
+
+
+def _parse_range(header, size):
+    """Parse a single HTTP byte range, returning (start, end) with the end
+    inclusive, None if the header should be ignored, or False if the range is
+    not satisfiable."""
+    m = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", header)
+    if m is None or (not m.group(1) and not m.group(2)):
+        return None
+
+    if not m.group(1):
+        # a suffix range of the last N bytes
+        nbytes = int(m.group(2))
+        if nbytes == 0:
+            return False
+        return max(size - nbytes, 0), size - 1
+
+    start = int(m.group(1))
+    if m.group(2):
+        end = int(m.group(2))
+        if end < start:
+            return None
+    else:
+        end = size - 1
+    if start >= size:
+        return False
+    return start, min(end, size - 1)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            super().log_message(format, *args)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _send_error(self, code, headers=None):
+        body = ("%d %s\n" % (code, self.responses.get(code, ("",))[0])).encode()
+        self.send_response(code)
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _serve(self, send_body):
+        mock = self.server.mock
+        mock._record("requests")
+
+        if mock.latency > 0:
+            time.sleep(mock.latency)
+
+        if mock.token is not None:
+            auth = self.headers.get("Authorization", "")
+            if auth != "Bearer " + mock.token:
+                mock._record("unauthorized")
+                self._send_error(401, {"WWW-Authenticate": "Bearer"})
+                return
+
+        if mock.error_rate > 0 and mock._rng_random() < mock.error_rate:
+            code = mock.error_codes[int(mock._rng_random() * len(mock.error_codes))]
+            mock._record("errors")
+            self._send_error(code)
+            return
+
+        path = unquote(self.path.split("?", 1)[0])
+        if not path.startswith(mock.prefix + "/"):
+            self._send_error(404)
+            return
+        fpth = os.path.realpath(
+            os.path.join(mock.root, path[len(mock.prefix) + 1 :].lstrip("/"))
+        )
+        if not fpth.startswith(mock.root + os.sep) or not os.path.isfile(fpth):
+            self._send_error(404)
+            return
+
+        st = os.stat(fpth)
+        size = st.st_size
+        etag = (
+            '"%s"'
+            % hashlib.md5(
+                ("%s-%d-%d" % (fpth, size, st.st_mtime_ns)).encode()
+            ).hexdigest()
+        )
+
+        if self.headers.get("If-None-Match", None) in (etag, "*"):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        rng = None
+        range_header = self.headers.get("Range", None)
+        if_range = self.headers.get("If-Range", None)
+        if range_header is not None and (if_range is None or if_range == etag):
+            rng = _parse_range(range_header, size)
+            if rng is False:
+                self._send_error(416, {"Content-Range": "bytes */%d" % size})
+                return
+
+        if rng is None:
+            start, end = 0, size - 1
+            self.send_response(200)
+        else:
+            start, end = rng
+            mock._record("ranges")
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+        nbytes = end - start + 1
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(nbytes))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+
+        if not send_body:
+            return
+
+        drop_at = None
+        if mock.drop_rate > 0 and mock._rng_random() < mock.drop_rate:
+            drop_at = nbytes // 2
+
+        with open(fpth, "rb") as fp:
+            fp.seek(start)
+            sent = 0
+            t0 = time.time()
+            while sent < nbytes:
+                chunk = fp.read(min(CHUNK_SIZE, nbytes - sent))
+                if drop_at is not None and sent + len(chunk) > drop_at:
+                    self.wfile.write(chunk[: drop_at - sent])
+                    self.wfile.flush()
+                    mock._record("drops")
+                    self.close_connection = True
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                mock._record("bytes", len(chunk))
+                if mock.bandwidth is not None:
+                    # sleep until we are back under the bandwidth limit
+                    dt = sent / mock.bandwidth - (time.time() - t0)
+                    if dt > 0:
+                        time.sleep(dt)
+
+
+class MockArchiveServer:
+    """A local HTTP server that mimics the FNAL dCache archive.
+
+    The server serves the files in the DESDATA-like tree at `root` under the
+    URL prefix `prefix`, checks bearer tokens and supports single byte ranges,
+    ETags, `If-Range` and `If-None-Match`. It can also inject latency, a
+    bandwidth limit, HTTP errors and dropped connections.
+
+    Use it as a context manager
+
+        with MockArchiveServer(root, token="abc") as server:
+            download_file(fname, prefix=server.url, ...)
+
+    Parameters
+    ----------
+    root : str
+        The root of the tree of files to serve.
+    token : str, optional
+        The bearer token clients must send. If None, no token is required.
+    prefix : str, optional
+        The URL path at which the tree is served.
+    latency : float, optional
+        The time in seconds to wait before responding to each request.
+    bandwidth : float, optional
+        The maximum transfer rate in bytes per second for each response.
+    error_rate : float, optional
+        The fraction of requests that fail with one of `error_codes`.
+    error_codes : tuple of int, optional
+        The HTTP error codes to return for failed requests.
+    drop_rate : float, optional
+        The fraction of responses whose connection is dropped halfway
+        through the body.
+    seed : int, optional
+        The seed for the random number generator used to inject failures.
+    verbose : bool, optional
+        If True, log each request to stderr.
+
+    Attributes
+    ----------
+    url : str
+        The base URL of the archive, to be used as the `prefix` for downloads.
+    stats : dict
+        Counts of the number of requests, unauthorized requests, range
+        requests, injected errors and dropped connections, and the number of
+        bytes sent.
+    """
+
+    def __init__(
+        self,
+        root,
+        token=None,
+        prefix=DEFAULT_PREFIX,
+        latency=0,
+        bandwidth=None,
+        error_rate=0,
+        error_codes=(500, 503),
+        drop_rate=0,
+        seed=None,
+        verbose=False,
+    ):
+        self.root = os.path.realpath(root)
+        self.token = token
+        self.prefix = "/" + prefix.strip("/")
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.drop_rate = drop_rate
+        self.verbose = verbose
+        self.stats = {
+            "requests": 0,
+            "unauthorized": 0,
+            "ranges": 0,
+            "errors": 0,
+            "drops": 0,
+            "bytes": 0,
+        }
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def _record(self, key, val=1):
+        with self._lock:
+            self.stats[key] += val
+
+    def _rng_random(self):
+        with self._lock:
+            return self._rng.random()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return "http://%s:%d%s" % (host, port, self.prefix)
+
+    def start(self):
+        """Start the server in a background thread."""
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,276 @@
+import argparse
+import math
+import os
+import random
+import sqlite3
+
+BANDS = ["g", "r", "i", "z", "Y"]
+
+# (filetype, filename suffix, archive subdirectory) for the single-epoch files
+# made for each CCD of an exposure
+SE_FILETYPES = [
+    ("red_immask", "immasked", "immask"),
+    ("red_bkg", "bkg", "bkg"),
+]
+
+# size in degrees of a coadd tile and of a single CCD
+TILE_SIZE = 0.7306
+CCD_SIZE = (0.15, 0.3)
+
+SCHEMA = """\
+create table y6a2_image (
+    filename text,
+    filetype text,
+    pfw_attempt_id integer,
+    band text,
+    tilename text,
+    expnum integer,
+    ccdnum integer,
+    ra_cent real,
+    dec_cent real,
+    rac1 real,
+    rac2 real,
+    rac3 real,
+    rac4 real,
+    decc1 real,
+    decc2 real,
+    decc3 real,
+    decc4 real,
+    crossra0 text
+);
+create table y6a2_file_archive_info (
+    filename text,
+    archive_name text,
+    path text,
+    compression text,
+    filesize integer
+);
+create table y6a2_coaddtile_geom (
+    tilename text,
+    ra_cent real,
+    dec_cent real,
+    racmin real,
+    racmax real,
+    deccmin real,
+    deccmax real,
+    crossra0 text
+);
+"""
+
+INDEXES = """\
+create index y6a2_image_filename_idx on y6a2_image (filename);
+create index y6a2_image_expnum_idx on y6a2_image (expnum);
+create index y6a2_image_tilename_idx on y6a2_image (tilename);
+create index y6a2_file_archive_info_filename_idx on y6a2_file_archive_info (filename);
+create index y6a2_coaddtile_geom_tilename_idx on y6a2_coaddtile_geom (tilename);
+"""
+
+
+def _tilename(ra, dec):
+    ra_hours = ra / 15.0
+    hh = int(ra_hours)
+    mm = int(round((ra_hours - hh) * 60))
+    if mm == 60:
+        hh, mm = (hh + 1) % 24, 0
+    sign = "-" if dec < 0 else "+"
+    adec = abs(dec)
+    dd = int(adec)
+    dm = int(round((adec - dd) * 60))
+    if dm == 60:
+        dd, dm = dd + 1, 0
+    return "DES%02d%02d%s%02d%02d" % (hh, mm, sign, dd, dm)
+
+
+def _corners(ra, dec, dra, ddec):
+    """Get the RA/Dec of the corners of a box of size (`dra`, `ddec`) degrees
+    centered at (`ra`, `dec`), along with the CROSSRA0 flag."""
+    dra = dra / max(math.cos(math.radians(dec)), 1e-3)
+    racs = [ra - dra / 2, ra + dra / 2, ra + dra / 2, ra - dra / 2]
+    decs = [dec - ddec / 2, dec - ddec / 2, dec + ddec / 2, dec + ddec / 2]
+    crossra0 = "Y" if min(racs) < 0 or max(racs) >= 360 else "N"
+    return [r % 360 for r in racs], decs, crossra0
+
+
+def make_synthetic_metadata_db(
+    path, nexp=100, nccd=62, seed=42, indexes=True, dec_range=(-65, 5)
+):
+    """Make a synthetic metadata DB shaped like the DES archive metadata DB.
+
+    The DB has the `y6a2_image`, `y6a2_file_archive_info` and
+    `y6a2_coaddtile_geom` tables filled with random, but reproducible, entries
+    for `nexp` exposures with `nccd` CCDs each. Every CCD has an image and a
+    background file, and every coadd tile touched by an exposure gets a coadd
+    image in the exposure's band.
+
+    Parameters
+    ----------
+    path : str
+        The location of the DB. Any existing file is overwritten.
+    nexp : int, optional
+        The number of exposures. The DB has roughly `2 * nexp * nccd` images.
+    nccd : int, optional
+        The number of CCDs per exposure.
+    seed : int, optional
+        The seed for the random number generator.
+    indexes : bool, optional
+        If True, make indexes on the columns used to join the tables.
+    dec_range : tuple of float, optional
+        The range of declinations in degrees for the exposure centers.
+
+    Returns
+    -------
+    path : str
+        The location of the DB.
+    """
+    rng = random.Random(seed)
+
+    if os.path.exists(path):
+        os.remove(path)
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+
+        tiles = {}
+        pfw_attempt_id = 1000000
+        for iexp in range(nexp):
+            expnum = 226000 + iexp * 7
+            band = BANDS[rng.randrange(len(BANDS))]
+            reqnum = 3500 + rng.randrange(600)
+            night = "2018%02d%02d" % (rng.randrange(1, 13), rng.randrange(1, 29))
+            exp_ra = rng.uniform(0, 360)
+            exp_dec = rng.uniform(*dec_range)
+            pfw_attempt_id += 1
+
+            images = []
+            archive_info = []
+            for ccdnum in range(1, nccd + 1):
+                ra = (exp_ra + rng.uniform(-1, 1)) % 360
+                dec = exp_dec + rng.uniform(-1, 1)
+                racs, decs, crossra0 = _corners(ra, dec, *CCD_SIZE)
+
+                tile_ra = (math.floor(ra / TILE_SIZE) + 0.5) * TILE_SIZE
+                tile_dec = (math.floor(dec / TILE_SIZE) + 0.5) * TILE_SIZE
+                tiles.setdefault(
+                    _tilename(tile_ra, tile_dec), (tile_ra, tile_dec, set())
+                )[2].add(band)
+
+                for filetype, suffix, subdir in SE_FILETYPES:
+                    filename = "D%08d_%s_c%02d_r%dp01_%s.fits" % (
+                        expnum,
+                        band,
+                        ccdnum,
+                        reqnum,
+                        suffix,
+                    )
+                    images.append(
+                        (filename, filetype, pfw_attempt_id, band, None, expnum)
+                        + (ccdnum, ra, dec)
+                        + tuple(racs)
+                        + tuple(decs)
+                        + (crossra0,)
+                    )
+                    archive_info.append(
+                        (
+                            filename,
+                            "desar2home",
+                            "OPS/finalcut/Y6A1/%s-r%d/D%08d/p01/red/%s"
+                            % (night, reqnum, expnum, subdir),
+                            ".fz",
+                            rng.randrange(1_000_000, 20_000_000),
+                        )
+                    )
+
+            conn.executemany(
+                "insert into y6a2_image values (%s)" % ", ".join(["?"] * 18),
+                images,
+            )
+            conn.executemany(
+                "insert into y6a2_file_archive_info values (?, ?, ?, ?, ?)",
+                archive_info,
+            )
+
+        tile_geoms = []
+        images = []
+        archive_info = []
+        for tilename, (ra, dec, bands) in sorted(tiles.items()):
+            pfw_attempt_id += 1
+            racs, decs, crossra0 = _corners(ra, dec, TILE_SIZE, TILE_SIZE)
+            racmin, racmax = min(racs), max(racs)
+            if crossra0 == "Y":
+                racmin, racmax = max(racs), min(racs)
+            tile_geoms.append(
+                (tilename, ra, dec, racmin, racmax, min(decs), max(decs), crossra0)
+            )
+            for band in sorted(bands):
+                filename = "%s_r4575p01_%s.fits" % (tilename, band)
+                images.append(
+                    (filename, "coadd", pfw_attempt_id, band, tilename, None)
+                    + (None, ra, dec)
+                    + tuple(racs)
+                    + tuple(decs)
+                    + (crossra0,)
+                )
+                archive_info.append(
+                    (
+                        filename,
+                        "desar2home",
+                        "OPS/multiepoch/Y6A2/r4575/%s/p01/coadd" % tilename,
+                        ".fz",
+                        rng.randrange(100_000_000, 500_000_000),
+                    )
+                )
+
+        conn.executemany(
+            "insert into y6a2_coaddtile_geom values (?, ?, ?, ?, ?, ?, ?, ?)",
+            tile_geoms,
+        )
+        conn.executemany(
+            "insert into y6a2_image values (%s)" % ", ".join(["?"] * 18),
+            images,
+        )
+        conn.executemany(
+            "insert into y6a2_file_archive_info values (?, ?, ?, ?, ?)",
+            archive_info,
+        )
+
+        if indexes:
+            conn.executescript(INDEXES)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Make a synthetic DES archive metadata DB for testing.",
+    )
+    parser.add_argument("path", type=str, help="location of the DB")
+    parser.add_argument("--nexp", type=int, default=100, help="the number of exposures")
+    parser.add_argument(
+        "--nccd", type=int, default=62, help="the number of CCDs per exposure"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42, help="the seed for the random numbers"
+    )
+    parser.add_argument(
+        "--no-indexes", action="store_true", help="do not make any indexes"
+    )
+    args = parser.parse_args()
+
+    make_synthetic_metadata_db(
+        args.path,
+        nexp=args.nexp,
+        nccd=args.nccd,
+        seed=args.seed,
+        indexes=not args.no_indexes,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import functools
+import os
+
+import pytest
+
+from des_archive_access.dbfiles import get_des_archive_access_db_conn
+from des_archive_access.testing.synthetic_db import make_synthetic_metadata_db
+
+
+@pytest.fixture
+def make_metadata_db():
+    """The function that makes the DB for the `metadata_db` fixture at a given
+    location. Override this fixture in a test module (or parametrize it) to use
+    another DB."""
+    return functools.partial(make_synthetic_metadata_db, nexp=5)
+
+
+@pytest.fixture
+def metadata_db(make_metadata_db, tmpdir, monkeypatch):
+    """Make a metadata DB with `make_metadata_db` and use it as the current DB,
+    with a fresh DES_ARCHIVE_ACCESS_DIR and the query daemon turned off."""
+    dbloc = os.path.join(tmpdir, "metadata.db")
+    make_metadata_db(dbloc)
+
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DB", dbloc)
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DIR", os.path.join(tmpdir, "daad"))
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DAEMON", "off")
+    get_des_archive_access_db_conn.cache_clear()
+    yield dbloc
+    if get_des_archive_access_db_conn.cache_info().currsize:
+        get_des_archive_access_db_conn().close()
+    get_des_archive_access_db_conn.cache_clear()
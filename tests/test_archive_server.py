@@ -0,0 +1,146 @@
+import os
+
+import pytest
+import requests
+
+from des_archive_access.dbfiles import download_file
+from des_archive_access.testing.archive_server import (
+    MockArchiveServer,
+    make_mock_archive,
+)
+
+FNAME = (
+    "OPS/finalcut/Y6A1/20181129-r4056/D00797980/p01/red/immask/"
+    "D00797980_r_c27_r4056p01_immasked.fits.fz"
+)
+
+
+@pytest.fixture
+def archive(tmpdir):
+    root = os.path.join(tmpdir, "archive")
+    make_mock_archive(root, [FNAME], size=100_000)
+    with open(os.path.join(root, FNAME), "rb") as fp:
+        data = fp.read()
+    return root, data
+
+
+@pytest.fixture
+def token_dir(tmpdir, monkeypatch):
+    daad = os.path.join(tmpdir, "daad")
+    os.makedirs(daad)
+    with open(os.path.join(daad, "bearer_token"), "w") as fp:
+        fp.write("abc123")
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DIR", daad)
+    return daad
+
+
+def test_archive_server_auth(archive):
+    root, data = archive
+    with MockArchiveServer(root, token="abc123") as server:
+        url = server.url + "/" + FNAME
+        assert requests.get(url).status_code == 401
+        assert (
+            requests.get(url, headers={"Authorization": "Bearer wrong"}).status_code
+            == 401
+        )
+        res = requests.get(url, headers={"Authorization": "Bearer abc123"})
+        assert res.status_code == 200
+        assert res.content == data
+        assert server.stats["unauthorized"] == 2
+
+
+def test_archive_server_range_and_etag(archive):
+    root, data = archive
+    with MockArchiveServer(root) as server:
+        url = server.url + "/" + FNAME
+        res = requests.get(url, headers={"Range": "bytes=10-19"})
+        assert res.status_code == 206
+        assert res.content == data[10:20]
+        assert res.headers["Content-Range"] == "bytes 10-19/%d" % len(data)
+
+        res = requests.get(url, headers={"Range": "bytes=-5"})
+        assert res.content == data[-5:]
+
+        res = requests.get(url, headers={"Range": "bytes=%d-" % len(data)})
+        assert res.status_code == 416
+
+        etag = requests.head(url).headers["ETag"]
+        assert requests.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+        res = requests.get(url, headers={"Range": "bytes=10-", "If-Range": '"old"'})
+        assert res.status_code == 200
+        assert res.content == data
+
+        assert requests.get(server.url + "/does/not/exist").status_code == 404
+        assert requests.get(server.url + "/../../etc/passwd").status_code == 404
+
+
+def test_archive_server_faults(archive):
+    root, data = archive
+    with MockArchiveServer(root, error_rate=1, error_codes=(503,)) as server:
+        assert requests.get(server.url + "/" + FNAME).status_code == 503
+        assert server.stats["errors"] == 1
+
+    with MockArchiveServer(root, drop_rate=1) as server:
+        with pytest.raises(requests.exceptions.RequestException):
+            requests.get(server.url + "/" + FNAME)
+        assert server.stats["drops"] == 1
+
+
+def test_download_file_mock_archive(archive, token_dir, tmpdir):
+    root, data = archive
+    desdata = os.path.join(tmpdir, "DESDATA")
+    with MockArchiveServer(root, token="abc123") as server:
+        fpth = download_file(
+            FNAME, prefix=server.url, desdata=desdata, refresh_token=False
+        )
+        with open(fpth, "rb") as fp:
+            assert fp.read() == data
+
+        # resume a partial download
+        with open(fpth, "r+b") as fp:
+            fp.truncate(1000)
+        download_file(FNAME, prefix=server.url, desdata=desdata, refresh_token=False)
+        with open(fpth, "rb") as fp:
+            assert fp.read() == data
+        assert server.stats["ranges"] == 1
+
+        # a complete file is left alone
+        download_file(FNAME, prefix=server.url, desdata=desdata, refresh_token=False)
+        with open(fpth, "rb") as fp:
+            assert fp.read() == data
+
+
+def test_download_file_mock_archive_unauthorized(archive, token_dir, tmpdir):
+    root, _ = archive
+    with MockArchiveServer(root, token="xyz") as server:
+        with pytest.raises(RuntimeError, match="401"):
+            download_file(
+                FNAME,
+                prefix=server.url,
+                desdata=os.path.join(tmpdir, "DESDATA"),
+                refresh_token=False,
+            )
+
+
+def test_download_file_mock_archive_416(archive, token_dir, tmpdir):
+    root, data = archive
+    desdata = os.path.join(tmpdir, "DESDATA")
+    fpth = os.path.join(desdata, FNAME)
+    os.makedirs(os.path.dirname(fpth))
+    with MockArchiveServer(root, token="abc123") as server:
+        # a complete file that is not in the cache index is accepted
+        with open(fpth, "wb") as fp:
+            fp.write(data)
+        download_file(FNAME, prefix=server.url, desdata=desdata, refresh_token=False)
+        with open(fpth, "rb") as fp:
+            assert fp.read() == data
+
+        # a local file larger than the remote one (e.g., a saved error page) is
+        # downloaded again
+        with open(fpth, "wb") as fp:
+            fp.write(b"x" * (len(data) + 3100))
+        os.remove(os.path.join(desdata, ".des_archive_access_cache.db"))
+        download_file(FNAME, prefix=server.url, desdata=desdata, refresh_token=False)
+        with open(fpth, "rb") as fp:
+            assert fp.read() == data
@@ -0,0 +1,162 @@
+import os
+import subprocess
+
+import pytest
+
+from des_archive_access.cache import DesdataCache, parse_size
+from des_archive_access.dbfiles import download_file
+from des_archive_access.testing.archive_server import (
+    MockArchiveServer,
+    make_mock_archive,
+)
+
+PATHS = ["OPS/a/file%d.fits.fz" % i for i in range(4)]
+
+
+@pytest.fixture
+def archive(tmpdir, monkeypatch):
+    root = os.path.join(tmpdir, "archive")
+    make_mock_archive(root, PATHS, size=1000)
+    daad = os.path.join(tmpdir, "daad")
+    os.makedirs(daad)
+    with open(os.path.join(daad, "bearer_token"), "w") as fp:
+        fp.write("abc123")
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DIR", daad)
+    monkeypatch.delenv("DES_ARCHIVE_ACCESS_CACHE_SIZE", raising=False)
+    with MockArchiveServer(root, token="abc123") as server:
+        yield server, os.path.join(tmpdir, "DESDATA")
+
+
+def test_parse_size():
+    assert parse_size("1000") == 1000
+    assert parse_size("1.5K") == 1536
+    assert parse_size("2GiB") == 2 * 1024**3
+    assert parse_size("1tb") == 1024**4
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_download_file_cache_hit(archive):
+    server, desdata = archive
+    fpth = download_file(
+        PATHS[0], prefix=server.url, desdata=desdata, refresh_token=False
+    )
+    nreq = server.stats["requests"]
+
+    # a cached file needs no network access
+    assert (
+        download_file(PATHS[0], prefix=server.url, desdata=desdata, refresh_token=False)
+        == fpth
+    )
+    assert server.stats["requests"] == nreq
+
+    # a file changed behind the cache's back is downloaded again
+    with open(fpth, "r+b") as fp:
+        fp.truncate(10)
+    download_file(PATHS[0], prefix=server.url, desdata=desdata, refresh_token=False)
+    assert server.stats["requests"] == nreq + 1
+    assert os.path.getsize(fpth) == 1000
+
+
+def test_download_list_refreshes_token_after_cache_hit(archive, tmpdir):
+    server, desdata = archive
+    download_file(PATHS[0], prefix=server.url, desdata=desdata, refresh_token=False)
+    nreq = server.stats["requests"]
+
+    # a stand-in for the token refresh that counts its calls
+    bindir = os.path.join(tmpdir, "bin")
+    os.makedirs(bindir)
+    calls = os.path.join(tmpdir, "calls")
+    script = os.path.join(bindir, "des-archive-access-make-token")
+    with open(script, "w") as fp:
+        fp.write(f"#!/bin/sh\necho refresh >> {calls}\n")
+    os.chmod(script, 0o755)
+
+    list_file = os.path.join(tmpdir, "files.txt")
+    with open(list_file, "w") as fp:
+        fp.write("\n".join(PATHS[:3]) + "\n")
+    subprocess.run(
+        ["des-archive-access-download", "-a", server.url, "-d", desdata]
+        + ["--list", list_file],
+        check=True,
+        capture_output=True,
+        env=dict(os.environ, PATH=bindir + os.pathsep + os.environ["PATH"]),
+    )
+
+    # the first file is a cache hit, so the token is refreshed for the second
+    with open(calls) as fp:
+        assert fp.read().splitlines() == ["refresh"]
+    assert server.stats["requests"] == nreq + 2
+
+
+def test_download_file_cache_eviction(archive, monkeypatch):
+    server, desdata = archive
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_CACHE_SIZE", "2500")
+
+    for pth in PATHS[:2]:
+        download_file(pth, prefix=server.url, desdata=desdata, refresh_token=False)
+    with DesdataCache(desdata) as cache:
+        assert cache.set_pinned(PATHS[0]) == 1
+
+    # the pinned file stays and the least recently used unpinned file goes
+    for pth in PATHS[2:]:
+        download_file(pth, prefix=server.url, desdata=desdata, refresh_token=False)
+    assert os.path.exists(os.path.join(desdata, PATHS[0]))
+    assert not os.path.exists(os.path.join(desdata, PATHS[1]))
+    assert not os.path.exists(os.path.join(desdata, PATHS[2]))
+    assert os.path.exists(os.path.join(desdata, PATHS[3]))
+    with DesdataCache(desdata) as cache:
+        assert cache.total_size() == 2000
+        assert [row[0] for row in cache.files(pinned_only=True)] == [PATHS[0]]
+
+
+def test_cache_scan_partial_files(archive):
+    server, desdata = archive
+    for path in PATHS[:2]:
+        download_file(path, prefix=server.url, desdata=desdata, refresh_token=False)
+    with open(os.path.join(server.root, PATHS[0]), "rb") as fp:
+        data = fp.read()
+
+    # a partial download left behind by curl and a complete file, both made
+    # before the index existed
+    os.remove(os.path.join(desdata, ".des_archive_access_cache.db"))
+    with open(os.path.join(desdata, PATHS[0]), "r+b") as fp:
+        fp.truncate(300)
+
+    with DesdataCache(desdata) as cache:
+        assert cache.scan() == 2
+        assert cache.lookup(PATHS[0]) is None
+
+    for path in PATHS[:2]:
+        download_file(path, prefix=server.url, desdata=desdata, refresh_token=False)
+    with open(os.path.join(desdata, PATHS[0]), "rb") as fp:
+        assert fp.read() == data
+    with DesdataCache(desdata) as cache:
+        assert cache.lookup(PATHS[0]) is not None
+        assert sorted(row[0] for row in cache.files()) == PATHS[:2]
+
+
+def test_cache_cli(tmpdir):
+    desdata = os.path.join(tmpdir, "DESDATA")
+    make_mock_archive(desdata, PATHS, size=100)
+    env = dict(os.environ, DESDATA=desdata)
+    env.pop("DES_ARCHIVE_ACCESS_CACHE_SIZE", None)
+
+    def _run(*args):
+        return subprocess.run(
+            ["des-archive-access-cache", *args],
+            check=True,
+            capture_output=True,
+            text=True,
+            env=env,
+        ).stdout
+
+    assert "added 4 files" in _run("scan")
+    assert "pinned 2 files" in _run("pin", "OPS/a/file[01]*")
+    assert "400B" in _run("status")
+    _run("evict", "--to", "250")
+    assert sorted(os.listdir(os.path.join(desdata, "OPS", "a"))) == [
+        "file0.fits.fz",
+        "file1.fits.fz",
+    ]
+    assert len(_run("list", "--pinned").splitlines()) == 2
@@ -0,0 +1,139 @@
+import os
+import re
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+from prompt_toolkit.document import Document
+
+from des_archive_access import catalogue
+from des_archive_access.repl import cli
+
+
+def _completions(completer, text):
+    return [c.text for c in completer.get_completions(Document(text), None)]
+
+
+def test_catalogue_contents(metadata_db):
+    cat = catalogue.load_catalogue()
+    assert os.path.exists(catalogue.get_catalogue_path())
+
+    conn = sqlite3.connect(metadata_db)
+    try:
+        nrows = conn.execute("select count(*) from y6a2_image").fetchone()[0]
+        bands = [
+            row[0]
+            for row in conn.execute("select distinct band from y6a2_image")
+            if row[0] is not None
+        ]
+    finally:
+        conn.close()
+
+    info = cat["y6a2_image"]
+    assert info["rows"] == nrows
+    assert info["indexes"]["y6a2_image_tilename_idx"] == ["tilename"]
+    columns = {col["name"]: col for col in info["columns"]}
+    assert columns["ra_cent"]["type"] == "REAL"
+    assert columns["band"]["values"] == sorted(bands)
+    assert "values" not in columns["filename"]
+
+    lines = catalogue.describe_table(cat, "Y6A2_IMAGE")
+    assert lines[0].startswith("Y6A2_IMAGE")
+    assert any(line.startswith("BAND") for line in lines)
+    assert catalogue.list_tables(cat, "y6a2_*_geom")[0].startswith(
+        "Y6A2_COADDTILE_GEOM"
+    )
+
+
+def test_catalogue_is_cached_per_snapshot(metadata_db, monkeypatch):
+    catalogue.load_catalogue()
+
+    # a cached catalogue never touches the DB
+    def _fail():
+        raise AssertionError("the metadata DB was opened")
+
+    with monkeypatch.context() as m:
+        m.setattr(catalogue, "connect_des_archive_access_db", _fail)
+        assert "y6a2_image" in catalogue.load_catalogue()
+
+    # a new snapshot of the metadata DB is catalogued again
+    conn = sqlite3.connect(metadata_db)
+    conn.execute("create table y6a2_new (x integer)")
+    conn.commit()
+    conn.close()
+    st = os.stat(metadata_db)
+    os.utime(metadata_db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    assert "y6a2_new" in catalogue.load_catalogue()
+
+
+def test_schema_completer(metadata_db):
+    completer = catalogue.get_schema_completer(catalogue.load_catalogue())
+    assert "y6a2_image" in _completions(completer, "select * from y6a2_im")
+    assert _completions(completer, "select * from y6a2_image where til") == ["tilename"]
+    assert _completions(completer, "select y6a2_image.ra_c") == ["ra_cent"]
+    assert "r" in _completions(completer, "select * from y6a2_image where band = '")
+    assert "select" in _completions(completer, "sel")
+
+
+def test_repl_describe_and_tables(metadata_db):
+    runner = CliRunner()
+    res = runner.invoke(cli, ["describe", "y6a2_file_archive_info"])
+    assert res.exit_code == 0, res.output
+    assert "ARCHIVE_NAME" in res.output
+
+    res = runner.invoke(cli, ["tables"])
+    assert res.exit_code == 0, res.output
+    assert "Y6A2_IMAGE" in res.output
+
+    res = runner.invoke(cli, ["describe", "not_a_table"])
+    assert res.exit_code != 0
+    assert "not_a_table" in res.output
+
+
+def test_catalogue_scans_each_table_once(metadata_db):
+    conn = sqlite3.connect(metadata_db)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        cat = catalogue.extract_catalogue(conn)
+    finally:
+        conn.close()
+
+    # one scan for each table with unindexed low-cardinality columns
+    scans = [
+        re.search(r'from "(\w+)"', sql).group(1)
+        for sql in statements
+        if sql.startswith("select distinct")
+    ]
+    assert sorted(scans) == [
+        "y6a2_coaddtile_geom",
+        "y6a2_file_archive_info",
+        "y6a2_image",
+    ]
+    columns = {col["name"]: col for col in cat["y6a2_image"]["columns"]}
+    assert "values" in columns["filetype"]
+    assert "values" in columns["crossra0"]
+
+
+def test_catalogue_built_in_background(metadata_db):
+    completer = catalogue.get_schema_completer()
+    assert _completions(completer, "select * from y6a2_im") == []
+
+    thread = catalogue.build_catalogue_in_background(completer.set_catalogue)
+    thread.join()
+    assert "y6a2_image" in _completions(completer, "select * from y6a2_im")
+
+
+@pytest.mark.parametrize("make_metadata_db", [lambda path: None])
+def test_repl_without_db(metadata_db):
+    assert not os.path.exists(metadata_db)
+    runner = CliRunner()
+
+    res = runner.invoke(cli, [], input="\n")
+    assert res.exit_code == 0, res.output
+
+    res = runner.invoke(cli, ["tables"])
+    assert res.exit_code == 1
+    assert "does not exist" in res.output
+    assert not isinstance(res.exception, FileNotFoundError)
@@ -0,0 +1,199 @@
+import contextlib
+import functools
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from des_archive_access.daemon import (
+    DaemonCursor,
+    DaemonNotRunningError,
+    QueryDaemon,
+    daemon_is_running,
+    decode_batch,
+    encode_batch,
+    get_serving_version,
+)
+from des_archive_access.dbfiles import get_des_archive_access_db_conn
+from des_archive_access.sql import execute_query
+from des_archive_access.testing.synthetic_db import make_synthetic_metadata_db
+
+
+@pytest.fixture
+def make_metadata_db():
+    return functools.partial(make_synthetic_metadata_db, nexp=2, nccd=10)
+
+
+@contextlib.contextmanager
+def _running_daemon(timeout=10):
+    daemon = QueryDaemon(idle_timeout=0)
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    try:
+        t0 = time.time()
+        while not daemon_is_running(daemon.socket_path):
+            if not thread.is_alive() or time.time() - t0 > timeout:
+                pytest.fail("The query daemon did not start!")
+            time.sleep(0.01)
+        yield daemon
+    finally:
+        daemon.shutdown()
+        thread.join(timeout)
+
+
+@pytest.fixture
+def query_daemon(metadata_db, monkeypatch):
+    monkeypatch.delenv("DES_ARCHIVE_ACCESS_DAEMON")
+    with _running_daemon() as daemon:
+        yield daemon
+
+
+def test_daemon_encode_decode_batch():
+    rows = [
+        (1, 1.5, "a", b"\x00\x01", None, 1),
+        (None, None, None, None, None, "b"),
+        (3, 2.5, "ü", b"", None, 2.5),
+    ]
+    columns = decode_batch(encode_batch(rows, 6))
+    assert list(zip(*columns)) == rows
+    assert decode_batch(encode_batch([], 3)) == [[], [], []]
+
+
+def test_daemon_query(query_daemon):
+    sql = "select filename, expnum, ra_cent, tilename from y6a2_image order by filename"
+
+    curr = execute_query(sql)
+    assert isinstance(curr, DaemonCursor)
+    assert [d[0] for d in curr.description] == [
+        "filename",
+        "expnum",
+        "ra_cent",
+        "tilename",
+    ]
+    first = curr.fetchmany(3)
+    rows = first + curr.fetchall()
+    curr.close()
+
+    local = get_des_archive_access_db_conn().execute(sql).fetchall()
+    assert rows == local
+
+    curr = execute_query(sql)
+    cols = curr.fetch_columns()
+    assert cols["filename"] == [r[0] for r in local]
+    assert cols["expnum"] == [r[1] for r in local]
+
+
+def test_daemon_query_closed_early(query_daemon):
+    for _ in range(10):
+        curr = execute_query("select * from y6a2_image")
+        assert len(curr.fetchmany(2)) == 2
+        curr.close()
+    assert len(execute_query("select * from y6a2_image").fetchall()) > 0
+
+
+def test_daemon_query_error(query_daemon):
+    with pytest.raises(sqlite3.OperationalError, match="no such column"):
+        execute_query("select blah from y6a2_image")
+
+
+def test_daemon_off(query_daemon, monkeypatch):
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DAEMON", "off")
+    curr = execute_query("select count(*) from y6a2_image")
+    assert isinstance(curr, sqlite3.Cursor)
+
+
+def test_daemon_db_mismatch(query_daemon, tmpdir, monkeypatch):
+    dbloc = make_synthetic_metadata_db(os.path.join(tmpdir, "other.db"), nexp=1, nccd=1)
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DB", dbloc)
+    get_des_archive_access_db_conn.cache_clear()
+    curr = execute_query("select count(*) from y6a2_image")
+    assert isinstance(curr, sqlite3.Cursor)
+    assert curr.fetchall() == [(3,)]
+
+
+def test_daemon_db_replaced(query_daemon, tmpdir):
+    def _count_on_disk():
+        conn = sqlite3.connect(os.environ["DES_ARCHIVE_ACCESS_DB"])
+        try:
+            return conn.execute("select count(*) from y6a2_image").fetchall()
+        finally:
+            conn.close()
+
+    sql = "select count(*) from y6a2_image"
+    assert execute_query(sql).fetchall() == _count_on_disk()
+
+    # a new download replaces the DB at the same location
+    new_dbloc = make_synthetic_metadata_db(
+        os.path.join(tmpdir, "new.db"), nexp=1, nccd=1
+    )
+    os.replace(new_dbloc, os.environ["DES_ARCHIVE_ACCESS_DB"])
+
+    curr = execute_query(sql)
+    assert isinstance(curr, DaemonCursor)
+    assert curr.fetchall() == _count_on_disk() == [(3,)]
+    assert query_daemon.status()["version"] == get_serving_version()
+
+
+def test_daemon_side_dbs_built_after_start(query_daemon):
+    from des_archive_access.joins import build_joins
+    from des_archive_access.spatial import build_spatial_index
+
+    # the daemon's connections were opened before the side DBs existed
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        execute_query("select count(*) from image_paths")
+
+    build_joins()
+    build_spatial_index()
+    curr = execute_query("select count(*) from image_paths")
+    assert isinstance(curr, DaemonCursor)
+    assert curr.fetchall()[0][0] > 0
+    curr = execute_query("select count(*) from spatial.image_rtree")
+    assert isinstance(curr, DaemonCursor)
+    assert curr.fetchall()[0][0] > 0
+
+
+def test_daemon_snapshot_switched(metadata_db, tmpdir, monkeypatch):
+    shared = os.path.join(tmpdir, "shared")
+    for name, nexp in [("s1", 1), ("s2", 2)]:
+        os.makedirs(os.path.join(shared, "snapshots", name))
+        make_synthetic_metadata_db(
+            os.path.join(shared, "snapshots", name, "metadata.db"), nexp=nexp, nccd=1
+        )
+    os.symlink(os.path.join("snapshots", "s1"), os.path.join(shared, "current"))
+    monkeypatch.delenv("DES_ARCHIVE_ACCESS_DB")
+    monkeypatch.delenv("DES_ARCHIVE_ACCESS_DAEMON")
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_SHARED_DIR", shared)
+
+    sql = "select count(*) from y6a2_image"
+    with _running_daemon() as daemon:
+        curr = execute_query(sql)
+        assert isinstance(curr, DaemonCursor)
+        assert curr.fetchall() == [(3,)]
+        assert daemon.status()["db"].endswith(
+            os.path.join("snapshots", "s1", "metadata.db")
+        )
+
+        # a new snapshot is made current while the daemon is running
+        tmp = os.path.join(shared, "current.tmp")
+        os.symlink(os.path.join("snapshots", "s2"), tmp)
+        os.replace(tmp, os.path.join(shared, "current"))
+
+        curr = execute_query(sql)
+        assert isinstance(curr, DaemonCursor)
+        assert curr.fetchall() == [(6,)]
+        assert daemon.status()["db"].endswith(
+            os.path.join("snapshots", "s2", "metadata.db")
+        )
+
+
+def test_daemon_mismatch_does_not_keep_it_alive(query_daemon, tmpdir, monkeypatch):
+    execute_query("select count(*) from y6a2_image").fetchall()
+    last_active = query_daemon._last_active
+
+    dbloc = make_synthetic_metadata_db(os.path.join(tmpdir, "other.db"), nexp=1, nccd=1)
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DB", dbloc)
+    with pytest.raises(DaemonNotRunningError):
+        DaemonCursor("select count(*) from y6a2_image")
+    assert query_daemon._last_active == last_active
@@ -0,0 +1,138 @@
+import json
+import os
+import sqlite3
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+
+from des_archive_access import joins
+from des_archive_access.dbfiles import connect_des_archive_access_db
+from des_archive_access.repl import cli
+
+DIRECT_QUERY = """\
+select i.filename, fai.path || '/' || fai.filename || coalesce(fai.compression, '')
+from y6a2_image i
+join y6a2_file_archive_info fai on fai.filename = i.filename
+where fai.archive_name = 'desar2home' and i.band = 'r' and i.filetype = 'red_immask'
+order by i.filename
+"""
+
+
+def test_joins_build_and_attach(metadata_db):
+    conn = connect_des_archive_access_db()
+    try:
+        expected = conn.execute(DIRECT_QUERY).fetchall()
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("select * from image_paths")
+    finally:
+        conn.close()
+    assert len(expected) > 0
+    assert not joins.joins_are_current()
+
+    path = joins.build_joins()
+    assert path == joins.get_joins_db_path()
+    assert joins.joins_are_current()
+
+    conn = connect_des_archive_access_db()
+    try:
+        got = conn.execute(
+            "select filename, archive_path from image_paths "
+            "where band = 'r' and filetype = 'red_immask' order by filename"
+        ).fetchall()
+        plan = " ".join(
+            row[-1]
+            for row in conn.execute(
+                "explain query plan select * from image_paths where band = 'r'"
+            )
+        )
+        nfiles = conn.execute("select count(*) from joins.file_paths").fetchone()[0]
+    finally:
+        conn.close()
+    assert got == expected
+    assert "USING INDEX" in plan
+    assert nfiles > 0
+
+
+def test_joins_refresh_when_stale(metadata_db):
+    joins.build_joins()
+    assert not joins.refresh_joins()
+
+    # a new snapshot of the metadata DB makes the tables stale
+    conn = sqlite3.connect(metadata_db)
+    conn.execute("delete from y6a2_image where band = 'g'")
+    conn.commit()
+    conn.close()
+    st = os.stat(metadata_db)
+    os.utime(metadata_db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    assert joins.joins_are_stale()
+    conn = connect_des_archive_access_db()
+    try:
+        assert conn.execute("select * from sqlite_temp_master").fetchall() == []
+    finally:
+        conn.close()
+
+    assert joins.refresh_joins()
+    assert joins.joins_are_current()
+    conn = connect_des_archive_access_db()
+    try:
+        nrows = conn.execute(
+            "select count(*) from image_paths where band = 'g'"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert nrows == 0
+
+
+def test_joins_rebuilt_by_download_not_queries(metadata_db):
+    joins.build_joins()
+    st = os.stat(metadata_db)
+    os.utime(metadata_db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    # queries fall back to the plain tables instead of waiting for a rebuild
+    res = CliRunner().invoke(cli, ["-c", "select count(*) from y6a2_image"])
+    assert res.exit_code == 0, res.output
+    assert "were built from another metadata DB" in res.output
+    assert joins.joins_are_stale()
+
+    res = subprocess.run(
+        ["des-archive-access-download-metadata"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert "rebuilding the materialised joins" in res.stderr
+    assert joins.joins_are_current()
+
+
+def test_joins_declared_in_json(metadata_db):
+    daad = os.environ["DES_ARCHIVE_ACCESS_DIR"]
+    os.makedirs(daad, exist_ok=True)
+    with open(os.path.join(daad, "joins.json"), "w") as fp:
+        json.dump(
+            {
+                "tile_images": {
+                    "sql": (
+                        "select t.tilename, i.filename from y6a2_coaddtile_geom t "
+                        "join y6a2_image i on i.tilename = t.tilename"
+                    ),
+                    "indexes": [["tilename"]],
+                },
+            },
+            fp,
+        )
+    assert joins.joins_are_stale() is False
+    joins.build_joins()
+
+    conn = connect_des_archive_access_db()
+    try:
+        tilename = conn.execute("select tilename from tile_images limit 1").fetchone()
+    finally:
+        conn.close()
+    assert tilename is not None
+
+    with open(os.path.join(daad, "joins.json"), "w") as fp:
+        json.dump({"bad name": {"sql": "select 1"}}, fp)
+    with pytest.raises(RuntimeError, match="not a valid table name"):
+        joins.get_join_declarations()
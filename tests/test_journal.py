@@ -0,0 +1,137 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from des_archive_access.journal import (
+    Journal,
+    get_shard,
+    merge_journals,
+    parse_shard,
+    shard_paths,
+)
+from des_archive_access.testing.archive_server import (
+    MockArchiveServer,
+    make_mock_archive,
+)
+
+PATHS = [
+    "OPS/finalcut/Y6A1/20181129-r4056/D%08d/p01/red/immask/"
+    "D%08d_r_c%02d_r4056p01_immasked.fits.fz" % (expnum, expnum, ccdnum)
+    for expnum in range(797980, 797984)
+    for ccdnum in range(1, 4)
+]
+
+
+def test_parse_shard():
+    assert parse_shard("3/10") == (3, 10)
+    for bad in ["10/10", "-1/3", "1", "a/b", "0/0"]:
+        with pytest.raises(ValueError):
+            parse_shard(bad)
+
+
+def test_shard_paths_partition():
+    shards = [shard_paths(PATHS, i, 3) for i in range(3)]
+    assert sorted(sum(shards, [])) == sorted(PATHS)
+    # the hash is stable across runs and machines
+    assert get_shard(PATHS[0], 1000) == 42
+
+
+def test_merge_journals(tmpdir):
+    j0 = Journal(str(tmpdir), 0, 2)
+    j1 = Journal(str(tmpdir), 1, 2)
+    j0.record("a", "failed", 1.0, error="boom")
+    j0.record("a", "done", 1.0, nbytes=10)
+    j1.record("b", "failed", 1.0, error="boom")
+    j1.record("c", "done", 1.0, nbytes=5)
+    # a task killed mid-write leaves a partial line
+    with open(j1.path, "a") as fp:
+        fp.write('{"path": "d", "sta')
+
+    assert j0.done_paths() == {"a"}
+    report = merge_journals(str(tmpdir), paths=["a", "b", "c", "d"])
+    assert report["shards"] == 2
+    assert report["done"] == ["a", "c"]
+    assert report["failed"] == ["b"]
+    assert report["pending"] == ["d"]
+    assert report["errors"] == {"b": "boom"}
+    assert report["bytes"] == 15
+
+
+def test_download_sharded_list_with_journal(tmpdir):
+    root = os.path.join(tmpdir, "archive")
+    make_mock_archive(root, PATHS[1:], size=1000)
+    daad = os.path.join(tmpdir, "daad")
+    os.makedirs(daad)
+    with open(os.path.join(daad, "bearer_token"), "w") as fp:
+        fp.write("abc123")
+    env = dict(os.environ, DES_ARCHIVE_ACCESS_DIR=daad)
+
+    list_file = os.path.join(tmpdir, "files.txt")
+    with open(list_file, "w") as fp:
+        fp.write("\n".join(PATHS) + "\n")
+
+    journal = os.path.join(tmpdir, "journal")
+    desdata = os.path.join(tmpdir, "DESDATA")
+    failing_shard = get_shard(PATHS[0], 3)
+    with MockArchiveServer(root, token="abc123") as server:
+
+        def _run(shard):
+            return subprocess.run(
+                [
+                    "des-archive-access-download",
+                    "--no-refresh-token",
+                    "-a",
+                    server.url,
+                    "-d",
+                    desdata,
+                    "--list",
+                    list_file,
+                    "--shard",
+                    shard,
+                    "--journal",
+                    journal,
+                ],
+                capture_output=True,
+                text=True,
+                env=env,
+            )
+
+        for i in range(3):
+            res = _run(f"{i}/3")
+            # the missing file fails its shard but the others are downloaded
+            assert res.returncode == (1 if i == failing_shard else 0), res.stderr
+
+        # rerunning a shard skips the files that are done
+        nreq = server.stats["requests"]
+        res = _run(f"{failing_shard}/3")
+        assert res.returncode == 1
+        assert server.stats["requests"] == nreq + 1
+
+    for pth in PATHS[1:]:
+        assert os.path.exists(os.path.join(desdata, pth))
+
+    retry_list = os.path.join(tmpdir, "retry.txt")
+    res = subprocess.run(
+        [
+            "des-archive-access-download-report",
+            journal,
+            "--list",
+            list_file,
+            "--json",
+            "--retry-list",
+            retry_list,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert res.returncode == 1
+    report = json.loads(res.stdout)
+    assert report["shards"] == 3
+    assert report["done"] == sorted(PATHS[1:])
+    assert report["failed"] == [PATHS[0]]
+    assert report["pending"] == []
+    assert report["bytes"] == 1000 * (len(PATHS) - 1)
+    with open(retry_list) as fp:
+        assert fp.read().split() == [PATHS[0]]
@@ -0,0 +1,112 @@
+import os
+import random
+import sqlite3
+import subprocess
+
+import pytest
+
+from des_archive_access.dbfiles import get_des_archive_access_db_conn
+from des_archive_access.seekable import (
+    SeekableZstdReader,
+    is_seekable_zstd,
+    make_seekable_db,
+)
+from des_archive_access.sql import parse_and_execute_query
+from des_archive_access.testing.synthetic_db import make_synthetic_metadata_db
+
+
+def test_seekable_reader(tmpdir):
+    rng = random.Random(10)
+    data = bytes(rng.randrange(4) for _ in range(100_000))
+    src = os.path.join(tmpdir, "data.bin")
+    with open(src, "wb") as fp:
+        fp.write(data)
+
+    dst = os.path.join(tmpdir, "data.bin.zst")
+    make_seekable_db(src, dst, frame_size=4096)
+    assert is_seekable_zstd(dst)
+    assert not is_seekable_zstd(src)
+
+    # the cache only holds two frames
+    reader = SeekableZstdReader(dst, cache_size_mb=8192 / 1024 / 1024)
+    try:
+        assert reader.size == len(data)
+        for _ in range(100):
+            offset = rng.randrange(len(data))
+            size = rng.randrange(1, 20_000)
+            assert reader.read(size, offset) == data[offset : offset + size]
+        assert reader.read(10, len(data)) == b""
+        assert len(reader._cache) <= 2
+        assert reader.misses > 0 and reader.hits > 0
+    finally:
+        reader.close()
+
+
+@pytest.fixture
+def make_metadata_db(tmpdir):
+    def _make(dbloc):
+        pytest.importorskip("apsw")
+        raw = make_synthetic_metadata_db(os.path.join(tmpdir, "raw.db"), nexp=5)
+        make_seekable_db(raw, dbloc + ".zst", frame_size=16 * 1024)
+
+    return _make
+
+
+@pytest.fixture
+def seekable_db(metadata_db, tmpdir):
+    """The raw DB behind the seekable metadata DB."""
+    return os.path.join(tmpdir, "raw.db")
+
+
+def test_seekable_db_query(seekable_db, capsys):
+    sql = (
+        "select i.filename, fai.path from y6a2_image i, y6a2_file_archive_info fai "
+        "where i.filename = fai.filename and i.band = 'r' order by i.filename"
+    )
+    conn = sqlite3.connect(seekable_db)
+    try:
+        expected = conn.execute(sql).fetchall()
+        nrows = conn.execute("select count(*) from y6a2_image").fetchone()[0]
+    finally:
+        conn.close()
+    assert get_des_archive_access_db_conn().execute(sql).fetchall() == expected
+
+    parse_and_execute_query("select count(*) as n from y6a2_image")
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[2].split() == ["n"]
+    assert lines[3].split() == [str(nrows)]
+
+    with pytest.raises(sqlite3.OperationalError):
+        get_des_archive_access_db_conn().execute("select * from not_a_table")
+
+
+def test_download_metadata_seekable(tmpdir, monkeypatch):
+    pytest.importorskip("apsw")
+
+    raw = make_synthetic_metadata_db(os.path.join(tmpdir, "raw.db"), nexp=2)
+    mloc = os.path.join(tmpdir, "daad", "metadata.db")
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DB", mloc)
+    subprocess.run(
+        [
+            "des-archive-access-download-metadata",
+            "--seekable",
+            "--url",
+            "file://" + raw,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    assert not os.path.exists(mloc)
+    assert is_seekable_zstd(mloc + ".zst")
+
+    # a second run finds the seekable DB
+    res = subprocess.run(
+        ["des-archive-access-download-metadata", "--url", "file://" + raw],
+        check=True,
+        capture_output=True,
+    )
+    assert res.stdout == b""
+    assert sorted(os.listdir(os.path.join(tmpdir, "daad"))) == [
+        "metadata.db.lock",
+        "metadata.db.zst",
+    ]
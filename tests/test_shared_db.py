@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import stat
+import subprocess
+
+import pytest
+import zstandard
+
+from des_archive_access import cli
+from des_archive_access.dbfiles import get_des_archive_access_db
+
+
+def _make_db(path, value):
+    conn = sqlite3.connect(path)
+    conn.execute("create table info (value text)")
+    conn.execute("insert into info values (?)", (value,))
+    conn.commit()
+    conn.close()
+
+    with open(path, "rb") as ifh, open(path + ".zst", "wb") as ofh:
+        zstandard.ZstdCompressor().copy_stream(ifh, ofh)
+    return "file://" + path + ".zst"
+
+
+def _read_db(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("select value from info").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def shared_env(tmpdir, monkeypatch):
+    monkeypatch.delenv("DES_ARCHIVE_ACCESS_DB", raising=False)
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_SHARED_DIR", os.path.join(tmpdir, "shared"))
+    yield os.environ.copy()
+
+
+def test_shared_db_single_flight(tmpdir, shared_env):
+    url = _make_db(os.path.join(tmpdir, "v1.db"), "v1")
+
+    procs = [
+        subprocess.Popen(
+            ["des-archive-access-download-metadata", "--url", url],
+            env=shared_env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for _ in range(4)
+    ]
+    outs = [proc.communicate() for proc in procs]
+    assert all(proc.returncode == 0 for proc in procs)
+    # only one process decompressed the DB
+    assert sum("decompressing" in out.decode("utf-8") for out, _ in outs) == 1
+
+    shared = os.path.join(tmpdir, "shared")
+    snapshots = os.listdir(os.path.join(shared, "snapshots"))
+    assert len(snapshots) == 1
+    assert get_des_archive_access_db() == os.path.join(
+        os.path.realpath(shared), "snapshots", snapshots[0], "metadata.db"
+    )
+    assert _read_db(get_des_archive_access_db()) == "v1"
+
+
+def test_shared_db_switch_snapshot_and_prune(tmpdir, shared_env):
+    url1 = _make_db(os.path.join(tmpdir, "v1.db"), "v1")
+    url2 = _make_db(os.path.join(tmpdir, "v2.db"), "v2")
+
+    subprocess.run(
+        ["des-archive-access-download-metadata", "--url", url1, "--snapshot", "s1"],
+        env=shared_env,
+        check=True,
+        capture_output=True,
+    )
+    old_db = get_des_archive_access_db()
+    assert old_db.endswith(os.path.join("snapshots", "s1", "metadata.db"))
+
+    # a reader of the old snapshot keeps working after the switch
+    conn = sqlite3.connect(old_db)
+    subprocess.run(
+        ["des-archive-access-download-metadata", "--url", url2, "--snapshot", "s2"],
+        env=shared_env,
+        check=True,
+        capture_output=True,
+    )
+    assert _read_db(get_des_archive_access_db()) == "v2"
+    assert conn.execute("select value from info").fetchone()[0] == "v1"
+
+    subprocess.run(
+        ["des-archive-access-download-metadata", "--prune"],
+        env=shared_env,
+        check=True,
+        capture_output=True,
+    )
+    assert conn.execute("select value from info").fetchone()[0] == "v1"
+    conn.close()
+    assert os.listdir(os.path.join(tmpdir, "shared", "snapshots")) == ["s2"]
+    assert _read_db(get_des_archive_access_db()) == "v2"
+
+
+def test_shared_db_force_keeps_current(tmpdir, shared_env, monkeypatch):
+    shared = os.path.join(tmpdir, "shared")
+    url1 = _make_db(os.path.join(tmpdir, "v1.db"), "v1")
+    url2 = _make_db(os.path.join(tmpdir, "v2.db"), "v2")
+    cli._download_shared_metadata_db(shared, url1, "s1", False, False)
+
+    download = cli._download_metadata_db
+    seen = []
+
+    def _download(*args, **kwargs):
+        # the current snapshot stays readable for the whole download
+        seen.append(_read_db(get_des_archive_access_db()))
+        download(*args, **kwargs)
+        seen.append(_read_db(get_des_archive_access_db()))
+
+    monkeypatch.setattr(cli, "_download_metadata_db", _download)
+    cli._download_shared_metadata_db(shared, url2, "s1", True, False)
+
+    assert seen == ["v1", "v1"]
+    assert _read_db(get_des_archive_access_db()) == "v2"
+    assert os.listdir(os.path.join(shared, "snapshots")) == ["s1"]
+
+
+def test_shared_db_group_permissions(tmpdir, shared_env):
+    url = _make_db(os.path.join(tmpdir, "v1.db"), "v1")
+    subprocess.run(
+        ["des-archive-access-download-metadata", "--url", url],
+        env=shared_env,
+        check=True,
+        capture_output=True,
+        preexec_fn=lambda: os.umask(0o077),
+    )
+
+    shared = os.path.join(tmpdir, "shared")
+    db = get_des_archive_access_db()
+    for pth in [shared, os.path.join(shared, "snapshots"), os.path.dirname(db)]:
+        mode = os.stat(pth).st_mode
+        assert mode & stat.S_ISGID
+        assert mode & 0o070 == 0o070
+    for pth in [db, os.path.join(shared, ".lock")]:
+        assert os.stat(pth).st_mode & 0o060 == 0o060
+
+
+def test_download_metadata_concurrent_private(tmpdir, monkeypatch):
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_DB", os.path.join(tmpdir, "db", "m.db"))
+    url = _make_db(os.path.join(tmpdir, "v1.db"), "v1")
+
+    procs = [
+        subprocess.Popen(
+            ["des-archive-access-download-metadata", "--url", url],
+            env=os.environ.copy(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for _ in range(3)
+    ]
+    outs = [proc.communicate() for proc in procs]
+    assert all(proc.returncode == 0 for proc in procs)
+    assert sum("decompressing" in out.decode("utf-8") for out, _ in outs) == 1
+    # no partial files are left behind
+    assert sorted(os.listdir(os.path.join(tmpdir, "db"))) == ["m.db", "m.db.lock"]
+    assert _read_db(os.path.join(tmpdir, "db", "m.db")) == "v1"
@@ -0,0 +1,128 @@
+import functools
+import sqlite3
+import subprocess
+
+import pytest
+
+from des_archive_access import spatial
+from des_archive_access.dbfiles import get_des_archive_access_db_conn
+from des_archive_access.testing.synthetic_db import make_synthetic_metadata_db
+
+
+@pytest.fixture
+def make_metadata_db():
+    return functools.partial(make_synthetic_metadata_db, nexp=20)
+
+
+@pytest.fixture
+def spatial_db(metadata_db):
+    spatial.build_spatial_index()
+    return metadata_db
+
+
+def test_ang_sep():
+    assert spatial.ang_sep(10, 0, 11, 0) == pytest.approx(1)
+    assert spatial.ang_sep(359.5, 0, 0.5, 0) == pytest.approx(1)
+    assert spatial.ang_sep(0, 89.5, 180, 89.5) == pytest.approx(1)
+    assert spatial.in_cone(0.5, 0, 0, 0, 1) == 1
+    assert spatial.in_cone(1.5, 0, 0, 0, 1) == 0
+
+
+def test_footprint_boxes_crossra0():
+    boxes = spatial._footprint_boxes([359.8, 0.2, 0.2, 359.8], [-1, -1, 1, 1], "Y")
+    assert boxes == [(359.8, 360.0, -1, 1), (0.0, pytest.approx(0.2), -1, 1)]
+    boxes = spatial._cone_boxes(0.1, 0, 0.5)
+    assert len(boxes) == 2
+    assert boxes[0][:2] == (pytest.approx(359.6, abs=1e-3), 360.0)
+    assert boxes[1][:2] == (0.0, pytest.approx(0.6, abs=1e-3))
+
+
+def test_cone_matches_brute_force(spatial_db):
+    conn = sqlite3.connect(spatial_db)
+    try:
+        rows = conn.execute(
+            "select filename, rac1, rac2, rac3, rac4, decc1, decc2, decc3, decc4, "
+            "crossra0, ra_cent, dec_cent from y6a2_image"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    for row in rows[::500]:
+        ra, dec, radius = row[10] + 0.3, row[11] - 0.2, 0.5
+        expected = sorted(
+            {
+                r[0]
+                for r in rows
+                if min(
+                    spatial._box_sep(ra, dec, *box)
+                    for box in spatial._footprint_boxes(r[1:5], r[5:9], r[9])
+                )
+                <= radius
+            }
+        )
+        assert spatial.cone(ra, dec, radius) == expected
+
+    assert row[0] in spatial.cone(row[10], row[11], 0)
+
+
+def test_tiles_overlapping_and_paths(spatial_db):
+    conn = sqlite3.connect(spatial_db)
+    try:
+        tilename, ra, dec = conn.execute(
+            "select tilename, ra_cent, dec_cent from y6a2_coaddtile_geom limit 1"
+        ).fetchone()
+    finally:
+        conn.close()
+
+    assert spatial.tiles_overlapping(ra, dec) == [tilename]
+    paths = spatial.get_archive_paths(tilenames=[tilename])
+    assert len(paths) > 0
+    assert all(
+        pth.startswith(f"OPS/multiepoch/Y6A2/r4575/{tilename}/") for pth in paths
+    )
+
+
+def test_spatial_sql(spatial_db):
+    conn = get_des_archive_access_db_conn()
+    nimg = conn.execute(
+        "select count(*) from spatial.image_rtree r, y6a2_image i "
+        "where r.filename = i.filename and r.ra_max >= 0 and r.ra_min <= 360"
+    ).fetchone()[0]
+    assert nimg > 0
+    assert conn.execute("select ang_sep(0, 0, 0, 1)").fetchone()[0] == pytest.approx(1)
+
+
+def test_spatial_index_stale(spatial_db):
+    assert spatial.spatial_index_is_current()
+    make_synthetic_metadata_db(spatial_db, nexp=2, seed=5)
+    assert not spatial.spatial_index_is_current()
+    with pytest.raises(RuntimeError, match="out of date"):
+        spatial.cone(10, 0, 1)
+
+
+def test_cone_cli(spatial_db):
+    conn = sqlite3.connect(spatial_db)
+    try:
+        ra, dec = conn.execute(
+            "select ra_cent, dec_cent from y6a2_image where filetype = 'red_immask'"
+        ).fetchone()
+    finally:
+        conn.close()
+
+    res = subprocess.run(
+        [
+            "des-archive-access-cone",
+            "--filetype=red_immask",
+            "--paths",
+            "--",
+            str(ra),
+            str(dec),
+            "0.1",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    paths = res.stdout.splitlines()
+    assert len(paths) > 0
+    assert all("/red/immask/" in pth and pth.endswith(".fits.fz") for pth in paths)
@@ -0,0 +1,70 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from des_archive_access.sql import explain_query, parse_and_execute_query
+
+
+@pytest.fixture
+def make_metadata_db():
+    def _make(dbloc):
+        conn = sqlite3.connect(dbloc)
+        conn.execute("create table y6a2_image (band text, ccdnum int, filename text)")
+        conn.executemany(
+            "insert into y6a2_image values (?, ?, ?)",
+            [("r", i, "D%08d_r_c%02d_immasked.fits" % (i, i % 62)) for i in range(250)],
+        )
+        conn.commit()
+        conn.close()
+
+    return _make
+
+
+def test_print_table_single_page(metadata_db, capsys):
+    parse_and_execute_query("select band, ccdnum from y6a2_image limit 3")
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("found 3 rows in")
+    assert lines[2].split() == ["band", "ccdnum"]
+    assert [line.split() for line in lines[3:]] == [["r", "0"], ["r", "1"], ["r", "2"]]
+
+
+@pytest.mark.parametrize("count", [True, False])
+def test_print_table_streams_all_rows(metadata_db, capsys, count):
+    parse_and_execute_query("select ccdnum from y6a2_image", count=count)
+    out = capsys.readouterr().out
+    lines = [line.split() for line in out.splitlines() if line.strip()]
+    assert ["ccdnum"] in lines
+    assert ["249"] in lines
+    if count:
+        assert "found 250 rows in" in out
+    else:
+        assert "found" not in out
+
+
+def test_parse_and_execute_query_timing(metadata_db, capsys):
+    parse_and_execute_query("select band from y6a2_image limit 3", timing=True)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-1].startswith("timing: execute")
+    for phase in ["fetch", "convert", "write", "total"]:
+        assert phase in lines[-1]
+
+
+def test_explain_query_full_scan(metadata_db, capsys):
+    explain_query("select * from y6a2_image where ccdnum = 10")
+    out = capsys.readouterr().out
+    assert "SCAN y6a2_image  <-- full table scan" in out
+    assert "found 1 step that could use a better index" in out
+
+
+def test_slow_query_log(metadata_db, tmpdir, monkeypatch, capsys):
+    monkeypatch.setenv("DES_ARCHIVE_ACCESS_SLOW_QUERY_TIME", "0")
+    parse_and_execute_query("select count(*) from y6a2_image")
+
+    with open(os.path.join(tmpdir, "daad", "slow_queries.jsonl")) as fp:
+        records = [json.loads(line) for line in fp]
+    assert len(records) == 1
+    assert records[0]["sql"] == "select count(*) from y6a2_image"
+    assert records[0]["plan"] == ["SCAN y6a2_image"]
+    assert set(records[0]["timings"]) == {"execute", "fetch", "convert", "write"}
@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "module,heavy_modules",
+    [
+        ("des_archive_access.cli", ["requests", "zstandard", "tqdm"]),
+        (
+            "des_archive_access.repl",
+            ["click_repl", "prompt_toolkit", "fitsio", "numpy"],
+        ),
+    ],
+)
+def test_startup_lazy_imports(module, heavy_modules):
+    res = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys; import {module}; "
+            f"print(' '.join(m for m in {heavy_modules!r} if m in sys.modules))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert res.stdout.strip() == ""
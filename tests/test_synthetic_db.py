@@ -0,0 +1,44 @@
+import os
+import sqlite3
+
+from des_archive_access.testing.synthetic_db import make_synthetic_metadata_db
+
+
+def test_make_synthetic_metadata_db(tmpdir):
+    dbloc = make_synthetic_metadata_db(
+        os.path.join(tmpdir, "metadata.db"), nexp=3, nccd=4
+    )
+    conn = sqlite3.connect(dbloc)
+    try:
+        nse = conn.execute(
+            "select count(*) from y6a2_image where filetype != 'coadd'"
+        ).fetchone()[0]
+        assert nse == 3 * 4 * 2
+
+        ntiles = conn.execute("select count(*) from y6a2_coaddtile_geom").fetchone()[0]
+        ncoadd = conn.execute(
+            "select count(*) from y6a2_image where filetype = 'coadd'"
+        ).fetchone()[0]
+        assert ntiles > 0
+        assert ncoadd >= ntiles
+
+        # every image has a location in the archive
+        nmissing = conn.execute(
+            "select count(*) from y6a2_image i left join y6a2_file_archive_info fai "
+            "on i.filename = fai.filename where fai.path is null"
+        ).fetchone()[0]
+        assert nmissing == 0
+    finally:
+        conn.close()
+
+
+def test_make_synthetic_metadata_db_reproducible(tmpdir):
+    rows = []
+    for i in range(2):
+        dbloc = make_synthetic_metadata_db(
+            os.path.join(tmpdir, "metadata%d.db" % i), nexp=2, nccd=2
+        )
+        conn = sqlite3.connect(dbloc)
+        rows.append(conn.execute("select * from y6a2_image").fetchall())
+        conn.close()
+    assert rows[0] == rows[1]